@@ -17,6 +17,7 @@ WishList = get_model('commerce', 'WishList')
 Order = get_model('commerce', 'Order')
 OrderItem = get_model('commerce', 'OrderItem')
 Notification = get_model('commerce', 'Notification')
+Blob = get_model('commerce', 'Blob')
 
 
 # extend Product
@@ -49,6 +50,12 @@ class OrderExtend(admin.ModelAdmin):
     inlines = [OrderItemInline,]
 
 
+class BlobExtend(admin.ModelAdmin):
+    model = Blob
+    list_display = ('name', 'size', 'ref_count', 'create_date',)
+    readonly_fields = ('digest', 'name', 'size', 'ref_count',)
+
+
 admin.site.register(Bank)
 admin.site.register(PaymentBank)
 admin.site.register(DeliveryAddress)
@@ -63,3 +70,4 @@ admin.site.register(WishList)
 admin.site.register(Order, OrderExtend)
 admin.site.register(OrderItem)
 admin.site.register(Notification)
+admin.site.register(Blob, BlobExtend)
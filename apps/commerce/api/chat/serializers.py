@@ -2,8 +2,9 @@ import random
 import string
 
 from django.db import transaction
-from django.db.models import Q, Prefetch
+from django.db.models import Q, Prefetch, Manager
 from django.core.exceptions import ObjectDoesNotExist
+from django.contrib.contenttypes.models import ContentType
 from django.utils.translation import gettext_lazy as _
 
 from rest_framework import serializers
@@ -12,6 +13,7 @@ from utils.generals import get_model
 from apps.person.utils.auth import CurrentUserDefault
 from apps.commerce.api.base.serializers import ProductSerializer
 from apps.commerce.api.utils import handle_upload_attachment
+from apps.commerce.utils.generic import prefetch_generic_objects, get_generic_object
 
 Chat = get_model('commerce', 'Chat')
 ChatMessage = get_model('commerce', 'ChatMessage')
@@ -30,6 +32,14 @@ class ChatAttachmentSerializer(serializers.ModelSerializer):
         exclude = ('chat_message',)
 
 
+class ChatMessageListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        # resolve embeded objects for whole page at once
+        data = data.all() if isinstance(data, Manager) else data
+        data = prefetch_generic_objects(data)
+        return super().to_representation(data)
+
+
 class ChatMessageSerializer(serializers.ModelSerializer):
     user = serializers.HiddenField(default=CurrentUserDefault())
     is_creator = serializers.BooleanField(read_only=True)
@@ -37,6 +47,7 @@ class ChatMessageSerializer(serializers.ModelSerializer):
     chat_message_attachments = ChatAttachmentSerializer(many=True, read_only=True)
 
     class Meta:
+        list_serializer_class = ChatMessageListSerializer
         model = ChatMessage
         exclude = ('chat',)
 
@@ -51,9 +62,9 @@ class ChatMessageSerializer(serializers.ModelSerializer):
         ret['user_uuid'] = instance.user.uuid
 
         # content embeded?
-        if instance.object_id and instance.content_type:
-            model_name = instance.content_type.model
-            content_object = instance.content_object
+        if instance.object_id and instance.content_type_id:
+            model_name = ContentType.objects.get_for_id(instance.content_type_id).model
+            content_object = get_generic_object(instance)
 
             ret['model_name'] = model_name
 
@@ -76,7 +87,7 @@ class ChatMessageSerializer(serializers.ModelSerializer):
                         'shipping_cost': content_object.shipping_cost,
                         'total': content_object.product.price * content_object.quantity,
                         'order_uuid': content_object.order.uuid,
-                        'is_seller': content_object.product.user.id == user.id
+                        'is_seller': content_object.product.user_id == user.id
                     }
 
                     ret['product'] = {
@@ -83,10 +83,7 @@ class ChatApiView(viewsets.ViewSet):
 
     def list(self, request, format=None):
         context = {'request': request}
-        messages = ChatMessage.objects \
-            .prefetch_related(Prefetch('chat'), Prefetch('user'), Prefetch('content_type'), Prefetch('content_object')) \
-            .select_related('chat', 'user', 'content_type', 'content_object') \
-            .filter(chat__id=OuterRef('id'))
+        messages = ChatMessage.objects.filter(chat__id=OuterRef('id'))
 
         queryset = Chat.objects \
             .prefetch_related(Prefetch('user'), Prefetch('send_to_user', 'user__profile')) \
@@ -1,16 +1,32 @@
+from django.db.models import Manager
+from django.contrib.contenttypes.models import ContentType
+
 from rest_framework import serializers
 
 from utils.generals import get_model
+from apps.commerce.utils.generic import prefetch_generic_objects, get_generic_object
 
 Notification = get_model('commerce', 'Notification')
 
 
+class NotificationListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        data = data.all() if isinstance(data, Manager) else data
+        data = list(data)
+
+        # older notification without summary, resolve action objects at once
+        prefetch_generic_objects([item for item in data if item.object_summary is None],
+                                 field_name='action_object')
+        return super().to_representation(data)
+
+
 class NotificationSerializer(serializers.ModelSerializer):
-    chat_uuid = serializers.UUIDField(read_only=True)
+    chat_uuid = serializers.UUIDField(source='chat.uuid', read_only=True, default=None)
 
     class Meta:
+        list_serializer_class = NotificationListSerializer
         model = Notification
-        fields = '__all__'
+        exclude = ('object_summary',)
 
     def to_representation(self, instance):
         request = self.context.get('request')
@@ -18,22 +34,30 @@ class NotificationSerializer(serializers.ModelSerializer):
         ret['actor_uuid'] = instance.actor.uuid
         ret['recipient_uuid'] = instance.recipient.uuid
 
-        if instance.action_object_content_type and instance.action_object:
-            model_name = instance.action_object_content_type.model
-            action_object = instance.action_object
-
-            ret['model_name'] = model_name
-
-            # order item
-            if model_name == 'orderitem' and action_object:
-                ret['object'] = {
-                    'id': action_object.id,
-                    'uuid': action_object.uuid,
-                    'name': action_object.product.name,
-                    'price': action_object.product.price,
-                    'shipping_cost': action_object.shipping_cost,
-                    'is_creator': action_object.product.user.id == request.user.id,
-                    'product_uuid': action_object.product.uuid,
-                }
+        if not instance.action_object_content_type_id:
+            return ret
+
+        model_name = ContentType.objects.get_for_id(instance.action_object_content_type_id).model
+        ret['model_name'] = model_name
+
+        if instance.object_summary is not None:
+            summary = dict(instance.object_summary)
+            summary['is_creator'] = summary.pop('creator_id', None) == request.user.id
+            ret['object'] = summary
+            return ret
+
+        action_object = get_generic_object(instance, 'action_object')
+
+        # order item
+        if model_name == 'orderitem' and action_object:
+            ret['object'] = {
+                'id': action_object.id,
+                'uuid': action_object.uuid,
+                'name': action_object.product.name,
+                'price': action_object.product.price,
+                'shipping_cost': action_object.shipping_cost,
+                'is_creator': action_object.product.user_id == request.user.id,
+                'product_uuid': action_object.product.uuid,
+            }
 
         return ret
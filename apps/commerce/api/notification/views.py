@@ -1,36 +1,112 @@
-from django.db.models import Q, Prefetch, Subquery, OuterRef
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.utils.translation import gettext_lazy as _
 
 from rest_framework import viewsets, status as response_status
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.decorators import action
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.response import Response
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
 
 from utils.generals import get_model
+from apps.commerce.utils.counters import get_unread_count
+from apps.commerce.utils.push import get_push_metrics
 from apps.commerce.api.notification.serializers import NotificationSerializer
 
 Notification = get_model('commerce', 'Notification')
-OrderItem = get_model('commerce', 'OrderItem')
-ChatMessage = get_model('commerce', 'ChatMessage')
+
+
+class NotificationCursorPagination(CursorPagination):
+    """
+    Cursor on timestamp, served by (recipient, timestamp, uuid_id) index so page
+    cost not depend on how many notifications user has.
+    DRF build the cursor from the first ordering field only, rows with
+    the same timestamp as the cursor skipped by offset; uuid_id only
+    keep their order stable.
+    """
+    ordering = ('-timestamp', '-uuid_id',)
+    page_size = settings.NOTIFICATION_PER_PAGE
+    page_size_query_param = 'limit'
+    max_page_size = 100
 
 
 class NotificationApiView(viewsets.ViewSet):
+    """
+    GET
+    --------------
+        :cursor = optional, from navigate next / previous
+        :limit = optional
+
+    POST mark-read
+    --------------
+        {"all": true}
+        {"up_to": "notification uuid"}, the notification and all older
+        {"uuids": ["uuid", "uuid"]}
+    """
     lookup_field = 'uuid'
     permission_classes = (IsAuthenticated,)
 
     def list(self, request, format=None):
         context = {'request': request}
-
-        chat_message = ChatMessage.objects \
-            .filter(object_id=OuterRef('action_object_object_id'),
-                    content_type=OuterRef('action_object_content_type'))
+        paginator = NotificationCursorPagination()
 
         queryset = Notification.objects \
-            .prefetch_related(Prefetch('actor'), Prefetch('recipient'), Prefetch('action_object_content_type'),
-                              Prefetch('action_object')) \
-            .select_related('actor', 'recipient', 'action_object_content_type') \
-            .annotate(
-                chat_uuid=Subquery(chat_message.values('chat__uuid')[:1])
-            ) \
+            .select_related('actor', 'recipient', 'chat') \
             .filter(Q(recipient_id=request.user.id))
-        
-        serializer = NotificationSerializer(queryset, many=True, context=context)
-        return Response(serializer.data, status=response_status.HTTP_200_OK)
+
+        queryset_paginator = paginator.paginate_queryset(queryset, request)
+        serializer = NotificationSerializer(queryset_paginator, many=True, context=context)
+
+        response = dict()
+        response['per_page'] = paginator.page_size
+        response['navigate'] = {
+            'previous': paginator.get_previous_link(),
+            'next': paginator.get_next_link(),
+        }
+        response['results'] = serializer.data
+        return Response(response, status=response_status.HTTP_200_OK)
+
+    @action(methods=['get'], detail=False, permission_classes=[IsAuthenticated],
+            url_path='unread-count', url_name='view_unread_count')
+    def view_unread_count(self, request, format=None):
+        count = get_unread_count(request.user.id)
+        return Response({'unread': count}, status=response_status.HTTP_200_OK)
+
+    @action(methods=['get'], detail=False, permission_classes=[IsAdminUser],
+            url_path='push-metrics', url_name='view_push_metrics')
+    def view_push_metrics(self, request, format=None):
+        # push digest counters, staff only
+        return Response(get_push_metrics(), status=response_status.HTTP_200_OK)
+
+    @action(methods=['post'], detail=False, permission_classes=[IsAuthenticated],
+            url_path='mark-read', url_name='view_mark_read')
+    def view_mark_read(self, request, format=None):
+        queryset = Notification.objects.filter(recipient_id=request.user.id)
+        up_to = request.data.get('up_to')
+        uuids = request.data.get('uuids')
+
+        try:
+            if up_to:
+                # same order as the feed, (timestamp, uuid_id) desc
+                last = queryset.only('timestamp').get(uuid_id=up_to)
+                queryset = queryset.filter(Q(timestamp__lt=last.timestamp)
+                                           | Q(timestamp=last.timestamp, uuid_id__lte=last.uuid_id))
+            elif isinstance(uuids, list) and uuids:
+                queryset = queryset.filter(uuid_id__in=uuids)
+            elif not request.data.get('all'):
+                return Response({'detail': _("Params missing")}, status=response_status.HTTP_400_BAD_REQUEST)
+
+            # one UPDATE, counter adjusted by updated rows
+            updated = queryset.mark_all_as_read(recipient=request.user)
+        except ValidationError as e:
+            return Response({'detail': _(u" ".join(e.messages))}, status=response_status.HTTP_406_NOT_ACCEPTABLE)
+        except Notification.DoesNotExist:
+            raise NotFound()
+
+        response = {
+            'updated': updated,
+            'unread': get_unread_count(request.user.id)
+        }
+        return Response(response, status=response_status.HTTP_200_OK)
@@ -1,6 +1,3 @@
-import json
-import requests
-
 from django.conf import settings
 from django.db import transaction, IntegrityError
 from django.db.models import Prefetch, Subquery, OuterRef, F, Sum, Q
@@ -20,6 +17,9 @@ from rest_framework.pagination import LimitOffsetPagination
 
 from utils.generals import get_model
 from apps.commerce.utils.permissions import IsCreatorOrReject
+from apps.commerce.utils.broadcast import chat_message_broadcast_on_commit
+from apps.commerce.utils.push import queue_push_on_commit
+from apps.commerce.models.notification import order_item_summary
 from apps.commerce.api.transaction.serializers import (
     CartSerializer, CartItemSerializer, OrderSerializer,
     OrderDetailSerializer, SellProductSerializer,
@@ -73,27 +73,6 @@ def create_chat(order_item):
     return obj
 
 
-def send_push_notifcation(token):
-    serverToken = 'AAAAUASTcW0:APA91bHQXIbndckM3Pn8wC2xgAf-nPlSRQH8WCCC9VNkzUKxgdgiJ-vZ1lSL75X5HvsGEL5lCkRGfS6yQ8A3mrKd5RiLfAwC1HFpBIotUzDXSdweUHvA8Gwkqrt7CaJGf8wVBqqbSLxS'
-    headers = {
-        'Content-Type': 'application/json',
-        'Authorization': 'key=' + serverToken,
-    }
-
-    body = {
-        'notification': {
-            'title': 'Notifikasi Open Pe O',
-            'body': 'Ada orderan baru!',
-            'click_action': 'https://openpeo.com/tabs/tab2'
-        },
-        'to': token,
-        'priority': 'high',
-    }
-
-    response = requests.post("https://fcm.googleapis.com/fcm/send",headers = headers, data=json.dumps(body))
-    return response.status_code, response.json()
-
-
 class CartApiView(viewsets.ViewSet):
     lookup_field = 'uuid'
     permission_classes = (IsAuthenticated,)
@@ -312,12 +291,14 @@ class OrderApiView(viewsets.ViewSet):
                 "sellers": [1, 2, 3],
                 "carts": [1, 2, 3]
             }
+
+        `sellers_fcm_token` still sent by older client is ignored,
+        push go to fcm_token saved on seller account.
         """
         context = {'request': request}
         user = request.user
 
         sellers = request.data.get('sellers')
-        sellers_fcm_token = request.data.get('sellers_fcm_token')
         carts = request.data.get('carts')
 
         if not sellers or not carts:
@@ -368,17 +349,21 @@ class OrderApiView(viewsets.ViewSet):
                 print(e)
 
         # get order items accros all order
-        order_items_created = OrderItem.objects.filter(order__in=orders.values_list('id', flat=True))
+        order_items_created = OrderItem.objects \
+            .select_related('order', 'order__user', 'order__seller', 'product') \
+            .filter(order__in=orders.values_list('id', flat=True))
         for item in order_items_created:
+            # collect order item then create a chat
+            chat_obj = create_chat(item)
+
             # prepare notifications object
             content_type = ContentType.objects.get_for_model(item)
             notif = Notification(actor=item.order.user, recipient=item.order.seller, verb=NEW,
                                 action_object_content_type=content_type,
-                                action_object_object_id=item.id)
+                                action_object_object_id=item.id,
+                                chat=chat_obj, object_summary=order_item_summary(item))
             notifications.append(notif)
 
-            # collect order item then create a chat
-            chat_obj = create_chat(item)
             chat_msg = ChatMessage(chat=chat_obj, user=user, content_type=content_type, object_id=item.id,
                                    message=_("Hay saya memesan ini. Apakah masih ada?"))
             chat_messages.append(chat_msg)
@@ -387,9 +372,12 @@ class OrderApiView(viewsets.ViewSet):
         if notifications:
             try:
                 with transaction.atomic():
-                    Notification.objects.bulk_create(notifications, ignore_conflicts=False)
+                    Notification.objects.bulk_notify(notifications)
             except IntegrityError as e:
                 pass
+            else:
+                # push to sellers, coalesced into one digest per seller
+                queue_push_on_commit(set(item.recipient_id for item in notifications), NEW)
 
         # create chat messages
         if chat_messages:
@@ -398,11 +386,9 @@ class OrderApiView(viewsets.ViewSet):
                     ChatMessage.objects.bulk_create(chat_messages, ignore_conflicts=False)
             except IntegrityError as e:
                 pass
-
-        # send push notifications
-        for i, v in enumerate(sellers_fcm_token):
-            if v:
-                send_push_notifcation(v)
+            else:
+                # bulk_create not send post_save signal
+                chat_message_broadcast_on_commit([item.uuid for item in chat_messages])
 
         # mark cart as done
         carts = Cart.objects.filter(user_id=request.user.id)
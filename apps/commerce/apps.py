@@ -1,5 +1,5 @@
 from django.apps import AppConfig
-from django.db.models.signals import post_save, post_delete
+from django.db.models.signals import pre_save, post_save, post_delete
 
 
 class CommerceConfig(AppConfig):
@@ -9,14 +9,31 @@ class CommerceConfig(AppConfig):
         from utils.generals import get_model
         from apps.commerce.signals import (
             order_save_handler, cart_item_delete_handler,
-            order_item_save_handler, order_item_delete_handler
+            order_item_save_handler, order_item_delete_handler,
+            chat_save_handler, chat_message_save_handler,
+            attachment_pre_save_handler, attachment_delete_handler,
+            notification_save_handler,
+            notification_delete_handler
         )
 
         Order = get_model('commerce', 'Order')
         OrderItem = get_model('commerce', 'OrderItem')
         CartItem = get_model('commerce', 'CartItem')
+        Chat = get_model('commerce', 'Chat')
+        ChatMessage = get_model('commerce', 'ChatMessage')
+        ChatAttachment = get_model('commerce', 'ChatAttachment')
+        ProductAttachment = get_model('commerce', 'ProductAttachment')
+        Notification = get_model('commerce', 'Notification')
 
+        pre_save.connect(attachment_pre_save_handler, sender=ChatAttachment, dispatch_uid='chat_attachment_pre_save_signal')
+        pre_save.connect(attachment_pre_save_handler, sender=ProductAttachment, dispatch_uid='product_attachment_pre_save_signal')
         post_save.connect(order_save_handler, sender=Order, dispatch_uid='order_save_signal')
         post_save.connect(order_item_save_handler, sender=OrderItem, dispatch_uid='order_item_save_signal')
+        post_save.connect(chat_save_handler, sender=Chat, dispatch_uid='chat_save_signal')
+        post_save.connect(chat_message_save_handler, sender=ChatMessage, dispatch_uid='chat_message_save_signal')
+        post_save.connect(notification_save_handler, sender=Notification, dispatch_uid='notification_save_signal')
         post_delete.connect(cart_item_delete_handler, sender=CartItem, dispatch_uid='cart_item_delete_handler_signal')
         post_delete.connect(order_item_delete_handler, sender=OrderItem, dispatch_uid='order_item_delete_handler_signal')
+        post_delete.connect(attachment_delete_handler, sender=ChatAttachment, dispatch_uid='chat_attachment_delete_signal')
+        post_delete.connect(attachment_delete_handler, sender=ProductAttachment, dispatch_uid='product_attachment_delete_signal')
+        post_delete.connect(notification_delete_handler, sender=Notification, dispatch_uid='notification_delete_signal')
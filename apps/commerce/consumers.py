@@ -1,35 +1,72 @@
 import json
+import asyncio
 
-from django.contrib.auth import get_user_model
-from asgiref.sync import async_to_sync
+from urllib.parse import parse_qs
+
+from django.db.models import Q
+
+from django.conf import settings
+from asgiref.sync import sync_to_async
 
 from channels.db import database_sync_to_async
-from channels.generic.websocket import AsyncWebsocketConsumer, WebsocketConsumer
+from channels.exceptions import StopConsumer
+from channels.generic.http import AsyncHttpConsumer
+from channels.generic.websocket import AsyncWebsocketConsumer
 
 from utils.generals import get_model
+from apps.commerce.utils.broadcast import (
+    chat_group_name, user_group_name, notification_group_name
+)
+from apps.commerce.utils.events import read_events, parse_event_id
 
 User = get_model('person', 'User')
+Chat = get_model('commerce', 'Chat')
+
+
+@database_sync_to_async
+def get_chat_uuids(user):
+    chats = Chat.objects \
+        .filter(Q(user_id=user.id) | Q(send_to_user__id=user.id)) \
+        .values_list('uuid', flat=True)
+    return set(str(uuid) for uuid in chats)
+
+
+@database_sync_to_async
+def is_chat_member(user, chat_uuid):
+    return Chat.objects \
+        .filter(Q(uuid=chat_uuid), Q(user_id=user.id) | Q(send_to_user__id=user.id)) \
+        .exists()
 
 
 class ChatConsumer(AsyncWebsocketConsumer):
+    """
+    Saved messages of one chat, participant only. Message sent through
+    chat message API, never relayed from this socket.
+    """
     async def connect(self):
-        self.room_name = self.scope['url_route']['kwargs']['chat_uuid']
-        self.room_group_name = 'chat_%s' % self.room_name
+        self.room_name = str(self.scope['url_route']['kwargs']['chat_uuid'])
+        self.room_group_name = chat_group_name(self.room_name)
+        self.joined = False
 
-        if self.scope['user'].is_anonymous:
+        user = self.scope['user']
+        if user.is_anonymous or not await is_chat_member(user, self.room_name):
             # Reject the connection
             await self.close()
-        else:
-            # Accept connection
-            # Join room group
-            await self.channel_layer.group_add(
-                self.room_group_name,
-                self.channel_name
-            )
+            return
+
+        # Join room group
+        await self.channel_layer.group_add(
+            self.room_group_name,
+            self.channel_name
+        )
+        self.joined = True
 
-            await self.accept()
+        await self.accept()
 
     async def disconnect(self, close_code):
+        if not self.joined:
+            return
+
         # Leave room group
         await self.channel_layer.group_discard(
             self.room_group_name,
@@ -38,17 +75,10 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
     # Receive message from WebSocket
     async def receive(self, text_data):
-        text_data_json = json.loads(text_data)
-        message = text_data_json['message']
-
-        # Send message to room group
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'chat_message',
-                'message': message
-            }
-        )
+        # not persisted, would look like saved message to other participant
+        await self.send(text_data=json.dumps({
+            'detail': 'Send message with chat message API'
+        }))
 
     # Receive message from room group
     async def chat_message(self, event):
@@ -58,3 +88,262 @@ class ChatConsumer(AsyncWebsocketConsumer):
         await self.send(text_data=json.dumps({
             'message': message
         }))
+
+
+class NotificationConsumer(AsyncWebsocketConsumer):
+    """Only notifications of the connected user"""
+    async def connect(self):
+        user = self.scope['user']
+
+        if user.is_anonymous:
+            # Reject the connection
+            await self.close()
+            return
+
+        self.group_name = notification_group_name(user.uuid)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        if self.scope['user'].is_anonymous:
+            return
+
+        await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    # Receive notification from user group
+    async def notification_message(self, event):
+        notification = dict(event)
+        notification.pop('type')
+        notification.pop('event_ids', None)
+        await self.send(text_data=json.dumps(notification))
+
+
+class StreamConsumer(AsyncWebsocketConsumer):
+    """
+    One connection per user for all chats and notifications.
+
+    Frame from client:
+
+        {"action": "subscribe", "chat": "chat uuid"}
+        {"action": "unsubscribe", "chat": "chat uuid"}
+
+    Frame to client:
+
+        {"stream": "chat", "chat": "chat uuid", "message": {...}}
+        {"stream": "notification", "notification": {...}}
+        {"stream": "error", "detail": "string"}
+
+    Message sent through chat message API, saved then broadcast
+    to the chat group, never relayed from this socket.
+    """
+    async def connect(self):
+        user = self.scope['user']
+        self.chat_uuids = set()
+
+        if user.is_anonymous:
+            # Reject the connection
+            await self.close()
+            return
+
+        self.user_group_name = user_group_name(user.uuid)
+        self.notification_group_name = notification_group_name(user.uuid)
+        self.chat_uuids = await get_chat_uuids(user)
+
+        # Join user, notification and all chat groups
+        for group_name in self.get_group_names():
+            await self.channel_layer.group_add(group_name, self.channel_name)
+
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        if self.scope['user'].is_anonymous:
+            return
+
+        # Leave all groups
+        for group_name in self.get_group_names():
+            await self.channel_layer.group_discard(group_name, self.channel_name)
+
+    def get_group_names(self):
+        groups = [self.user_group_name, self.notification_group_name]
+        groups.extend(chat_group_name(uuid) for uuid in self.chat_uuids)
+        return groups
+
+    async def send_json(self, content):
+        await self.send(text_data=json.dumps(content))
+
+    async def join_chat(self, chat_uuid):
+        if chat_uuid not in self.chat_uuids:
+            self.chat_uuids.add(chat_uuid)
+            await self.channel_layer.group_add(chat_group_name(chat_uuid), self.channel_name)
+
+    # Receive frame from WebSocket, route by action
+    async def receive(self, text_data):
+        try:
+            content = json.loads(text_data)
+        except ValueError:
+            await self.send_json({'stream': 'error', 'detail': 'Invalid frame'})
+            return
+
+        action = content.get('action')
+        chat_uuid = str(content.get('chat', ''))
+
+        if action == 'subscribe':
+            # only participant can join the chat
+            if chat_uuid in self.chat_uuids or await is_chat_member(self.scope['user'], chat_uuid):
+                await self.join_chat(chat_uuid)
+            else:
+                await self.send_json({'stream': 'error', 'chat': chat_uuid, 'detail': 'Chat not found'})
+
+        elif action == 'unsubscribe':
+            if chat_uuid in self.chat_uuids:
+                self.chat_uuids.discard(chat_uuid)
+                await self.channel_layer.group_discard(chat_group_name(chat_uuid), self.channel_name)
+
+        elif action == 'message':
+            # not persisted, would look like saved message to other participant
+            await self.send_json({'stream': 'error', 'chat': chat_uuid,
+                                  'detail': 'Send message with chat message API'})
+
+        else:
+            await self.send_json({'stream': 'error', 'detail': 'Unknown action'})
+
+    # Receive message from room group
+    async def chat_message(self, event):
+        await self.send_json({
+            'stream': 'chat',
+            'chat': event.get('chat'),
+            'message': event['message']
+        })
+
+    # New chat created for this user
+    async def chat_join(self, event):
+        await self.join_chat(event['chat'])
+
+    # Receive notification from user group
+    async def notification_message(self, event):
+        notification = dict(event)
+        notification.pop('type')
+        notification.pop('event_ids', None)
+        await self.send_json({
+            'stream': 'notification',
+            'notification': notification
+        })
+
+
+class EventStreamConsumer(AsyncHttpConsumer):
+    """
+    Server-Sent Events for client can't keep a websocket.
+    Same events as `StreamConsumer`, one way only:
+
+        id: 1602999999999-0
+        event: chat | notification
+        data: {...}
+
+    Reconnect with `Last-Event-ID` header (or `last_event_id` param)
+    replay missed events still in the user event stream.
+    """
+    streaming = False
+    heartbeat = None
+    replayed_event_id = None
+
+    # Keep consumer open after handle(), closed by http.disconnect
+    async def http_request(self, message):
+        if 'body' in message:
+            self.body.append(message['body'])
+
+        if not message.get('more_body'):
+            await self.handle(b''.join(self.body))
+
+            if not self.streaming:
+                await self.disconnect()
+                raise StopConsumer()
+
+    async def handle(self, body):
+        user = self.scope['user']
+        if user.is_anonymous:
+            await self.send_response(401, b'Unauthorized', headers=[(b'Content-Type', b'text/plain')])
+            return
+
+        self.streaming = True
+        self.user_uuid = str(user.uuid)
+        self.last_event_id = self.get_last_event_id()
+        self.chat_uuids = await get_chat_uuids(user)
+
+        # Join before replay, duplicate skipped by event id
+        for group_name in self.get_group_names():
+            await self.channel_layer.group_add(group_name, self.channel_name)
+
+        await self.send_headers(headers=[
+            (b'Content-Type', b'text/event-stream'),
+            (b'Cache-Control', b'no-cache'),
+            (b'X-Accel-Buffering', b'no'),
+        ])
+        await self.send_body(b'retry: 3000\n\n', more_body=True)
+
+        if self.last_event_id:
+            events = await sync_to_async(read_events)(self.user_uuid, self.last_event_id)
+            for event_id, event, data in events:
+                await self.send_event(event, data, event_id)
+
+            # live event queued while joining may be replayed already
+            self.replayed_event_id = events[-1][0] if events else self.last_event_id
+
+        self.heartbeat = asyncio.ensure_future(self.send_heartbeat())
+
+    async def disconnect(self):
+        if self.heartbeat:
+            self.heartbeat.cancel()
+
+        if self.streaming:
+            for group_name in self.get_group_names():
+                await self.channel_layer.group_discard(group_name, self.channel_name)
+
+    def get_last_event_id(self):
+        headers = dict(self.scope.get('headers', []))
+        last_event_id = headers.get(b'last-event-id', b'').decode()
+
+        if not last_event_id:
+            query = parse_qs(self.scope.get('query_string', b'').decode())
+            last_event_id = query.get('last_event_id', [''])[0]
+        return last_event_id if parse_event_id(last_event_id) else None
+
+    def get_group_names(self):
+        groups = [user_group_name(self.user_uuid), notification_group_name(self.user_uuid)]
+        groups.extend(chat_group_name(uuid) for uuid in self.chat_uuids)
+        return groups
+
+    async def send_heartbeat(self):
+        # comment line, keep proxy from closing idle connection
+        while True:
+            await asyncio.sleep(settings.SSE_HEARTBEAT)
+            await self.send_body(b': ping\n\n', more_body=True)
+
+    async def send_event(self, event, data, event_id=None):
+        # already sent by replay, live events not compared each other
+        # so one arrive late still sent
+        if event_id and self.replayed_event_id \
+                and parse_event_id(event_id) <= parse_event_id(self.replayed_event_id):
+            return
+
+        frame = 'event: %s\ndata: %s\n\n' % (event, json.dumps(data))
+        if event_id:
+            frame = 'id: %s\n' % event_id + frame
+        await self.send_body(frame.encode(), more_body=True)
+
+    # Receive message from room group
+    async def chat_message(self, event):
+        event_id = event.get('event_ids', {}).get(self.user_uuid)
+        await self.send_event('chat', {'chat': event.get('chat'), 'message': event['message']}, event_id)
+
+    # New chat created for this user
+    async def chat_join(self, event):
+        if event['chat'] not in self.chat_uuids:
+            self.chat_uuids.add(event['chat'])
+            await self.channel_layer.group_add(chat_group_name(event['chat']), self.channel_name)
+
+    # Receive notification from user group
+    async def notification_message(self, event):
+        notification = dict(event)
+        notification.pop('type')
+        event_id = notification.pop('event_ids', {}).get(self.user_uuid)
+        await self.send_event('notification', notification, event_id)
@@ -4,6 +4,8 @@ from django.conf import settings
 from django.db import models
 from django.utils.translation import gettext_lazy as _
 
+from apps.commerce.utils.storage import attachment_storage
+
 
 class AbstractBank(models.Model):
     uuid = models.UUIDField(default=uuid.uuid4, editable=False)
@@ -113,7 +115,8 @@ class AbstractProductAttachment(models.Model):
     title = models.CharField(max_length=255)
     description = models.TextField(null=True, blank=True)
     attach_type = models.CharField(max_length=255, editable=False)
-    attach_file = models.FileField(upload_to=_UPLOAD_TO, max_length=500)
+    attach_file = models.FileField(upload_to=_UPLOAD_TO, storage=attachment_storage,
+                                   max_length=500)
 
     class Meta:
         abstract = True
@@ -126,6 +129,27 @@ class AbstractProductAttachment(models.Model):
         return self.title
 
 
+class AbstractBlob(models.Model):
+    """File stored by content hash, shared by many attachments"""
+    create_date = models.DateTimeField(auto_now_add=True, null=True)
+    update_date = models.DateTimeField(auto_now=True, null=True)
+
+    digest = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=500, db_index=True)
+    size = models.BigIntegerField(default=0)
+    ref_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        abstract = True
+        app_label = 'commerce'
+        ordering = ['-create_date']
+        verbose_name = _(u"Blob")
+        verbose_name_plural = _(u"Blobs")
+
+    def __str__(self):
+        return self.name
+
+
 class AbstractWishList(models.Model):
     uuid = models.UUIDField(default=uuid.uuid4, editable=False)
     date_created = models.DateTimeField(auto_now_add=True, null=True)
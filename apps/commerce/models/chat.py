@@ -6,6 +6,8 @@ from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from django.utils.translation import gettext_lazy as _
 
+from apps.commerce.utils.storage import attachment_storage
+
 
 class AbstractChat(models.Model):
     uuid = models.UUIDField(default=uuid.uuid4, editable=False)
@@ -72,7 +74,8 @@ class AbstractChatAttachment(models.Model):
     title = models.CharField(max_length=255)
     description = models.TextField(null=True, blank=True)
     attach_type = models.CharField(max_length=255, editable=False)
-    attach_file = models.FileField(upload_to=_UPLOAD_TO, max_length=500)
+    attach_file = models.FileField(upload_to=_UPLOAD_TO, storage=attachment_storage,
+                                   max_length=500)
 
     class Meta:
         abstract = True
@@ -132,3 +132,12 @@ if not is_model_registered('commerce', 'Notification'):
             db_table = 'commerce_notification'
 
     __all__.append('Notification')
+
+
+# 15
+if not is_model_registered('commerce', 'Blob'):
+    class Blob(AbstractBlob):
+        class Meta(AbstractBlob.Meta):
+            db_table = 'commerce_blob'
+
+    __all__.append('Blob')
@@ -1,19 +1,23 @@
 import uuid
 
+from collections import Counter
+
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
-from django.db import models
+from django.db import models, transaction
 from django.utils.translation import ugettext_lazy as _
 from django.template.defaultfilters import slugify
 
-from asgiref.sync import async_to_sync
-
-from channels.layers import get_channel_layer
-
 from utils.generals import get_model
 from apps.commerce.utils.constants import NOTIFICATION_TYPES
+from apps.commerce.utils.broadcast import notification_broadcast_on_commit
+from apps.commerce.utils.fanout import create_fanout_job
+from apps.commerce.tasks import notification_fanout
+from apps.commerce.utils.counters import (
+    incr_unread_count_on_commit, reset_unread_count
+)
 
 
 class NotificationQuerySet(models.query.QuerySet):
@@ -27,6 +31,21 @@ class NotificationQuerySet(models.query.QuerySet):
         """Return only read items in the current queryset"""
         return self.filter(unread=False)
 
+    def _change_unread(self, qs, unread, recipient=None):
+        """UPDATE then adjust counters after commit, rollback leave them as is"""
+        if recipient:
+            updated = qs.update(unread=unread)
+            if updated:
+                incr_unread_count_on_commit(recipient.id, updated if unread else -updated)
+            return updated
+
+        # recipients not known, their counters recounted on next read
+        recipient_ids = set(qs.order_by().values_list('recipient_id', flat=True).distinct())
+        updated = qs.update(unread=unread)
+        if updated:
+            transaction.on_commit(lambda: [reset_unread_count(user_id) for user_id in recipient_ids])
+        return updated
+
     def mark_all_as_read(self, recipient=None):
         """Mark as read any unread elements in the current queryset with
         optional filter by recipient first.
@@ -34,8 +53,7 @@ class NotificationQuerySet(models.query.QuerySet):
         qs = self.unread()
         if recipient:
             qs = qs.filter(recipient=recipient)
-
-        return qs.update(unread=False)
+        return self._change_unread(qs, False, recipient)
 
     def mark_all_as_unread(self, recipient=None):
         """Mark as unread any read elements in the current queryset with
@@ -44,13 +62,43 @@ class NotificationQuerySet(models.query.QuerySet):
         qs = self.read()
         if recipient:
             qs = qs.filter(recipient=recipient)
-
-        return qs.update(unread=True)
+        return self._change_unread(qs, True, recipient)
 
     def get_most_recent(self):
         """Returns the most recent unread elements in the queryset"""
         return self.unread()[:5]
 
+    def bulk_notify(self, notifications, key="notification", id_value=None, batch_size=500):
+        """Create many notifications at once then publish each to its
+        recipient group. bulk_create skip signals, so unread counter and
+        broadcast done here.
+        """
+        # same slug as save(), usernames of recipients not loaded read at once
+        missing = [item for item in notifications if not item.slug]
+        recipient_ids = set(item.recipient_id for item in missing
+                            if not self.model.recipient.is_cached(item))
+        usernames = dict()
+        if recipient_ids:
+            usernames = dict(get_user_model().objects
+                             .filter(id__in=recipient_ids)
+                             .values_list('id', 'username'))
+
+        for item in missing:
+            username = item.recipient.username if self.model.recipient.is_cached(item) \
+                else usernames.get(item.recipient_id)
+            item.slug = self.model.build_slug(username, item.uuid_id, item.verb)
+
+        created = self.bulk_create(notifications, batch_size=batch_size)
+
+        counts = Counter(item.recipient_id for item in created if item.unread)
+        for recipient_id, count in counts.items():
+            incr_unread_count_on_commit(recipient_id, count)
+
+        notification_broadcast_on_commit(
+            [item.uuid_id for item in created], key=key, id_value=id_value
+        )
+        return created
+
 
 class AbstractNotification(models.Model):
     """
@@ -90,6 +138,15 @@ class AbstractNotification(models.Model):
     action_object = GenericForeignKey(
         "action_object_content_type", "action_object_object_id"
     )
+    # denormalized, listing not need subquery or generic relation
+    chat = models.ForeignKey(
+        "commerce.Chat",
+        blank=True,
+        null=True,
+        related_name="notifications",
+        on_delete=models.SET_NULL,
+    )
+    object_summary = models.JSONField(null=True, blank=True)
     objects = NotificationQuerySet.as_manager()
 
     class Meta:
@@ -97,6 +154,19 @@ class AbstractNotification(models.Model):
         verbose_name = _("Notification")
         verbose_name_plural = _("Notifications")
         ordering = ("-timestamp",)
+        indexes = [
+            # keyset pagination of recipient notifications
+            models.Index(fields=["recipient", "timestamp", "uuid_id"],
+                         name="%(app_label)s_%(class)s_cursor"),
+            models.Index(fields=["recipient", "unread"],
+                         name="%(app_label)s_%(class)s_unread"),
+            # retention, see apps.commerce.utils.retention
+            models.Index(fields=["unread", "timestamp"],
+                         name="%(app_label)s_%(class)s_expire"),
+            models.Index(fields=["action_object_content_type", "action_object_object_id",
+                                 "recipient", "timestamp"],
+                         name="%(app_label)s_%(class)s_object"),
+        ]
 
     def __str__(self):
         if self.action_object:
@@ -104,9 +174,13 @@ class AbstractNotification(models.Model):
 
         return f"{self.actor} {self.get_verb_display()} {self.time_since()} ago"
 
+    @staticmethod
+    def build_slug(username, uuid_id, verb):
+        return slugify(f"{username} {uuid_id} {verb}")
+
     def save(self, *args, **kwargs):
         if not self.slug:
-            self.slug = slugify(f"{self.recipient} {self.uuid_id} {self.verb}")
+            self.slug = self.build_slug(self.recipient.username, self.uuid_id, self.verb)
 
         super().save(*args, **kwargs)
 
@@ -123,11 +197,27 @@ class AbstractNotification(models.Model):
         if self.unread:
             self.unread = False
             self.save()
+            incr_unread_count_on_commit(self.recipient_id, -1)
 
     def mark_as_unread(self):
         if not self.unread:
             self.unread = True
             self.save()
+            incr_unread_count_on_commit(self.recipient_id)
+
+
+def order_item_summary(order_item):
+    """Snapshot of the order item saved on notification as `object_summary`"""
+    product = order_item.product
+    return {
+        "id": order_item.id,
+        "uuid": str(order_item.uuid),
+        "name": product.name,
+        "price": product.price,
+        "shipping_cost": order_item.shipping_cost,
+        "product_uuid": str(product.uuid),
+        "creator_id": product.user_id,
+    }
 
 
 def notification_handler(actor, recipient, verb, **kwargs):
@@ -135,7 +225,7 @@ def notification_handler(actor, recipient, verb, **kwargs):
     Handler function to create a Notification instance.
     :requires:
     :param actor: User instance of that user who makes the action.
-    :param recipient: User instance, a list of User instances or string
+    :param recipient: User instance, a list of usernames or string
                       'global' defining who should be notified.
     :param verb: Notification attribute with the right choice from the list.
     :optional:
@@ -144,64 +234,28 @@ def notification_handler(actor, recipient, verb, **kwargs):
     :param id_value: UUID value assigned to a specific element in the DOM.
     """
     Notification = get_model('commerce', 'Notification')
+    User = get_user_model()
 
     key = kwargs.pop("key", "notification")
     id_value = kwargs.pop("id_value", None)
-    if recipient == "global":
-        users = get_user_model().objects.all().exclude(username=actor.username)
-        for user in users:
-            Notification.objects.create(
-                actor=actor,
-                recipient=user,
-                verb=verb,
-                action_object=kwargs.pop("action_object", None),
-            )
-        notification_broadcast(actor, key)
-
-    elif isinstance(recipient, list):
-        for user in recipient:
-            Notification.objects.create(
-                actor=actor,
-                recipient=get_user_model().objects.get(username=user),
-                verb=verb,
-                action_object=kwargs.pop("action_object", None),
-            )
-
-    elif isinstance(recipient, get_user_model()):
-        Notification.objects.create(
-            actor=actor,
-            recipient=recipient,
-            verb=verb,
-            action_object=kwargs.pop("action_object", None),
-        )
-        notification_broadcast(
-            actor, key, id_value=id_value, recipient=recipient.username
-        )
+    action_object = kwargs.pop("action_object", None)
 
+    if recipient == "global":
+        # whole user base, created in background by chunk
+        job = create_fanout_job(actor, verb, action_object=action_object,
+                                key=key, id_value=id_value)
+        transaction.on_commit(lambda: notification_fanout.delay(job['job_id']))
+        return job
+
+    if isinstance(recipient, list):
+        users = User.objects.filter(username__in=recipient)
+    elif isinstance(recipient, User):
+        users = [recipient]
     else:
-        pass
-
+        return
 
-def notification_broadcast(actor, key, **kwargs):
-    """Notification handler to broadcast calls to the recieve layer of the
-    WebSocket consumer of this app.
-    :requires:
-    :param actor: User instance of that user who makes the action.
-    :param key: String parameter to indicate the client which action to
-                perform.
-    :optional:
-    :param id_value: UUID value assigned to a specific element in the DOM.
-    :param recipient: String indicating the name of that who needs to be
-                      notified.
-    """
-    channel_layer = get_channel_layer()
-    id_value = kwargs.pop("id_value", None)
-    recipient = kwargs.pop("recipient", None)
-    payload = {
-        "type": "receive",
-        "key": key,
-        "actor_name": actor.username,
-        "id_value": id_value,
-        "recipient": recipient,
-    }
-    async_to_sync(channel_layer.group_send)("notifications", payload)
+    notifications = [
+        Notification(actor=actor, recipient=user, verb=verb, action_object=action_object)
+        for user in users
+    ]
+    Notification.objects.bulk_notify(notifications, key=key, id_value=id_value)
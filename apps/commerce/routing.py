@@ -1,8 +1,17 @@
 from django.urls import path
 
 # Channels
-from apps.commerce.consumers import ChatConsumer
+from apps.commerce.consumers import (
+    ChatConsumer, NotificationConsumer, StreamConsumer, EventStreamConsumer
+)
 
 websocket_urlpatterns = [
     path('ws/chats/<uuid:chat_uuid>/messages/', ChatConsumer),
+    path('ws/notifications/', NotificationConsumer),
+    path('ws/streams/', StreamConsumer),
+]
+
+# Prefixed with sse/ by openpeo.routing
+http_urlpatterns = [
+    path('streams/', EventStreamConsumer),
 ]
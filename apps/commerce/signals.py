@@ -1,10 +1,17 @@
 from django.db import transaction
-from django.db.models import Prefetch, Q
+from django.db.models import Q
 from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ObjectDoesNotExist
 from django.utils.translation import gettext_lazy as _
 
 from utils.generals import get_model
+from apps.commerce.models.notification import order_item_summary
+from apps.commerce.utils.storage import delete_attachment_file, release_replaced_file
+from apps.commerce.utils.counters import incr_unread_count_on_commit
+from apps.commerce.utils.broadcast import (
+    chat_message_broadcast_on_commit, chat_join_broadcast_on_commit,
+    notification_broadcast_on_commit
+)
 from apps.commerce.utils.constants import (
     PENDING, CONFIRMED, NEW, ACCEPTED, PAYMENT_CONFIRMATION, PAYED, DELIVER,
     REJECTED, CANCELED, PAYMENT_CONFIRMED, DONE
@@ -18,20 +25,23 @@ ChatMessage = get_model('commerce', 'ChatMessage')
 OrderItem = get_model('commerce', 'OrderItem')
 
 
+def get_chat(order_item):
+    # chat between seller and buyer of the order item, None if not yet exist
+    user_id = order_item.order.seller_id
+    send_to_user_id = order_item.order.user_id
+
+    return Chat.objects \
+        .select_related('user', 'send_to_user') \
+        .filter((Q(user_id=user_id) & Q(send_to_user__id=send_to_user_id))
+                | (Q(user_id=send_to_user_id) & Q(send_to_user__id=user_id))) \
+        .first()
+
+
 def create_chat(order_item):
     # if user has chat or send chat by other user, just get the chat. Not created again.
-    user = order_item.order.seller
-    send_to_user = order_item.order.user
-
-    try:
-        obj = Chat.objects \
-            .prefetch_related(Prefetch('user'), Prefetch('send_to_user')) \
-            .select_related('user', 'send_to_user') \
-            .filter((Q(user_id=user.id) & Q(send_to_user__id=send_to_user.id))
-                    | (Q(user_id=send_to_user.id) & Q(send_to_user__id=user.id))
-        ).get()
-    except ObjectDoesNotExist:
-        obj = Chat.objects.create(user=user, send_to_user=send_to_user)
+    obj = get_chat(order_item)
+    if obj is None:
+        obj = Chat.objects.create(user=order_item.order.seller, send_to_user=order_item.order.user)
 
     return obj
 
@@ -62,6 +72,7 @@ def order_save_handler(sender, instance, created, **kwargs):
 def order_item_save_handler(sender, instance, created, **kwargs):
     content_type = ContentType.objects.get_for_model(instance)
     verb = NEW
+    chat_obj = None
 
     if not created:
         # action by seller
@@ -93,13 +104,29 @@ def order_item_save_handler(sender, instance, created, **kwargs):
         if instance.status == CANCELED:
             verb = CANCELED
 
+    if chat_obj is None:
+        chat_obj = get_chat(instance)
+
     # send notification
     Notification.objects.create(actor=instance.order.seller, recipient=instance.order.user,
                                 action_object_content_type=content_type,
                                 action_object_object_id=instance.id,
+                                chat=chat_obj, object_summary=order_item_summary(instance),
                                 verb=verb)
 
 
+def chat_save_handler(sender, instance, created, **kwargs):
+    # participants connected with multiplexed socket join new chat
+    if created:
+        chat_join_broadcast_on_commit(instance)
+
+
+def chat_message_save_handler(sender, instance, created, **kwargs):
+    # push new message to websocket clients
+    if created:
+        chat_message_broadcast_on_commit([instance.uuid])
+
+
 @transaction.atomic
 def cart_item_delete_handler(sender, instance, **kwargs):
     # delete cart if has not cart item
@@ -120,3 +147,27 @@ def order_item_delete_handler(sender, instance, **kwargs):
             instance.order.delete()
     except ObjectDoesNotExist:
         pass
+
+
+def attachment_pre_save_handler(sender, instance, **kwargs):
+    # file replaced, release the old one
+    release_replaced_file(instance)
+
+
+def attachment_delete_handler(sender, instance, **kwargs):
+    # release shared file
+    delete_attachment_file(instance)
+
+
+def notification_save_handler(sender, instance, created, **kwargs):
+    if created:
+        if instance.unread:
+            incr_unread_count_on_commit(instance.recipient_id)
+
+        # push to recipient only
+        notification_broadcast_on_commit([instance.uuid_id])
+
+
+def notification_delete_handler(sender, instance, **kwargs):
+    if instance.unread:
+        incr_unread_count_on_commit(instance.recipient_id, -1)
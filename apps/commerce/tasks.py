@@ -0,0 +1,61 @@
+import logging
+
+from django.conf import settings
+from django.utils.translation import ugettext_lazy as _
+
+# Celery config
+from celery import shared_task
+
+from apps.commerce.utils.fanout import run_fanout_job
+from apps.commerce.utils.push import flush_push_digest
+from apps.commerce.utils.storage import attachment_storage
+from apps.commerce.utils.retention import (
+    purge_read_notifications, collapse_superseded_notifications
+)
+
+
+@shared_task(bind=True, acks_late=True)
+def notification_fanout(self, job_id):
+    """
+    Acked after finished, job redelivered when worker die
+    then continue from the last saved chunk.
+    """
+    logging.info(_(u"Notification fan-out %s run.") % job_id)
+
+    def progress(job):
+        self.update_state(state='PROGRESS', meta={
+            'processed': job['processed'],
+            'total': job['total']
+        })
+
+    job = run_fanout_job(job_id, progress=progress)
+    if job is None:
+        logging.warning(_(u"Notification fan-out %s not found.") % job_id)
+        return None
+    return {'processed': job['processed'], 'total': job['total']}
+
+
+@shared_task
+def notification_retention():
+    """Hourly from beat, each step bounded. Remaining rows left for next run."""
+    collapsed = collapse_superseded_notifications()
+    purged = purge_read_notifications()
+
+    logging.info(_(u"Notification retention: %(collapsed)s collapsed, %(purged)s purged.")
+                 % {'collapsed': collapsed, 'purged': purged})
+    return {'collapsed': collapsed, 'purged': purged}
+
+
+@shared_task
+def push_digest_flush(user_id):
+    # scheduled by queue_push when digest window opened
+    return flush_push_digest(user_id)
+
+
+@shared_task
+def purge_orphan_blobs():
+    """Daily from beat, file left by rolled back upload"""
+    removed = attachment_storage.purge_orphans(settings.BLOB_ORPHAN_MIN_AGE)
+
+    logging.info(_(u"Orphan blobs: %s removed.") % removed)
+    return removed
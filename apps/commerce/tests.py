@@ -1,3 +1,599 @@
-from django.test import TestCase
+import os
+import shutil
+import tempfile
+import uuid
 
-# Create your tests here.
+from unittest import mock
+
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync, sync_to_async
+
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.contenttypes.models import ContentType
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import ApplicationCommunicator, WebsocketCommunicator
+from rest_framework.test import APIClient
+
+from utils.generals import get_model
+from utils.testcases import RedisTestCase, execute_on_commit
+from apps.commerce.routing import websocket_urlpatterns, http_urlpatterns
+from apps.commerce.utils import broadcast, push
+from apps.commerce.utils.counters import get_unread_count
+from apps.commerce.utils.events import append_events, read_events
+from apps.commerce.utils.fanout import create_fanout_job, run_fanout_job, get_fanout_job, DONE
+from apps.commerce.utils.retention import (
+    purge_read_notifications, collapse_superseded_notifications
+)
+from apps.commerce.utils.constants import NEW, ACCEPTED, CONFIRMED
+from apps.commerce.utils.storage import ContentAddressedStorage
+
+User = get_model('person', 'User')
+Notification = get_model('commerce', 'Notification')
+Product = get_model('commerce', 'Product')
+Cart = get_model('commerce', 'Cart')
+Order = get_model('commerce', 'Order')
+OrderItem = get_model('commerce', 'OrderItem')
+Blob = get_model('commerce', 'Blob')
+ChatAttachment = get_model('commerce', 'ChatAttachment')
+
+
+def run_on_commit(func):
+    func()
+
+
+class BroadcastOnCommitTest(TestCase):
+    @mock.patch('apps.commerce.utils.broadcast.transaction.on_commit', run_on_commit)
+    def test_channel_layer_error_logged(self):
+        failing = mock.Mock(side_effect=ConnectionError('redis down'), __name__='failing')
+
+        with self.assertLogs(level='ERROR') as logs:
+            broadcast.broadcast_on_commit(failing, ['uuid'], key='chat')
+
+        failing.assert_called_once_with(['uuid'], key='chat')
+        self.assertIn('Broadcast failing failed', logs.output[0])
+
+
+class NotificationTestCase(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        self.actor = User.objects.create_user(username='seller', email='seller@example.com',
+                                              password='secret')
+        self.recipient = User.objects.create_user(username='buyer', email='buyer@example.com',
+                                                  password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.recipient)
+
+    def notify(self, count, recipient=None):
+        return Notification.objects.bulk_notify([
+            Notification(actor=self.actor, recipient=recipient or self.recipient, verb=NEW)
+            for i in range(count)
+        ])
+
+
+class BulkNotifyTest(NotificationTestCase):
+    def test_recipient_not_loaded(self):
+        notifications = [Notification(actor_id=self.actor.id, recipient_id=self.recipient.id,
+                                      verb=NEW) for i in range(3)]
+
+        # usernames read at once then one insert, slug same as save()
+        with self.assertNumQueries(2):
+            created = Notification.objects.bulk_notify(notifications)
+        self.assertTrue(all(item.slug.startswith(self.recipient.username) for item in created))
+
+        saved = Notification.objects.create(actor=self.actor, recipient=self.recipient, verb=NEW)
+        self.assertEqual(saved.slug,
+                         Notification.build_slug(self.recipient.username, saved.uuid_id, NEW))
+
+
+class NotificationGroupTest(NotificationTestCase):
+    def test_only_recipient_receive(self):
+        created = self.notify(1)
+
+        with mock.patch.object(broadcast, 'group_send_many', mock.AsyncMock()) as send:
+            broadcast.notification_broadcast([item.uuid_id for item in created])
+        messages = send.call_args[0][0]
+        self.assertEqual([name for name, payload in messages],
+                         [broadcast.notification_group_name(self.recipient.uuid)])
+
+        @async_to_sync
+        async def run():
+            recipient = WebsocketCommunicator(as_user(self.recipient), '/ws/notifications/')
+            actor = WebsocketCommunicator(as_user(self.actor), '/ws/notifications/')
+            self.assertTrue((await recipient.connect())[0])
+            self.assertTrue((await actor.connect())[0])
+
+            await broadcast.group_send_many(messages)
+            notification = await recipient.receive_json_from()
+            self.assertEqual(notification['uuid'], str(created[0].uuid_id))
+            self.assertNotIn('event_ids', notification)
+            self.assertTrue(await actor.receive_nothing())
+
+            await recipient.disconnect()
+            await actor.disconnect()
+
+        run()
+
+
+class NotificationFanoutTest(NotificationTestCase):
+    def setUp(self):
+        super().setUp()
+        self.users = [self.recipient] + [
+            User.objects.create_user(username='user%s' % i, email='user%s@example.com' % i,
+                                     password='secret')
+            for i in range(4)
+        ]
+
+    def test_resume_after_crash(self):
+        job = create_fanout_job(self.actor, NEW)
+
+        def crash(job):
+            raise RuntimeError('worker killed')
+
+        # first chunk saved then the worker died
+        with self.assertRaises(RuntimeError):
+            run_fanout_job(job['job_id'], chunk_size=2, progress=crash)
+        self.assertEqual(get_fanout_job(job['job_id'])['processed'], 2)
+
+        # next chunk inserted but progress not saved
+        Notification.objects.bulk_notify([
+            Notification(actor=self.actor, recipient=self.users[2], verb=NEW)
+        ])
+
+        job = run_fanout_job(job['job_id'], chunk_size=2)
+        self.assertEqual(job['status'], DONE)
+        self.assertEqual(job['processed'], 5)
+
+        recipients = Notification.objects.filter(actor=self.actor) \
+            .values_list('recipient_id', flat=True)
+        self.assertEqual(sorted(recipients), sorted(user.id for user in self.users))
+
+
+class NotificationPaginationTest(NotificationTestCase):
+    def test_same_timestamp_not_skipped_or_repeated(self):
+        created = self.notify(7)
+        Notification.objects.update(timestamp=timezone.now())
+
+        seen = list()
+        url = '/api/commerce/notifications/?limit=3'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen.extend(item['uuid_id'] for item in response.data['results'])
+            url = response.data['navigate']['next']
+
+        self.assertEqual(len(seen), 7)
+        self.assertEqual(set(seen), set(str(item.uuid_id) for item in created))
+
+
+class NotificationListQueryTest(NotificationTestCase):
+    def notify_products(self, count):
+        content_type = ContentType.objects.get_for_model(Product)
+        products = [Product.objects.create(user=self.actor, name='Product %s' % i, price=1000,
+                                           description='-', order_deadline=timezone.now(),
+                                           delivery_date=timezone.now())
+                    for i in range(count)]
+        Notification.objects.bulk_notify([
+            Notification(actor=self.actor, recipient=self.recipient, verb=NEW,
+                         action_object_content_type=content_type,
+                         action_object_object_id=item.id)
+            for item in products
+        ])
+
+        # deleted target still listed
+        products[0].delete()
+
+    def count_list_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/commerce/notifications/')
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def test_query_count_constant(self):
+        self.notify_products(2)
+        expected = self.count_list_queries()
+
+        self.notify_products(5)
+        with self.assertNumQueries(expected):
+            response = self.client.get('/api/commerce/notifications/')
+        self.assertEqual(len(response.data['results']), 7)
+
+
+class NotificationSummaryTest(NotificationTestCase):
+    def test_chat_and_summary_stored(self):
+        product = Product.objects.create(user=self.actor, name='Kopi', price=25000,
+                                         description='-', order_deadline=timezone.now(),
+                                         delivery_date=timezone.now())
+        cart = Cart.objects.create(user=self.recipient, seller=self.actor)
+        order = Order.objects.create(user=self.recipient, seller=self.actor, cart=cart)
+        order_item = OrderItem.objects.create(order=order, product=product, quantity=1,
+                                              shipping_cost=5000)
+
+        # seller accept, chat created with the notification
+        order_item.status = CONFIRMED
+        order_item.save()
+        notification = Notification.objects.get(verb=ACCEPTED)
+        self.assertIsNotNone(notification.chat_id)
+
+        # listed from the snapshot, later change not resolved
+        Product.objects.filter(id=product.id).update(name='Teh')
+        response = self.client.get('/api/commerce/notifications/')
+        item = next(item for item in response.data['results']
+                    if item['uuid_id'] == str(notification.uuid_id))
+
+        self.assertEqual(item['chat_uuid'], str(notification.chat.uuid))
+        self.assertEqual(item['object']['name'], 'Kopi')
+        self.assertEqual(item['object']['shipping_cost'], 5000)
+        self.assertFalse(item['object']['is_creator'])
+
+
+class NotificationRetentionTest(NotificationTestCase):
+    def test_only_old_read_notifications_deleted(self):
+        old_read, old_unread, new_read = self.notify(3)
+        Notification.objects.filter(uuid_id__in=[old_read.uuid_id, new_read.uuid_id]) \
+            .update(unread=False)
+        Notification.objects.filter(uuid_id__in=[old_read.uuid_id, old_unread.uuid_id]) \
+            .update(timestamp=timezone.now() - timedelta(days=365))
+
+        self.assertEqual(purge_read_notifications(ttl_days=30, chunk_size=1), 1)
+        self.assertEqual(
+            set(Notification.objects.values_list('uuid_id', flat=True)),
+            {old_unread.uuid_id, new_read.uuid_id}
+        )
+
+    def test_collapse_keep_latest_of_each_order_item(self):
+        content_type = ContentType.objects.get_for_model(get_model('commerce', 'OrderItem'))
+        now = timezone.now()
+
+        latest = dict()
+        for object_id in (1, 2):
+            for minutes in (30, 20, 10):
+                item = Notification.objects.create(
+                    actor=self.actor, recipient=self.recipient, verb=NEW,
+                    action_object_content_type=content_type, action_object_object_id=object_id)
+                Notification.objects.filter(uuid_id=item.uuid_id) \
+                    .update(timestamp=now - timedelta(minutes=minutes))
+                latest[object_id] = item.uuid_id
+        other = self.notify(1)[0]
+        self.assertEqual(get_unread_count(self.recipient.id), 7)
+
+        # each run scan 4 rows only, continue from cursor
+        deleted = list()
+        with execute_on_commit():
+            for i in range(3):
+                deleted.append(collapse_superseded_notifications(chunk_size=2, max_chunks=2))
+
+        self.assertEqual(sum(deleted), 4)
+        self.assertEqual(
+            set(Notification.objects.values_list('uuid_id', flat=True)),
+            {latest[1], latest[2], other.uuid_id}
+        )
+        self.assertEqual(get_unread_count(self.recipient.id), 3)
+
+
+class NotificationUnreadCountTest(NotificationTestCase):
+    def setUp(self):
+        super().setUp()
+        self.other = User.objects.create_user(username='other', email='other@example.com',
+                                              password='secret')
+        self.notifications = self.notify(3)
+        self.notify(2, recipient=self.other)
+
+        # counter cached from here
+        self.assertEqual(get_unread_count(self.recipient.id), 3)
+        self.assertEqual(get_unread_count(self.other.id), 2)
+
+    def test_unread_count_endpoint(self):
+        response = self.client.get('/api/commerce/notifications/unread-count/')
+        self.assertEqual(response.data, {'unread': 3})
+
+    def test_mark_read_uuids(self):
+        uuids = [str(item.uuid_id) for item in self.notifications[:2]]
+
+        with execute_on_commit():
+            response = self.client.post('/api/commerce/notifications/mark-read/',
+                                        {'uuids': uuids}, format='json')
+
+        # request run inside test transaction, counter changed after
+        self.assertEqual(response.data['updated'], 2)
+        self.assertEqual(get_unread_count(self.recipient.id), 1)
+        self.assertEqual(get_unread_count(self.other.id), 2)
+
+    def test_mark_read_all_only_own(self):
+        with execute_on_commit():
+            response = self.client.post('/api/commerce/notifications/mark-read/',
+                                        {'all': True}, format='json')
+
+        self.assertEqual(response.data['updated'], 3)
+        self.assertEqual(get_unread_count(self.recipient.id), 0)
+        self.assertEqual(get_unread_count(self.other.id), 2)
+
+    def test_mark_read_params_missing(self):
+        response = self.client.post('/api/commerce/notifications/mark-read/', {}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_rollback_keep_counter(self):
+        with execute_on_commit():
+            try:
+                with transaction.atomic():
+                    Notification.objects.mark_all_as_read(recipient=self.recipient)
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+
+        self.assertEqual(get_unread_count(self.recipient.id), 3)
+
+    def test_without_recipient_reset_affected_counters(self):
+        with execute_on_commit():
+            Notification.objects.mark_all_as_read()
+        self.assertEqual(get_unread_count(self.recipient.id), 0)
+        self.assertEqual(get_unread_count(self.other.id), 0)
+
+        with execute_on_commit():
+            Notification.objects.filter(recipient=self.other).mark_all_as_unread()
+        self.assertEqual(get_unread_count(self.recipient.id), 0)
+        self.assertEqual(get_unread_count(self.other.id), 2)
+
+    def test_mark_as_read_single(self):
+        with execute_on_commit():
+            self.notifications[0].mark_as_read()
+        self.assertEqual(get_unread_count(self.recipient.id), 2)
+
+
+class PushDigestTest(RedisTestCase):
+    def test_digest_message(self):
+        self.assertEqual(push.digest_message([NEW]), 'Ada orderan baru!')
+        self.assertEqual(push.digest_message([NEW, NEW]), '2 Pesanan Baru')
+
+    def test_metrics_for_staff_only(self):
+        user = User.objects.create_user(username='staff', email='staff@example.com',
+                                        password='secret')
+        client = APIClient()
+        client.force_authenticate(user)
+
+        url = '/api/commerce/notifications/push-metrics/'
+        self.assertEqual(client.get(url).status_code, 403)
+
+        with mock.patch('apps.commerce.tasks.push_digest_flush.apply_async'):
+            push.queue_push(user.id, NEW)
+            push.queue_push(user.id, NEW)
+        push.flush_push_digest(user.id)
+
+        user.is_staff = True
+        user.save()
+        response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'events': 2, 'flushes': 1, 'coalesced': 1})
+
+    @override_settings(FCM_SERVER_KEY='')
+    def test_push_skipped_without_server_key(self):
+        with mock.patch('apps.commerce.utils.push.requests.post') as post:
+            self.assertEqual(push.send_push_notifcation('device-token'), (None, None))
+        post.assert_not_called()
+
+    @override_settings(FCM_SERVER_KEY='server-key')
+    def test_server_key_from_settings(self):
+        with mock.patch('apps.commerce.utils.push.requests.post') as post:
+            post.return_value.status_code = 200
+            post.return_value.json.return_value = {'success': 1}
+            push.send_push_notifcation('device-token')
+
+        self.assertEqual(post.call_args[1]['headers']['Authorization'], 'key=server-key')
+
+
+def as_user(user):
+    """Websocket application with `user` already in scope"""
+    router = URLRouter(websocket_urlpatterns)
+    return lambda scope: router(dict(scope, user=user))
+
+
+def member(result):
+    async def is_chat_member(user, chat_uuid):
+        return result
+    return is_chat_member
+
+
+class ChatConsumerTest(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        self.chat_uuid = str(uuid.uuid4())
+        self.path = '/ws/chats/%s/messages/' % self.chat_uuid
+        self.user = User.objects.create_user(username='member', email='member@example.com',
+                                             password='secret')
+
+    @async_to_sync
+    async def connect(self, user):
+        communicator = WebsocketCommunicator(as_user(user), self.path)
+        connected, code = await communicator.connect()
+        await communicator.disconnect()
+        return connected
+
+    @mock.patch('apps.commerce.consumers.is_chat_member', member(False))
+    def test_not_member_rejected(self):
+        self.assertFalse(self.connect(self.user))
+        self.assertFalse(self.connect(AnonymousUser()))
+
+    @mock.patch('apps.commerce.consumers.is_chat_member', member(True))
+    def test_member_only_receive_saved_message(self):
+        @async_to_sync
+        async def run():
+            communicator = WebsocketCommunicator(as_user(self.user), self.path)
+            connected, code = await communicator.connect()
+            self.assertTrue(connected)
+
+            # client text not relayed to the group
+            await communicator.send_to(text_data='{"message": "unsaved"}')
+            self.assertEqual(await communicator.receive_json_from(),
+                             {'detail': 'Send message with chat message API'})
+            self.assertTrue(await communicator.receive_nothing())
+
+            await get_channel_layer().group_send(broadcast.chat_group_name(self.chat_uuid), {
+                'type': 'chat_message', 'chat': self.chat_uuid, 'message': {'message': 'saved'}
+            })
+            self.assertEqual(await communicator.receive_json_from(),
+                             {'message': {'message': 'saved'}})
+            await communicator.disconnect()
+
+        run()
+
+
+async def no_chats(user):
+    return set()
+
+
+@mock.patch('apps.commerce.consumers.get_chat_uuids', no_chats)
+class EventStreamTest(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='reader', email='reader@example.com',
+                                             password='secret')
+        self.user_uuid = str(self.user.uuid)
+        self.event_ids = append_events([
+            (self.user_uuid, 'notification', {'n': i}) for i in range(3)
+        ])
+
+    def test_read_after_last_event_id(self):
+        events = read_events(self.user_uuid, self.event_ids[0])
+        self.assertEqual([event_id for event_id, event, data in events], self.event_ids[1:])
+        self.assertEqual(read_events(self.user_uuid, 'invalid'), [])
+
+    def test_reconnect_replay_missed_events(self):
+        router = URLRouter(http_urlpatterns)
+        scope = {
+            'type': 'http', 'method': 'GET', 'path': '/streams/', 'query_string': b'',
+            'headers': [(b'last-event-id', self.event_ids[0].encode())], 'user': self.user,
+        }
+
+        @async_to_sync
+        async def run():
+            communicator = ApplicationCommunicator(router, scope)
+            await communicator.send_input({'type': 'http.request'})
+            self.assertEqual((await communicator.receive_output())['status'], 200)
+            self.assertEqual((await communicator.receive_output())['body'], b'retry: 3000\n\n')
+
+            frames = [(await communicator.receive_output())['body'] for i in range(2)]
+            self.assertEqual(frames, [
+                ('id: %s\nevent: notification\ndata: {"n": %s}\n\n' % (event_id, i + 1)).encode()
+                for i, event_id in enumerate(self.event_ids[1:])
+            ])
+
+            # live copy of a replayed event skipped
+            await get_channel_layer().group_send(broadcast.notification_group_name(self.user_uuid), {
+                'type': 'notification_message', 'event_ids': {self.user_uuid: self.event_ids[2]},
+                'n': 2,
+            })
+            self.assertTrue(await communicator.receive_nothing())
+
+            # live events arrive out of order, none dropped
+            live_ids = await sync_to_async(append_events)([
+                (self.user_uuid, 'notification', {'n': i}) for i in (3, 4)
+            ])
+            for event_id in reversed(live_ids):
+                await get_channel_layer().group_send(
+                    broadcast.notification_group_name(self.user_uuid),
+                    {'type': 'notification_message', 'event_ids': {self.user_uuid: event_id}})
+            for event_id in reversed(live_ids):
+                frame = (await communicator.receive_output())['body']
+                self.assertTrue(frame.startswith(('id: %s\n' % event_id).encode()))
+
+            await communicator.send_input({'type': 'http.disconnect'})
+            await communicator.wait()
+
+        run()
+
+
+class ContentAddressedStorageTest(TestCase):
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.location)
+        self.storage = ContentAddressedStorage(location=self.location)
+
+    def test_same_content_stored_once(self):
+        first = self.storage.save('files/chat/proof.jpg', ContentFile(b'payment proof'))
+        second = self.storage.save('files/product/other.JPG', ContentFile(b'payment proof'))
+
+        self.assertEqual(first, second)
+        self.assertTrue(first.startswith('files/blobs/'))
+        self.assertEqual(Blob.objects.get(name=first).ref_count, 2)
+
+        self.storage.delete(first)
+        self.assertTrue(self.storage.exists(first))
+        self.assertEqual(Blob.objects.get(name=first).ref_count, 1)
+
+        self.storage.delete(first)
+        self.assertFalse(self.storage.exists(first))
+        self.assertFalse(Blob.objects.filter(name=first).exists())
+
+    def test_rolled_back_upload_purged(self):
+        try:
+            with transaction.atomic():
+                name = self.storage.save('files/chat/proof.jpg', ContentFile(b'rolled back'))
+                raise RuntimeError
+        except RuntimeError:
+            pass
+
+        # file in place, row gone with the transaction
+        self.assertTrue(self.storage.exists(name))
+        self.assertFalse(Blob.objects.filter(name=name).exists())
+
+        kept = self.storage.save('files/chat/kept.jpg', ContentFile(b'committed'))
+        self.assertEqual(self.storage.purge_orphans(min_age=60), 0)
+
+        # old enough to not belong to running transaction
+        past = os.path.getmtime(self.storage.path(name)) - 120
+        os.utime(self.storage.path(name), (past, past))
+        self.assertEqual(self.storage.purge_orphans(min_age=60), 1)
+        self.assertFalse(self.storage.exists(name))
+        self.assertTrue(self.storage.exists(kept))
+
+
+class AttachmentFileTest(TestCase):
+    def setUp(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location)
+
+        media = override_settings(MEDIA_ROOT=location)
+        media.enable()
+        self.addCleanup(media.disable)
+
+    def attach(self, content):
+        return ChatAttachment.objects.create(title='proof', attach_type='image',
+                                             attach_file=ContentFile(content, name='proof.jpg'))
+
+    def test_replaced_file_released(self):
+        attachment = self.attach(b'first proof')
+        old_name = attachment.attach_file.name
+
+        with execute_on_commit():
+            attachment.attach_file = ContentFile(b'second proof', name='proof.jpg')
+            attachment.save()
+
+        self.assertFalse(Blob.objects.filter(name=old_name).exists())
+        self.assertEqual(Blob.objects.get(name=attachment.attach_file.name).ref_count, 1)
+
+    def test_other_field_update_keep_file(self):
+        attachment = self.attach(b'first proof')
+
+        with execute_on_commit():
+            attachment.title = 'renamed'
+            attachment.save()
+
+        self.assertEqual(Blob.objects.get(name=attachment.attach_file.name).ref_count, 1)
+
+    def test_deleted_shared_file_kept_for_other_reference(self):
+        first, second = self.attach(b'same proof'), self.attach(b'same proof')
+
+        with execute_on_commit():
+            first.delete()
+        self.assertEqual(Blob.objects.get(name=second.attach_file.name).ref_count, 1)
+
+        with execute_on_commit():
+            second.delete()
+        self.assertFalse(Blob.objects.exists())
@@ -0,0 +1,248 @@
+from django.db import transaction
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Prefetch
+
+import asyncio
+import logging
+
+from asgiref.sync import async_to_sync
+
+from channels.layers import get_channel_layer
+
+from utils.generals import get_model
+from apps.commerce.utils.generic import prefetch_generic_objects, get_generic_object
+from apps.commerce.utils.events import append_events
+
+
+def broadcast_on_commit(func, *args, **kwargs):
+    """
+    Run broadcast after commit. Data already saved at that point,
+    channel layer or Redis failure logged instead of turn the request
+    into error (client would retry and create duplicate).
+    """
+    def run():
+        try:
+            func(*args, **kwargs)
+        except Exception:
+            logging.exception('Broadcast %s failed' % func.__name__)
+
+    transaction.on_commit(run)
+
+
+def chat_group_name(chat_uuid):
+    return 'chat_%s' % chat_uuid
+
+
+def user_group_name(user_uuid):
+    return 'user_%s' % user_uuid
+
+
+def notification_group_name(user_uuid):
+    return 'notifications_%s' % user_uuid
+
+
+def serialize_chat_message(instance):
+    """
+    Compact form of a chat message pushed to websocket clients.
+    Same keys as ChatMessageSerializer but without anything that
+    depends on the current request (eg: `is_creator`, `is_seller`),
+    client decide that by compare `user_uuid` / `seller_uuid`.
+    """
+    ret = {
+        'uuid': str(instance.uuid),
+        'chat_uuid': str(instance.chat.uuid),
+        'user_uuid': str(instance.user.uuid),
+        'message': instance.message,
+        'create_date': instance.create_date.isoformat() if instance.create_date else None,
+        'attachments': [
+            {
+                'uuid': str(item.uuid),
+                'title': item.title,
+                'attach_type': item.attach_type,
+                'attach_file': item.attach_file.url if item.attach_file else None,
+            } for item in instance.chat_message_attachments.all()
+        ],
+    }
+
+    # content embeded?
+    if instance.object_id and instance.content_type_id:
+        model_name = ContentType.objects.get_for_id(instance.content_type_id).model
+        content_object = get_generic_object(instance)
+
+        ret['model_name'] = model_name
+
+        if content_object:
+            product = None
+
+            # product
+            if model_name == 'product':
+                product = content_object
+
+            # orderitem
+            if model_name == 'orderitem':
+                product = content_object.product
+                ret['orderitem'] = {
+                    'uuid': str(content_object.uuid),
+                    'status': content_object.status,
+                    'shipping_cost': content_object.shipping_cost,
+                    'total': product.price * content_object.quantity,
+                    'order_uuid': str(content_object.order.uuid),
+                    'seller_uuid': str(product.user.uuid),
+                }
+
+            if product:
+                ret['product'] = {
+                    'uuid': str(product.uuid),
+                    'name': product.name,
+                    'price': product.price,
+                }
+
+    return ret
+
+
+def chat_message_broadcast(message_uuids):
+    """
+    Send persisted chat messages to the room group joined by `ChatConsumer`.
+    :param message_uuids: list of ChatMessage uuid
+    """
+    ChatMessage = get_model('commerce', 'ChatMessage')
+
+    if not message_uuids:
+        return
+
+    messages = ChatMessage.objects \
+        .prefetch_related(Prefetch('chat_message_attachments')) \
+        .select_related('chat', 'chat__user', 'chat__send_to_user', 'user') \
+        .filter(uuid__in=message_uuids) \
+        .order_by('create_date')
+    messages = prefetch_generic_objects(messages)
+
+    # replay buffer for SSE, one entry per participant
+    entries = list()
+    payloads = list()
+    for item in messages:
+        data = {
+            'chat': str(item.chat.uuid),
+            'message': serialize_chat_message(item),
+        }
+        participants = [str(item.chat.user.uuid), str(item.chat.send_to_user.uuid)]
+        entries.extend((user_uuid, 'chat', data) for user_uuid in participants)
+        payloads.append((item.chat.uuid, participants, data))
+
+    event_ids = iter(append_events(entries))
+    sends = list()
+    for chat_uuid, participants, data in payloads:
+        payload = {
+            'type': 'chat_message',
+            'event_ids': {user_uuid: next(event_ids) for user_uuid in participants},
+        }
+        payload.update(data)
+        sends.append((chat_group_name(chat_uuid), payload))
+
+    # keep messages order in the chat
+    async_to_sync(group_send_many)(sends, ordered=True)
+
+
+def chat_message_broadcast_on_commit(message_uuids):
+    """
+    Broadcast only after transaction committed, so attachments
+    created in the same transaction are included and rolled back
+    messages never reach the client.
+    """
+    broadcast_on_commit(chat_message_broadcast, list(message_uuids))
+
+
+def chat_join_broadcast(chat_uuid, user_uuids):
+    """
+    Tell multiplexed connections of chat participants to join the chat group.
+    So new chat live without client reconnect.
+    """
+    channel_layer = get_channel_layer()
+    payload = {
+        'type': 'chat_join',
+        'chat': str(chat_uuid),
+    }
+
+    for user_uuid in user_uuids:
+        async_to_sync(channel_layer.group_send)(user_group_name(user_uuid), payload)
+
+
+def chat_join_broadcast_on_commit(chat):
+    chat_uuid = chat.uuid
+    user_uuids = [chat.user.uuid, chat.send_to_user.uuid]
+    broadcast_on_commit(chat_join_broadcast, chat_uuid, user_uuids)
+
+
+async def group_send_many(messages, ordered=False):
+    """
+    Send many (group name, payload) in one event loop pass,
+    not one async_to_sync round trip per message.
+    Concurrent unless order matter.
+    """
+    channel_layer = get_channel_layer()
+    if ordered:
+        for group_name, payload in messages:
+            await channel_layer.group_send(group_name, payload)
+        return
+
+    await asyncio.gather(*[
+        channel_layer.group_send(group_name, payload)
+        for group_name, payload in messages
+    ])
+
+
+def serialize_notification(instance, key='notification', id_value=None):
+    """
+    Compact notification pushed to the recipient.
+    Client fetch full content from notification API when needed.
+    """
+    ret = {
+        'key': key,
+        'uuid': str(instance.uuid_id),
+        'verb': instance.verb,
+        'actor_uuid': str(instance.actor.uuid),
+        'actor_name': instance.actor.username,
+        'timestamp': instance.timestamp.isoformat() if instance.timestamp else None,
+        'id_value': id_value,
+        'chat_uuid': str(instance.chat.uuid) if instance.chat_id else None,
+    }
+
+    if instance.action_object_content_type_id:
+        ret['model_name'] = ContentType.objects.get_for_id(instance.action_object_content_type_id).model
+        ret['object_id'] = instance.action_object_object_id
+    return ret
+
+
+def notification_broadcast(notification_uuids, key='notification', id_value=None):
+    """
+    Send notifications only to the group of each recipient.
+    :param notification_uuids: list of Notification uuid_id
+    """
+    Notification = get_model('commerce', 'Notification')
+
+    if not notification_uuids:
+        return
+
+    notifications = Notification.objects \
+        .select_related('actor', 'recipient', 'chat') \
+        .filter(uuid_id__in=notification_uuids)
+
+    items = [
+        (str(item.recipient.uuid), serialize_notification(item, key=key, id_value=id_value))
+        for item in notifications
+    ]
+    event_ids = append_events([(user_uuid, 'notification', data) for user_uuid, data in items])
+
+    messages = list()
+    for (user_uuid, data), event_id in zip(items, event_ids):
+        payload = {'type': 'notification_message', 'event_ids': {user_uuid: event_id}}
+        payload.update(data)
+        messages.append((notification_group_name(user_uuid), payload))
+
+    # keep event id order of each recipient
+    async_to_sync(group_send_many)(messages, ordered=True)
+
+
+def notification_broadcast_on_commit(notification_uuids, key='notification', id_value=None):
+    broadcast_on_commit(notification_broadcast, list(notification_uuids),
+                        key=key, id_value=id_value)
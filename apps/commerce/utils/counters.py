@@ -0,0 +1,48 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from utils.generals import get_model
+
+
+def _unread_key(user_id):
+    return 'notification_unread:%s' % user_id
+
+
+def get_unread_count(user_id):
+    """
+    Unread notification count of the user from cache.
+    Counted from database only when cache missing, then kept
+    up to date by `incr_unread_count`.
+
+    Increment between the count and `add` lost (counter missing at that
+    time), cached value can drift by those. Drift accepted, bounded by
+    NOTIFICATION_UNREAD_TIMEOUT: increment keep the expiry, so the
+    counter recounted at least that often.
+    """
+    key = _unread_key(user_id)
+    count = cache.get(key)
+
+    if count is None:
+        Notification = get_model('commerce', 'Notification')
+        count = Notification.objects.filter(recipient_id=user_id, unread=True).count()
+
+        # add, not set. Don't overwrite value changed meanwhile
+        cache.add(key, count, timeout=settings.NOTIFICATION_UNREAD_TIMEOUT)
+    return max(count, 0)
+
+
+def incr_unread_count(user_id, delta=1):
+    # missing counter recounted on next read
+    try:
+        cache.incr(_unread_key(user_id), delta)
+    except ValueError:
+        pass
+
+
+def incr_unread_count_on_commit(user_id, delta=1):
+    transaction.on_commit(lambda: incr_unread_count(user_id, delta))
+
+
+def reset_unread_count(user_id):
+    cache.delete(_unread_key(user_id))
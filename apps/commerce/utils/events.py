@@ -0,0 +1,68 @@
+import json
+import logging
+
+from django.conf import settings
+
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+
+def _stream_key(user_uuid):
+    return 'event_stream:%s' % user_uuid
+
+
+def parse_event_id(event_id):
+    """Redis stream id '1602999999999-0' as comparable tuple, None if invalid"""
+    try:
+        ms, seq = str(event_id).split('-')
+        return int(ms), int(seq)
+    except (TypeError, ValueError):
+        return None
+
+
+def append_events(entries):
+    """
+    Keep a short replay buffer of events per user, read by SSE clients
+    reconnect with Last-Event-ID. Buffer is best effort, live delivery
+    not depend on it.
+
+    :param entries: list of (user uuid, event name, data)
+    :return: list of event id, same order as entries
+    """
+    if not entries:
+        return []
+
+    try:
+        pipe = get_redis_connection('default').pipeline(transaction=False)
+        for user_uuid, event, data in entries:
+            key = _stream_key(user_uuid)
+            pipe.xadd(key, {'event': event, 'data': json.dumps(data)},
+                      maxlen=settings.EVENT_STREAM_MAXLEN, approximate=True)
+            pipe.expire(key, settings.EVENT_STREAM_TIMEOUT)
+        result = pipe.execute()
+    except RedisError as e:
+        logging.warning('Event stream not saved: %s' % e)
+        return [None] * len(entries)
+
+    # result is [id, expire, id, expire, ...]
+    return [event_id.decode() for event_id in result[::2]]
+
+
+def read_events(user_uuid, last_event_id, count=None):
+    """Events after last_event_id as list of (event id, event, data)"""
+    if parse_event_id(last_event_id) is None:
+        return []
+
+    count = count or settings.EVENT_STREAM_MAXLEN
+    try:
+        items = get_redis_connection('default') \
+            .xrange(_stream_key(user_uuid), min=last_event_id, max='+', count=count + 1)
+    except RedisError as e:
+        logging.warning('Event stream not read: %s' % e)
+        return []
+
+    # range is inclusive, skip the last seen event
+    return [
+        (event_id.decode(), fields[b'event'].decode(), json.loads(fields[b'data']))
+        for event_id, fields in items if event_id.decode() != last_event_id
+    ][:count]
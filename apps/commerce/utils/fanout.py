@@ -0,0 +1,153 @@
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from utils.generals import get_model
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+
+
+def _job_key(job_id):
+    return 'notification_fanout:%s' % job_id
+
+
+def get_fanout_job(job_id):
+    """
+    Progress of a fan-out job, eg:
+        {'status': 'running', 'total': 100000, 'processed': 42000, ...}
+    """
+    return cache.get(_job_key(job_id))
+
+
+def _save_job(job):
+    cache.set(_job_key(job['job_id']), job, timeout=settings.NOTIFICATION_FANOUT_TIMEOUT)
+
+
+def create_fanout_job(actor, verb, action_object=None, key='notification', id_value=None):
+    """
+    Prepare notification to every user except the actor.
+    Run with `apps.commerce.tasks.notification_fanout`.
+    """
+    job = {
+        'job_id': uuid.uuid4().hex,
+        'status': PENDING,
+        'actor_id': actor.id,
+        'verb': verb,
+        'key': key,
+        'id_value': str(id_value) if id_value else None,
+        'content_type_id': None,
+        'object_id': None,
+        'create_date': timezone.now().isoformat(),
+        'last_id': 0,
+        'processed': 0,
+        'total': None,
+    }
+
+    if action_object is not None:
+        job['content_type_id'] = ContentType.objects.get_for_model(action_object).id
+        job['object_id'] = action_object.pk
+
+    _save_job(job)
+    return job
+
+
+def _already_notified(job, user_ids):
+    """Recipients created by previous run which crashed before progress saved"""
+    Notification = get_model('commerce', 'Notification')
+
+    return set(
+        Notification.objects
+        .filter(actor_id=job['actor_id'], verb=job['verb'], recipient_id__in=user_ids,
+                action_object_content_type_id=job['content_type_id'],
+                action_object_object_id=job['object_id'],
+                timestamp__gte=parse_datetime(job['create_date']))
+        .values_list('recipient_id', flat=True)
+    )
+
+
+def run_fanout_job(job_id, chunk_size=None, progress=None):
+    """
+    Stream recipient ids ordered by id, each chunk inserted with one
+    bulk_create and published in one batch. Progress saved after every
+    chunk, so a job started again continue after the last saved id.
+
+    :param progress: optional callable receive the job after each chunk
+    """
+    Notification = get_model('commerce', 'Notification')
+    User = get_user_model()
+
+    job = get_fanout_job(job_id)
+    if job is None or job['status'] == DONE:
+        return job
+
+    chunk_size = chunk_size or settings.NOTIFICATION_FANOUT_CHUNK_SIZE
+    resumed = job['last_id'] > 0
+
+    users = User.objects \
+        .filter(id__gt=job['last_id']) \
+        .exclude(id=job['actor_id']) \
+        .order_by('id')
+
+    if job['total'] is None:
+        job['total'] = users.count()
+
+    job['status'] = RUNNING
+    _save_job(job)
+
+    def flush(chunk):
+        nonlocal resumed
+
+        if resumed:
+            skip = _already_notified(job, [user_id for user_id, username in chunk])
+            chunk = [item for item in chunk if item[0] not in skip]
+            resumed = False
+
+        notifications = list()
+        for user_id, username in chunk:
+            item = Notification(
+                actor_id=job['actor_id'], recipient_id=user_id, verb=job['verb'],
+                action_object_content_type_id=job['content_type_id'],
+                action_object_object_id=job['object_id']
+            )
+            item.slug = Notification.build_slug(username, item.uuid_id, item.verb)
+            notifications.append(item)
+
+        with transaction.atomic():
+            Notification.objects.bulk_notify(
+                notifications, key=job['key'], id_value=job['id_value'],
+                batch_size=chunk_size
+            )
+
+    chunk = list()
+    for user_id, username in users.values_list('id', 'username').iterator(chunk_size=chunk_size):
+        chunk.append((user_id, username))
+        if len(chunk) < chunk_size:
+            continue
+
+        flush(chunk)
+        job['last_id'] = user_id
+        job['processed'] += len(chunk)
+        chunk = list()
+
+        _save_job(job)
+        if progress:
+            progress(job)
+
+    if chunk:
+        flush(chunk)
+        job['last_id'] = chunk[-1][0]
+        job['processed'] += len(chunk)
+
+    job['status'] = DONE
+    _save_job(job)
+    if progress:
+        progress(job)
+    return job
@@ -0,0 +1,138 @@
+import json
+import logging
+import requests
+
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+
+from django_redis import get_redis_connection
+
+from utils.generals import get_model
+from apps.commerce.utils.constants import NOTIFICATION_TYPES, NEW
+
+PUSH_METRICS_KEY = 'push_digest:metrics'
+
+
+def _buffer_key(user_id):
+    return 'push_digest:buffer:%s' % user_id
+
+
+def _window_key(user_id):
+    return 'push_digest:window:%s' % user_id
+
+
+def send_push_notifcation(token, body='Ada orderan baru!'):
+    if not settings.FCM_SERVER_KEY:
+        logging.warning('FCM_SERVER_KEY not set, push not sent')
+        return None, None
+
+    headers = {
+        'Content-Type': 'application/json',
+        'Authorization': 'key=' + settings.FCM_SERVER_KEY,
+    }
+
+    body = {
+        'notification': {
+            'title': 'Notifikasi Open Pe O',
+            'body': body,
+            'click_action': 'https://openpeo.com/tabs/tab2'
+        },
+        'to': token,
+        'priority': 'high',
+    }
+
+    response = requests.post("https://fcm.googleapis.com/fcm/send",headers = headers, data=json.dumps(body))
+    return response.status_code, response.json()
+
+
+def queue_push(user_id, verb):
+    """
+    Buffer push event of the user. First event open a window, the buffer
+    sent as one digest by `apps.commerce.tasks.push_digest_flush` when
+    window end. Events in the same window not schedule anything again.
+    """
+    from apps.commerce.tasks import push_digest_flush
+
+    window = settings.PUSH_DIGEST_WINDOW
+    redis = get_redis_connection('default')
+
+    pipe = redis.pipeline()
+    pipe.rpush(_buffer_key(user_id), verb)
+    pipe.expire(_buffer_key(user_id), window * 10)
+    pipe.set(_window_key(user_id), 1, nx=True, ex=window)
+    pipe.hincrby(PUSH_METRICS_KEY, 'events', 1)
+    opened = pipe.execute()[2]
+
+    if opened:
+        push_digest_flush.apply_async((user_id,), countdown=window)
+
+
+def queue_push_on_commit(user_ids, verb):
+    user_ids = list(user_ids)
+
+    def queue():
+        for user_id in user_ids:
+            queue_push(user_id, verb)
+    transaction.on_commit(queue)
+
+
+def digest_message(verbs):
+    """
+    Digest to seller, only new order pushed.
+    Eg: ['new', 'new'] -> 2 Pesanan Baru
+    """
+    labels = dict(NOTIFICATION_TYPES)
+    counts = Counter(verbs)
+
+    if len(verbs) == 1 and verbs[0] == NEW:
+        return 'Ada orderan baru!'
+
+    return ', '.join('%s %s' % (count, labels.get(verb, verb)) for verb, count in counts.items())
+
+
+def flush_push_digest(user_id):
+    """Take all buffered events of the user at once, send one push"""
+    Account = get_model('person', 'Account')
+
+    redis = get_redis_connection('default')
+    pipe = redis.pipeline()
+    pipe.lrange(_buffer_key(user_id), 0, -1)
+    pipe.delete(_buffer_key(user_id))
+    verbs = [verb.decode() for verb in pipe.execute()[0]]
+
+    if not verbs:
+        return 0
+
+    token = Account.objects.filter(user_id=user_id).values_list('fcm_token', flat=True).first()
+
+    pipe = redis.pipeline()
+    pipe.hincrby(PUSH_METRICS_KEY, 'flushes', 1)
+    pipe.hincrby(PUSH_METRICS_KEY, 'coalesced', len(verbs) - 1)
+    if token:
+        pipe.hincrby(PUSH_METRICS_KEY, 'pushes', 1)
+    pipe.execute()
+
+    if token:
+        try:
+            send_push_notifcation(token, body=digest_message(verbs))
+        except (requests.RequestException, ValueError) as e:
+            redis.hincrby(PUSH_METRICS_KEY, 'errors', 1)
+            logging.error('Push digest failed: %s' % e)
+    return len(verbs)
+
+
+def get_push_metrics():
+    """
+    Counters since last reset:
+        events: events buffered
+        flushes: digest windows closed
+        pushes: push sent to device
+        coalesced: push saved by the digest
+        errors: push request failed
+    Served to staff at GET notifications/push-metrics/
+    """
+    redis = get_redis_connection('default')
+    metrics = redis.hgetall(PUSH_METRICS_KEY)
+    return {key.decode(): int(value) for key, value in metrics.items()}
@@ -0,0 +1,97 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.contrib.contenttypes.models import ContentType
+from django.utils import timezone
+
+from utils.generals import get_model
+
+# last primary key scanned by collapse, next run continue from it
+COLLAPSE_CURSOR_KEY = 'notification_collapse:cursor'
+
+
+def _delete_chunk(uuids):
+    """
+    Public `delete()`, post_delete (`notification_delete_handler`)
+    adjust unread counter of each unread row on commit.
+    """
+    Notification = get_model('commerce', 'Notification')
+
+    with transaction.atomic():
+        deleted, per_model = Notification.objects.filter(uuid_id__in=uuids).delete()
+    return deleted
+
+
+def purge_read_notifications(ttl_days=None, chunk_size=None, max_chunks=None):
+    """Delete read notifications older than ttl, oldest first"""
+    Notification = get_model('commerce', 'Notification')
+
+    ttl_days = ttl_days or settings.NOTIFICATION_READ_TTL_DAYS
+    chunk_size = chunk_size or settings.NOTIFICATION_PURGE_CHUNK_SIZE
+    max_chunks = max_chunks or settings.NOTIFICATION_PURGE_MAX_CHUNKS
+    cutoff = timezone.now() - timedelta(days=ttl_days)
+
+    queryset = Notification.objects \
+        .filter(unread=False, timestamp__lt=cutoff) \
+        .order_by('timestamp')
+
+    deleted = 0
+    for i in range(max_chunks):
+        uuids = list(queryset.values_list('uuid_id', flat=True)[:chunk_size])
+        if not uuids:
+            break
+
+        deleted += _delete_chunk(uuids)
+        if len(uuids) < chunk_size:
+            break
+    return deleted
+
+
+def collapse_superseded_notifications(chunk_size=None, max_chunks=None):
+    """
+    Each order item status change add a notification to the same recipient.
+    Only latest status matter, delete the older ones.
+
+    Order item notifications scanned by primary key, at most `max_chunks`
+    pages of `chunk_size` per run, newer one looked up by index for
+    scanned rows only. Next run continue from the saved cursor, start
+    over after the last page. Superseded ids selected first, then deleted.
+    """
+    Notification = get_model('commerce', 'Notification')
+    OrderItem = get_model('commerce', 'OrderItem')
+
+    chunk_size = chunk_size or settings.NOTIFICATION_PURGE_CHUNK_SIZE
+    max_chunks = max_chunks or settings.NOTIFICATION_PURGE_MAX_CHUNKS
+
+    content_type = ContentType.objects.get_for_model(OrderItem)
+    newer = Notification.objects.filter(
+        action_object_content_type_id=OuterRef('action_object_content_type_id'),
+        action_object_object_id=OuterRef('action_object_object_id'),
+        recipient_id=OuterRef('recipient_id'),
+        timestamp__gt=OuterRef('timestamp')
+    )
+
+    queryset = Notification.objects \
+        .filter(action_object_content_type_id=content_type.id) \
+        .annotate(superseded=Exists(newer)) \
+        .order_by('uuid_id')
+
+    cursor = cache.get(COLLAPSE_CURSOR_KEY)
+    superseded = list()
+    for i in range(max_chunks):
+        page = queryset.filter(uuid_id__gt=cursor) if cursor else queryset
+        rows = list(page.values_list('uuid_id', 'superseded')[:chunk_size])
+
+        superseded.extend(uuid_id for uuid_id, is_superseded in rows if is_superseded)
+        cursor = rows[-1][0] if len(rows) == chunk_size else None
+        if cursor is None:
+            break
+    cache.set(COLLAPSE_CURSOR_KEY, cursor, timeout=None)
+
+    deleted = 0
+    for offset in range(0, len(superseded), chunk_size):
+        deleted += _delete_chunk(superseded[offset:offset + chunk_size])
+    return deleted
@@ -0,0 +1,212 @@
+import os
+import time
+import hashlib
+import tempfile
+
+from django.db import transaction
+from django.db.models import F
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+from utils.generals import get_model
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Store each file once by sha256 of the content.
+    Upload name ignored, only extension kept. Output sharded path like:
+        files/blobs/6f/1a/6f1a...e2.jpg
+
+    Same content uploaded many times (payment proof, product photo
+    re-sent in chat) point to one file. Each reference counted in `Blob`,
+    file removed when last reference deleted.
+
+    File moved in place before the transaction commit, rolled back upload
+    leave file without `Blob` row, removed later by `purge_orphans`.
+    """
+    prefix = 'files/blobs'
+
+    def __init__(self, prefix=None, **kwargs):
+        if prefix:
+            self.prefix = prefix
+        super().__init__(**kwargs)
+
+    def get_available_name(self, name, max_length=None):
+        # final name decided by content in _save
+        return name
+
+    def _write_temporary(self, content):
+        """Write content to temporary file and hash at once"""
+        hasher = hashlib.sha256()
+        size = 0
+
+        tmp_dir = self.path(self.prefix)
+        os.makedirs(tmp_dir, exist_ok=True)
+
+        fd, tmp_path = tempfile.mkstemp(dir=tmp_dir, suffix='.upload')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+
+                for chunk in content.chunks():
+                    if isinstance(chunk, str):
+                        chunk = chunk.encode()
+                    hasher.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        return hasher.hexdigest(), tmp_path, size
+
+    def get_blob_name(self, digest, ext):
+        name = os.path.join(self.prefix, digest[:2], digest[2:4], digest + ext.lower())
+        return name.replace('\\', '/')
+
+    def _save(self, name, content):
+        Blob = get_model('commerce', 'Blob')
+
+        ext = os.path.splitext(name)[1]
+        digest, tmp_path, size = self._write_temporary(content)
+
+        try:
+            with transaction.atomic():
+                blob, created = Blob.objects.select_for_update() \
+                    .get_or_create(digest=digest, defaults={
+                        'name': self.get_blob_name(digest, ext),
+                        'size': size
+                    })
+
+                # first reference, move temporary file to the place. New row
+                # always replace the file, may be orphan about to be purged
+                full_path = self.path(blob.name)
+                if created or not os.path.exists(full_path):
+                    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                    os.replace(tmp_path, full_path)
+                    tmp_path = None
+
+                    if self.file_permissions_mode is not None:
+                        os.chmod(full_path, self.file_permissions_mode)
+
+                Blob.objects.filter(id=blob.id).update(ref_count=F('ref_count') + 1)
+        finally:
+            # duplicate content, nothing written
+            if tmp_path:
+                os.remove(tmp_path)
+
+        return blob.name
+
+    def delete(self, name):
+        Blob = get_model('commerce', 'Blob')
+
+        with transaction.atomic():
+            blob = Blob.objects.select_for_update().filter(name=name).first()
+
+            # file stored before this storage used
+            if blob is None:
+                super().delete(name)
+                return
+
+            if blob.ref_count > 1:
+                Blob.objects.filter(id=blob.id).update(ref_count=F('ref_count') - 1)
+                return
+
+            # last reference
+            blob.delete()
+            super().delete(name)
+
+    def _remove_unreferenced(self, candidates):
+        Blob = get_model('commerce', 'Blob')
+
+        known = set(Blob.objects
+                    .filter(name__in=[name for name, path, mtime in candidates])
+                    .values_list('name', flat=True))
+
+        removed = 0
+        for name, path, mtime in candidates:
+            if name in known:
+                continue
+
+            try:
+                # stored again meanwhile
+                if os.path.getmtime(path) != mtime:
+                    continue
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+    def purge_orphans(self, min_age, chunk_size=1000):
+        """
+        Remove file without `Blob` row and temporary file of interrupted
+        upload. Only file older than `min_age` seconds, newer one may
+        belong to transaction not committed yet.
+
+        :return: removed file count
+        """
+        root = self.path(self.prefix)
+        deadline = time.time() - min_age
+        candidates = list()
+        removed = 0
+
+        for dirpath, dirnames, filenames in os.walk(root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    mtime = os.path.getmtime(path)
+                except FileNotFoundError:
+                    continue
+                if mtime > deadline:
+                    continue
+
+                if filename.endswith('.upload'):
+                    os.remove(path)
+                    removed += 1
+                    continue
+
+                name = os.path.relpath(path, self.location).replace('\\', '/')
+                candidates.append((name, path, mtime))
+                if len(candidates) >= chunk_size:
+                    removed += self._remove_unreferenced(candidates)
+                    candidates = list()
+
+        if candidates:
+            removed += self._remove_unreferenced(candidates)
+        return removed
+
+
+attachment_storage = ContentAddressedStorage()
+
+
+def delete_attachment_file(instance, field_name='attach_file'):
+    """
+    Release attachment file reference after the row deleted.
+    Run on commit so rollback not leave row without file.
+    """
+    file = getattr(instance, field_name, None)
+    if file and file.name:
+        name = file.name
+        storage = file.storage
+        transaction.on_commit(lambda: storage.delete(name))
+
+
+def release_replaced_file(instance, field_name='attach_file'):
+    """
+    Release old file reference when the row saved with other file.
+    Old name read from the row, released on commit same as delete.
+    """
+    if instance._state.adding:
+        return
+
+    file = getattr(instance, field_name)
+    old_name = instance.__class__._default_manager \
+        .filter(pk=instance.pk) \
+        .values_list(field_name, flat=True) \
+        .first()
+
+    if old_name and old_name != file.name:
+        storage = file.storage
+        transaction.on_commit(lambda: storage.delete(old_name))
@@ -7,6 +7,7 @@ from rest_framework import serializers
 
 from utils.generals import get_model
 from apps.person.utils.constants import CHANGE_MSISDN_VALIDATION
+from apps.person.utils.otp import get_otp_storage
 from apps.person.api.validator import (
     MSISDNDuplicateValidator,
     MSISDNNumberValidator
@@ -53,7 +54,7 @@ class AccountSerializer(serializers.ModelSerializer):
         if self.instance and settings.STRICT_MSISDN_VERIFIED:
             with transaction.atomic():
                 try:
-                    self.otp_obj = OTPFactory.objects.select_for_update() \
+                    self.otp_obj = get_otp_storage() \
                         .get_verified_unused(msisdn=value, challenge=CHANGE_MSISDN_VALIDATION)
                 except ObjectDoesNotExist:
                     raise serializers.ValidationError(_(u"Kode OTP pembaruan msisdn salah."))
@@ -1,8 +1,6 @@
 from django.db import transaction
-from django.db.models import Q
 from django.core.exceptions import ValidationError
 from django.core.validators import EmailValidator
-from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 
 from rest_framework import serializers
@@ -11,6 +9,7 @@ from rest_framework.exceptions import NotAcceptable
 from utils.generals import get_model
 from apps.person.utils.constants import OTP_SESSION_FIELDS, PASSWORD_RECOVERY
 from apps.person.utils.auth import get_users_by_email
+from apps.person.utils.otp import get_otp_storage
 
 OTPFactory = get_model('person', 'OTPFactory')
 
@@ -119,27 +118,12 @@ class OTPFactoryFactorySerializer(OTPFactoryFieldsModelSerializer, serializers.M
         if not email and not msisdn:
             raise NotAcceptable(_(u"Email or msisdn not provided."))
 
-        _defaults = {
-            'challenge': challenge,
-            'is_verified': False,
-            'is_used': False,
-            'is_expired': False,
-        }
-
-        if email and not msisdn:
-            _defaults['email'] = email
-
-        if msisdn and not email:
-            _defaults['msisdn'] = msisdn
-
         # Ops, please choose one (email or telehone)
         if msisdn and email:
             raise NotAcceptable(_(u"Only accept one of email or msisdn."))
 
-        # If `valid_until` greater than time now we update OTP Code
-        obj, created = OTPFactory.objects \
-            .filter(Q(valid_until__gt=timezone.now())) \
-            .update_or_create(**_defaults, defaults=_defaults) 
+        # Active code with same target and challenge renewed
+        obj, created = get_otp_storage().create(challenge, email=email, msisdn=msisdn)
 
         setattr(obj, 'created', created)
         return obj
@@ -31,6 +31,8 @@ from apps.person.utils.constants import (
 )
 from apps.person.api.otp.serializers import OTPFactoryFactorySerializer
 from apps.person.utils.auth import get_users_by_email
+from apps.person.utils.otp import get_otp_storage
+from apps.person.utils.throttles import OTPThrottle
 
 OTPFactory = get_model('person', 'OTPFactory')
 
@@ -52,6 +54,7 @@ class OTPFactoryApiView(viewsets.ViewSet):
     """
     lookup_field = 'uuid'
     permission_classes = (AllowAny,)
+    throttle_classes = (OTPThrottle,)
 
     @method_decorator(never_cache)
     @transaction.atomic
@@ -81,7 +84,7 @@ class OTPFactoryApiView(viewsets.ViewSet):
             email = request.data.get('email', None)
             msisdn = request.data.get('msisdn', None)
 
-            instance = OTPFactory.objects.select_for_update() \
+            instance = get_otp_storage() \
                 .get_unverified_unused(email=email, msisdn=msisdn, uuid=uuid)
         except ValidationError as err:
             raise NotAcceptable(detail=_(' '.join(err.messages)))
@@ -131,7 +134,7 @@ class OTPFactoryApiView(viewsets.ViewSet):
             if not passcode.isupper():
                 passcode = passcode.upper()
 
-            otp_obj = OTPFactory.objects.select_for_update() \
+            otp_obj = get_otp_storage() \
                 .get_unverified_unused(email=email, msisdn=msisdn, token=token,
                                        challenge=challenge, passcode=passcode)
         except ObjectDoesNotExist:
@@ -1,13 +1,11 @@
 import os
-import base64
 
 from django.db import transaction
-from django.utils.translation import ugettext_lazy as _
-from django.core.files.base import ContentFile
 
 from rest_framework import serializers
 
 from utils.generals import get_model
+from apps.person.utils.images import PictureIngest
 
 Profile = get_model('person', 'Profile')
 
@@ -25,13 +23,6 @@ def handle_upload_profile_picture(instance, file, is_original=False):
             instance.save(update_fields=['picture'])
 
 
-def base64_to_file(picture_base64):
-    picture_format, picture_imgstr = picture_base64.split(';base64,') 
-    picture_ext = picture_format.split('/')[-1] 
-    picture_file = ContentFile(base64.b64decode(picture_imgstr), name='temp.' + picture_ext)
-    return picture_file
-
-
 # User profile serializer
 class ProfileSerializer(serializers.ModelSerializer):
     first_name = serializers.CharField()
@@ -45,29 +36,56 @@ class ProfileSerializer(serializers.ModelSerializer):
         ret['gender'] = instance.get_gender_display()
         return ret
 
+    def run_validation(self, data=serializers.empty):
+        self._picture_ingest = None
+        try:
+            return super().run_validation(data)
+        except Exception:
+            # validation failed after ingest created, release temp file and pool work
+            if self._picture_ingest:
+                self._picture_ingest.close()
+            raise
+
     def to_internal_value(self, data):
-        # process base64 image back to file
-        picture_base64 = data.get('picture', None)
-        picture_original_base64 = data.get('picture_original', None)
+        # base64 data url or multipart upload
+        picture = data.get('picture', None)
+        picture_original = data.get('picture_original', None)
+        picture_crop = data.get('picture_crop', None)
         picture_changed = data.get('picture_changed', False)
         picture_removed = data.get('picture_removed', False)
 
-        # cropped picture
-        if picture_base64 and isinstance(picture_base64, str):
-            data['picture'] = base64_to_file(picture_base64)
+        fields = data.keys() - {'picture', 'picture_original', 'picture_crop'}
+        data = super().to_internal_value({key: data.get(key) for key in fields})
+
+        # original kept when only cropped picture changed
+        if picture_original:
+            data['has_picture_original'] = True
 
-        # original picture
-        if picture_original_base64 and isinstance(picture_original_base64, str):
-            data['picture_original'] = base64_to_file(picture_original_base64)
+        # original only needed when saved or cropped by server
+        if not (picture_changed or picture_crop):
+            picture_original = None
 
-        data = super().to_internal_value(data)
+        # decoded and checked here, resize and encode run in pool
+        # while the rest of request processed
+        if picture or picture_original:
+            try:
+                ingest = PictureIngest(
+                    picture=picture or None,
+                    picture_original=picture_original or None,
+                    crop=picture_crop
+                )
+            except serializers.ValidationError as e:
+                raise serializers.ValidationError({'picture': e.detail})
+
+            ingest.submit()
+            data['picture_ingest'] = self._picture_ingest = ingest
 
         # user select new picture?
         if picture_changed:
             data['picture_changed'] = picture_changed
 
         # is picture changed?
-        if picture_base64 :
+        if picture or picture_crop:
             data['has_picture'] = True
 
         # is picture remove?
@@ -77,48 +95,36 @@ class ProfileSerializer(serializers.ModelSerializer):
 
     @transaction.atomic
     def update(self, instance, validated_data):
-        request = self.context.get('request', None)
-
-        # upload picture / avatar use celery task
-        picture = validated_data.pop('picture', None)
-        picture_original = validated_data.pop('picture_original', None)
+        ingest = validated_data.pop('picture_ingest', None)
         picture_changed = validated_data.pop('picture_changed', False)
         picture_removed = validated_data.pop('picture_removed', False)
         has_picture = validated_data.pop('has_picture', False)
-
-        # only execute if update has picture
-        if has_picture or picture_removed:
-            # cropped picture
-            if picture:
-                fsize = picture.size
-                fname = picture.name
-
-                # max size 2.5 MB
-                if fsize > 312500:
-                    raise serializers.ValidationError(_(u"Maksimal ukuran file 2.5 MB"))
-
-                # only accept JPG, JPEG & PNG
-                if not fname.endswith('.jpg') and not fname.endswith('.jpeg') and not fname.endswith('.png'):
-                    raise serializers.ValidationError(_(u"File hanya boleh .jpg dan .png"))
-
-                file = request.FILES.get('picture', None)
-                if file is None:
-                    file = picture
-                handle_upload_profile_picture(instance, file)
-            else:
-                # delete picture
-                instance.picture.delete(save=True)
-
-            # original picture
-            if picture_original and picture_changed:
-                file = request.FILES.get('picture_original', None)
-                if file is None:
-                    file = picture_original
-                handle_upload_profile_picture(instance, file, True)
-
-            if not picture_original and not picture:
-                # delete picture
-                instance.picture_original.delete(save=True)
+        has_picture_original = validated_data.pop('has_picture_original', False)
+
+        try:
+            # only execute if update has picture
+            if has_picture or picture_removed:
+                files = ingest.files() if ingest else dict()
+
+                # cropped picture
+                picture = files.get('picture', None)
+                if picture:
+                    handle_upload_profile_picture(instance, picture)
+                else:
+                    # delete picture
+                    instance.picture.delete(save=True)
+
+                # original picture
+                picture_original = files.get('picture_original', None)
+                if picture_original and picture_changed:
+                    handle_upload_profile_picture(instance, picture_original, True)
+
+                if not has_picture_original and not picture:
+                    # delete picture
+                    instance.picture_original.delete(save=True)
+        finally:
+            if ingest:
+                ingest.close()
 
         # update user instance
         first_name = validated_data.pop('first_name', None)
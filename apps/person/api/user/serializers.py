@@ -16,6 +16,8 @@ from apps.person.utils.constants import (
     CHANGE_EMAIL_VALIDATION, CHANGE_MSISDN_VALIDATION,
     REGISTER_VALIDATION
 )
+from apps.person.utils.otp import get_otp_storage
+from apps.person.utils.provisioning import set_verified_msisdn
 from apps.person.api.validator import (
     EmailDuplicateValidator,
     EmailVerifiedForRegistrationValidator,
@@ -145,7 +147,7 @@ class UserFactorySerializer(DynamicFieldsModelSerializer, serializers.ModelSeria
                 # update user
                 with transaction.atomic():
                     try:
-                        self.otp_obj = OTPFactory.objects.select_for_update() \
+                        self.otp_obj = get_otp_storage() \
                             .get_verified_unused(email=value, challenge=CHANGE_EMAIL_VALIDATION)
                     except ObjectDoesNotExist:
                         raise serializers.ValidationError(_(u"Kode OTP pembaruan email salah."))
@@ -153,7 +155,7 @@ class UserFactorySerializer(DynamicFieldsModelSerializer, serializers.ModelSeria
                 # create user
                 with transaction.atomic():
                     try:
-                        self.otp_obj = OTPFactory.objects.select_for_update() \
+                        self.otp_obj = get_otp_storage() \
                             .get_verified_unused(email=value, challenge=REGISTER_VALIDATION)
                     except ObjectDoesNotExist:
                         raise serializers.ValidationError(_(u"Alamat email belum tervalidasi."))
@@ -166,7 +168,7 @@ class UserFactorySerializer(DynamicFieldsModelSerializer, serializers.ModelSeria
                 # update user
                 with transaction.atomic():
                     try:
-                        self.otp_obj = OTPFactory.objects.select_for_update() \
+                        self.otp_obj = get_otp_storage() \
                             .get_verified_unused(msisdn=value, challenge=CHANGE_MSISDN_VALIDATION)
                     except ObjectDoesNotExist:
                         raise serializers.ValidationError(_(u"Kode OTP pembaruan msisdn salah."))
@@ -174,7 +176,7 @@ class UserFactorySerializer(DynamicFieldsModelSerializer, serializers.ModelSeria
                 # create user
                 with transaction.atomic():
                     try:
-                        self.otp_obj = OTPFactory.objects.select_for_update() \
+                        self.otp_obj = get_otp_storage() \
                             .get_verified_unused(msisdn=value, challenge=REGISTER_VALIDATION)
                     except ObjectDoesNotExist:
                         raise serializers.ValidationError(_(u"MSISDN belum tervalidasi."))
@@ -188,7 +190,7 @@ class UserFactorySerializer(DynamicFieldsModelSerializer, serializers.ModelSeria
 
             with transaction.atomic():
                 try:
-                    self.otp_obj = OTPFactory.objects.select_for_update() \
+                    self.otp_obj = get_otp_storage() \
                         .get_verified_unused(email=email, msisdn=msisdn, challenge=CHANGE_USERNAME)
                 except ObjectDoesNotExist:
                     raise serializers.ValidationError(_(u"Kode OTP pembaruan nama pengguna salah."))
@@ -230,18 +232,9 @@ class UserFactorySerializer(DynamicFieldsModelSerializer, serializers.ModelSeria
         except TypeError as e:
             raise ValidationError(repr(e))
 
-        # create Account instance
+        # Account created by user_save_handler
         if self.msisdn:
-            account = getattr(user, 'account')
-            if account:
-                account.msisdn = self.msisdn
-                account.msisdn_verified = True
-                account.save()
-            else:
-                try:
-                    Account.objects.create(user=user, msisdn=self.msisdn, msisdn_verified=True)
-                except IntegrityError:
-                    pass
+            set_verified_msisdn(user, self.msisdn)
 
         # all done mark otp as used
         if self.otp_obj:
@@ -10,7 +10,7 @@ from django.core.exceptions import (
     MultipleObjectsReturned
 )
 from django.views.decorators.cache import never_cache
-from django.contrib.auth import authenticate, login, logout
+from django.contrib.auth import login, logout
 from django.core.validators import validate_email
 from django.utils.http import urlsafe_base64_decode
 from django.contrib.auth.tokens import default_token_generator
@@ -43,7 +43,11 @@ from utils.generals import get_model
 from utils.validators import is_valid_uuid
 from apps.person.utils.permissions import IsCurrentUserOrReject
 from apps.person.utils.auth import validate_username
-from apps.person.utils.constants import PASSWORD_RECOVERY
+from apps.person.utils.otp import get_otp_storage
+from apps.person.utils.constants import (
+    PASSWORD_RECOVERY, LOGIN_USERNAME, LOGIN_EMAIL, LOGIN_MSISDN
+)
+from apps.person.utils.availability import maybe_taken
 
 User = get_model('person', 'User')
 Account = get_model('person', 'Account')
@@ -149,7 +153,7 @@ class UserApiView(viewsets.ViewSet):
     # Get otp object
     def get_otp(self, challenge=None):
         try:
-            obj = OTPFactory.objects.select_for_update() \
+            obj = get_otp_storage() \
                 .get_verified_unused(email=self.otp_email, msisdn=self.otp_msisdn,
                                      token=self.otp_token, challenge=challenge)
             return obj
@@ -188,7 +192,6 @@ class UserApiView(viewsets.ViewSet):
 
     # Sub-action check email available
     @method_decorator(never_cache)
-    @transaction.atomic
     @action(methods=['post'], detail=False, permission_classes=[AllowAny],
             url_path='check-email-available', url_name='view_check_email_available')
     def view_check_email_available(self, request):
@@ -209,6 +212,10 @@ class UserApiView(viewsets.ViewSet):
         except ValidationError as e:
             raise NotAcceptable({'detail': _(u" ".join(e.messages))})
 
+        # definitely not used, skip the database
+        if not maybe_taken(email, kinds=[LOGIN_EMAIL]):
+            return self.email_available(email)
+
         try:
             Account.objects.get(Q(user__account__email=Case(When(user__account__email__isnull=False, then=Value(email))))
                                 | Q(email=Case(When(email__isnull=False, then=Value(email)))),
@@ -220,14 +227,16 @@ class UserApiView(viewsets.ViewSet):
             raise NotAcceptable(_(u"Email `{email}` terdaftar lebih dari satu akun. Jika merasa belum pernah mendaftar"
                                   " dengan email tersebut silahkan hubungi kami.".format(email=email)))
         except ObjectDoesNotExist:
-            # Check the email has been used in OTP
-            check = OTPFactory.objects.filter(email=email, is_used=False, is_expired=False)
-            return Response({'detail': _(u"Email tersedia!"), 'is_exist': check.exists(), 'email': email},
-                            status=response_status.HTTP_200_OK)
+            return self.email_available(email)
+
+    def email_available(self, email):
+        # Check the email has been used in OTP
+        is_exist = get_otp_storage().has_active(email=email)
+        return Response({'detail': _(u"Email tersedia!"), 'is_exist': is_exist, 'email': email},
+                        status=response_status.HTTP_200_OK)
 
     # Sub-action check msisdn available
     @method_decorator(never_cache)
-    @transaction.atomic
     @action(methods=['post'], detail=False, permission_classes=[AllowAny],
             url_path='check-msisdn-available', url_name='view_check_msisdn_available')
     def view_check_msisdn_available(self, request):
@@ -243,6 +252,10 @@ class UserApiView(viewsets.ViewSet):
         if not msisdn:
             raise NotFound(_(u"Masukkan MSISDN."))
 
+        # definitely not used, skip the database
+        if not maybe_taken(msisdn, kinds=[LOGIN_MSISDN]):
+            return self.msisdn_available(msisdn)
+
         try:
             Account.objects.get(msisdn=msisdn, msisdn_verified=True)
             raise NotAcceptable(_(u"MSISDN `{msisdn}` sudah digunakan."
@@ -251,14 +264,16 @@ class UserApiView(viewsets.ViewSet):
             raise NotAcceptable(_(u"MSISDN `{msisdn}` terdaftar lebih dari satu akun. Jika merasa belum pernah mendaftar"
                                   " dengan msisdn tersebut silahkan hubungi kami.".format(msisdn=msisdn)))
         except ObjectDoesNotExist:
-            # Check whether the msisdn has been used
-            check = OTPFactory.objects.filter(msisdn=msisdn, is_used=False, is_expired=False)
-            return Response({'detail': _(u"MSISDN tersedia!"), 'is_exist': check.exists(), 'msisdn': msisdn},
-                            status=response_status.HTTP_200_OK)
+            return self.msisdn_available(msisdn)
+
+    def msisdn_available(self, msisdn):
+        # Check whether the msisdn has been used
+        is_exist = get_otp_storage().has_active(msisdn=msisdn)
+        return Response({'detail': _(u"MSISDN tersedia!"), 'is_exist': is_exist, 'msisdn': msisdn},
+                        status=response_status.HTTP_200_OK)
 
     # Sub-action check account available
     @method_decorator(never_cache)
-    @transaction.atomic
     @action(methods=['post'], detail=False, permission_classes=[AllowAny],
             url_path='check-account', url_name='view_check_account')
     def view_check_account(self, request):
@@ -274,6 +289,10 @@ class UserApiView(viewsets.ViewSet):
         if not account:
             raise NotFound(_(u"Masukkan email, nama pengguna atau MSISDN."))
 
+        # definitely not used, skip the database
+        if not maybe_taken(account):
+            raise NotFound({'detail': _(u"Akun `{account}` tidak ditemukan.".format(account=account))})
+
         try:
             user = User.objects.get(Q(username=account)
                                     | Q(email=account) & Q(account__email_verified=True)
@@ -288,7 +307,6 @@ class UserApiView(viewsets.ViewSet):
 
     # Sub-action check email available
     @method_decorator(never_cache)
-    @transaction.atomic
     @action(methods=['post'], detail=False, permission_classes=[AllowAny],
             url_path='check-username-available', url_name='view_check_username_available')
     def view_check_username_available(self, request):
@@ -310,7 +328,8 @@ class UserApiView(viewsets.ViewSet):
         except ValidationError as e:
             raise NotAcceptable({'detail': _(" ".join(e.messages))})
 
-        if User.objects.filter(username=username).exists():
+        if maybe_taken(username, kinds=[LOGIN_USERNAME]) \
+                and User.objects.filter(username=username).exists():
             raise NotAcceptable({'detail': _(u"Nama pengguna `{username}` "
                                              "sudah digunakan.".format(username=username))})
         return Response({'detail': _(u"Nama pengguna tersedia!")},
@@ -470,8 +489,6 @@ class TokenObtainPairViewExtend(TokenObtainPairView):
     @transaction.atomic
     def post(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
-        username = request.data.get('username')
-        password = request.data.get('password')
 
         try:
             serializer.is_valid(raise_exception=True)
@@ -479,8 +496,7 @@ class TokenObtainPairViewExtend(TokenObtainPairView):
             raise InvalidToken(e.args[0])
 
         # Make user logged-in
+        # user already authenticated by serializer, password not hashed again
         if settings.LOGIN_WITH_JWT:
-            user = authenticate(request, username=username, password=password)
-            if user:
-                login(request, user)
+            login(request, serializer.user)
         return Response(serializer.validated_data, status=response_status.HTTP_200_OK)
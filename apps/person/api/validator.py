@@ -5,9 +5,9 @@ from rest_framework import serializers
 
 from utils.generals import get_model
 from apps.person.utils.constants import REGISTER_VALIDATION
+from apps.person.utils.otp import get_otp_storage
 
 User = get_model('person', 'User')
-OTPFactory = get_model('person', 'OTPFactory')
 
 
 # Password verification
@@ -39,10 +39,7 @@ class EmailVerifiedForRegistrationValidator(object):
     requires_context = True
 
     def __call__(self, value, serializer_field):
-        otp = OTPFactory.objects.filter(challenge=REGISTER_VALIDATION, email=value,
-                                        is_used=False, is_verified=True, is_expired=False)
-
-        if not otp.exists():
+        if not get_otp_storage().has_verified(challenge=REGISTER_VALIDATION, email=value):
             raise serializers.ValidationError(_(u"Alamat email belum tervalidasi."))
 
 
@@ -65,10 +62,7 @@ class MSISDNVerifiedForRegistrationValidator(object):
     requires_context = True
 
     def __call__(self, value, serializer_field):
-        otp = OTPFactory.objects.filter(challenge=REGISTER_VALIDATION, msisdn=value,
-                                        is_used=False, is_verified=True, is_expired=False)
-
-        if not otp.exists():
+        if not get_otp_storage().has_verified(challenge=REGISTER_VALIDATION, msisdn=value):
             raise serializers.ValidationError(_(u"Nomor telepon belum tervalidasi."))
 
 
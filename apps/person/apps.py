@@ -1,5 +1,5 @@
 from django.apps import AppConfig
-from django.db.models.signals import post_save, post_delete
+from django.db.models.signals import post_save, post_delete, m2m_changed
 
 
 class PersonConfig(AppConfig):
@@ -8,10 +8,28 @@ class PersonConfig(AppConfig):
     def ready(self):
         from django.conf import settings
         from utils.generals import get_model
-        from apps.person.signals import user_save_handler, otpcode_save_handler
+        from apps.person.signals import (
+            user_save_handler, user_delete_handler, otpcode_save_handler,
+            account_save_handler, profile_save_handler, role_capabilities_change_handler,
+            role_change_handler
+        )
 
         OTPFactory = get_model('person', 'OTPFactory')
         Account = get_model('person', 'Account')
+        Profile = get_model('person', 'Profile')
+        Role = get_model('person', 'Role')
+        RoleCapabilities = get_model('person', 'RoleCapabilities')
 
         post_save.connect(user_save_handler, sender=settings.AUTH_USER_MODEL, dispatch_uid='user_save_signal')
+        post_delete.connect(user_delete_handler, sender=settings.AUTH_USER_MODEL, dispatch_uid='user_delete_signal')
+        post_save.connect(account_save_handler, sender=Account, dispatch_uid='account_save_signal')
+        post_save.connect(profile_save_handler, sender=Profile, dispatch_uid='profile_save_signal')
         post_save.connect(otpcode_save_handler, sender=OTPFactory, dispatch_uid='otpcode_save_signal')
+        post_save.connect(role_change_handler, sender=Role, dispatch_uid='role_save_signal')
+        post_delete.connect(role_change_handler, sender=Role, dispatch_uid='role_delete_signal')
+        post_save.connect(role_capabilities_change_handler, sender=RoleCapabilities,
+                          dispatch_uid='role_capabilities_save_signal')
+        post_delete.connect(role_capabilities_change_handler, sender=RoleCapabilities,
+                            dispatch_uid='role_capabilities_delete_signal')
+        m2m_changed.connect(role_capabilities_change_handler, sender=RoleCapabilities.permissions.through,
+                            dispatch_uid='role_capabilities_permissions_signal')
@@ -0,0 +1,32 @@
+import time
+import random
+import statistics
+
+from django.core.management.base import BaseCommand
+from django.db import reset_queries
+
+
+class BenchmarkCommand(BaseCommand):
+    """Timing loop and latency report shared by benchmark commands"""
+    def measure(self, run, samples, exceptions=()):
+        """Milliseconds of `run(sample)` for each sample, in random order"""
+        timings = list()
+        for sample in random.sample(samples, len(samples)):
+            begin = time.perf_counter()
+            try:
+                run(sample)
+            except exceptions:
+                pass
+            timings.append((time.perf_counter() - begin) * 1000)
+            reset_queries()
+        return timings
+
+    def report(self, label, timings):
+        timings = sorted(timings)
+        p95 = timings[int(len(timings) * 0.95) - 1] if len(timings) > 1 else timings[0]
+        self.stdout.write(
+            "%-10s n=%s mean=%.3fms p50=%.3fms p95=%.3fms max=%.3fms" % (
+                label, len(timings), statistics.mean(timings),
+                statistics.median(timings), p95, timings[-1]
+            )
+        )
@@ -0,0 +1,119 @@
+import time
+import threading
+import socketserver
+
+from django.core.mail import get_connection, EmailMultiAlternatives
+from django.core.management.base import BaseCommand
+
+from apps.person.utils.mail import render_email, deliver_messages
+
+
+class SinkHandler(socketserver.StreamRequestHandler):
+    """Minimal SMTP server, accept and drop every message"""
+    def handle(self):
+        # stand-in for TCP + TLS handshake of real server
+        time.sleep(self.server.handshake)
+        self.wfile.write(b'220 localhost\r\n')
+
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                break
+
+            command = line[:4].upper()
+            if command in (b'EHLO', b'HELO'):
+                self.wfile.write(b'250 localhost\r\n')
+            elif command == b'DATA':
+                self.wfile.write(b'354 End data with <CR><LF>.<CR><LF>\r\n')
+                while self.rfile.readline() not in (b'.\r\n', b''):
+                    pass
+                with self.server.lock:
+                    self.server.received += 1
+                self.wfile.write(b'250 OK\r\n')
+            elif command == b'QUIT':
+                self.wfile.write(b'221 Bye\r\n')
+                break
+            else:
+                self.wfile.write(b'250 OK\r\n')
+
+
+class SinkServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, handshake):
+        super().__init__(('127.0.0.1', 0), SinkHandler)
+        self.handshake = handshake
+        self.received = 0
+        self.lock = threading.Lock()
+
+
+class Command(BaseCommand):
+    """
+    Compare connection per message vs pooled batch delivery against
+    a local SMTP stand-in, nothing leave this machine.
+
+        python manage.py benchmark_email --messages 1000 --handshake-ms 50
+    """
+    help = "Measure email delivery throughput with local SMTP server"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=500)
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--handshake-ms', type=float, default=50,
+                            help="Delay before server greeting, simulate TLS handshake")
+
+    def handle(self, *args, **options):
+        server = SinkServer(options['handshake_ms'] / 1000)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        host, port = server.server_address
+        items = self.build_items(options['messages'])
+
+        def connection():
+            return get_connection('django.core.mail.backends.smtp.EmailBackend',
+                                  host=host, port=port, username='', password='',
+                                  use_tls=False, use_ssl=False, fail_silently=False)
+
+        try:
+            self.report('per-message', server, lambda: self.per_message(items, connection))
+            self.report('pooled', server,
+                        lambda: self.pooled(items, connection(), options['batch_size']))
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def build_items(self, count):
+        items = list()
+        for i in range(count):
+            text, html = render_email('otp', {'site_name': 'Benchmark', 'passcode': str(i).zfill(6)})
+            items.append({
+                'subject': 'Validasi OTP', 'text': text, 'html': html,
+                'from_email': 'benchmark@localhost', 'to': ['user%s@localhost' % i],
+            })
+        return items
+
+    def per_message(self, items, connection):
+        # previous send_otp_email, new connection each message
+        for item in items:
+            msg = EmailMultiAlternatives(item['subject'], item['text'], item['from_email'],
+                                         item['to'], connection=connection())
+            msg.attach_alternative(item['html'], "text/html")
+            msg.send()
+
+    def pooled(self, items, connection, batch_size):
+        for offset in range(0, len(items), batch_size):
+            deliver_messages(items[offset:offset + batch_size], connection=connection)
+        connection.close()
+
+    def report(self, label, server, run):
+        server.received = 0
+        begin = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - begin
+
+        self.stdout.write(
+            "%-12s sent=%s elapsed=%.2fs rate=%.1f msg/s" % (
+                label, server.received, elapsed, server.received / elapsed
+            )
+        )
@@ -0,0 +1,101 @@
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.db.models import Q
+
+from utils.generals import get_model
+from apps.person.utils.auth import normalize_identifier
+from apps.person.utils.constants import LOGIN_USERNAME, LOGIN_EMAIL, LOGIN_MSISDN
+from apps.person.management.commands._benchmark import BenchmarkCommand
+
+User = get_model('person', 'User')
+Account = get_model('person', 'Account')
+LoginIdentifier = get_model('person', 'LoginIdentifier')
+
+
+class Command(BenchmarkCommand):
+    """
+    Compare login lookup, old OR/iexact join vs LoginIdentifier point lookup.
+    Password hashing not measured, same cost for both.
+
+        python manage.py benchmark_login --users 1000000 --samples 2000
+
+    Seeded users inserted inside a transaction and rolled back at the end.
+    """
+    help = "Measure login identifier lookup latency"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=0,
+                            help="Fake users to seed, 0 use existing data")
+        parser.add_argument('--samples', type=int, default=1000)
+        parser.add_argument('--chunk-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            if options['users']:
+                self.seed(options['users'], options['chunk_size'])
+
+            identifiers = list(
+                LoginIdentifier.objects
+                .order_by('?')
+                .values_list('identifier', flat=True)[:options['samples']]
+            )
+            if not identifiers:
+                self.stdout.write(self.style.ERROR("No login identifier, seed users first."))
+                return
+
+            not_found = (User.DoesNotExist, User.MultipleObjectsReturned,
+                         LoginIdentifier.DoesNotExist)
+            self.report('legacy', self.measure(self.legacy_lookup, identifiers, not_found))
+            self.report('identifier', self.measure(self.identifier_lookup, identifiers, not_found))
+
+            # leave database as before
+            transaction.set_rollback(True)
+
+    def seed(self, count, chunk_size):
+        password = make_password('benchmark')
+        start = User.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+        for offset in range(0, count, chunk_size):
+            size = min(chunk_size, count - offset)
+            names = ['bench%s' % (start + offset + i) for i in range(size)]
+
+            users = User.objects.bulk_create([
+                User(username=name, email='%s@example.com' % name, password=password)
+                for name in names
+            ])
+            users = User.objects.filter(username__in=names).only('id', 'username', 'email')
+
+            accounts = list()
+            identifiers = list()
+            for user in users:
+                msisdn = '08%s' % str(user.id).zfill(10)
+                accounts.append(Account(user_id=user.id, email=user.email, email_verified=True,
+                                        msisdn=msisdn, msisdn_verified=True))
+                identifiers.extend([
+                    LoginIdentifier(user_id=user.id, kind=LOGIN_USERNAME,
+                                    identifier=normalize_identifier(user.username)),
+                    LoginIdentifier(user_id=user.id, kind=LOGIN_EMAIL,
+                                    identifier=normalize_identifier(user.email)),
+                    LoginIdentifier(user_id=user.id, kind=LOGIN_MSISDN, identifier=msisdn),
+                ])
+
+            Account.objects.bulk_create(accounts)
+            LoginIdentifier.objects.bulk_create(identifiers, ignore_conflicts=True)
+            self.stdout.write("%s users seeded" % (offset + size))
+
+    def legacy_lookup(self, username):
+        # query used by LoginBackend before login identifier
+        return User.objects \
+            .filter(
+                Q(username__iexact=username)
+                | Q(email__iexact=username)
+                | Q(account__msisdn=username)
+                & Q(account__msisdn_verified=True)) \
+            .get(Q(username__iexact=username) | Q(email__iexact=username)
+                 | Q(account__msisdn=username)
+                 & Q(account__msisdn_verified=True))
+
+    def identifier_lookup(self, username):
+        return LoginIdentifier.objects \
+            .select_related('user', 'user__profile', 'user__account') \
+            .get(identifier=normalize_identifier(username)).user
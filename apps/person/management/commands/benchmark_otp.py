@@ -0,0 +1,100 @@
+from django.db import transaction
+from django.db.models import Q, Case, When, Value
+from django.utils import timezone
+
+from utils.generals import get_model
+from apps.person.models.otp import otp_target_q
+from apps.person.utils.constants import REGISTER_VALIDATION, PASSWORD_RECOVERY
+from apps.person.management.commands._benchmark import BenchmarkCommand
+
+OTPFactory = get_model('person', 'OTPFactory')
+
+
+class Command(BenchmarkCommand):
+    """
+    Compare OTP validate lookup, old CASE comparison vs plain indexed
+    predicate. Query plan of both printed with EXPLAIN.
+
+        python manage.py benchmark_otp --codes 1000000 --samples 2000
+
+    Seeded codes inserted inside a transaction and rolled back at the end.
+    """
+    help = "Measure OTP lookup latency and show query plan"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--codes', type=int, default=0,
+                            help="Fake OTP codes to seed, 0 use existing data")
+        parser.add_argument('--samples', type=int, default=1000)
+        parser.add_argument('--chunk-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            if options['codes']:
+                self.seed(options['codes'], options['chunk_size'])
+
+            codes = list(
+                OTPFactory.objects
+                .filter(is_used=False, is_expired=False)
+                .order_by('?')
+                .values_list('email', 'msisdn', 'challenge', 'token', 'passcode')[:options['samples']]
+            )
+            if not codes:
+                self.stdout.write(self.style.ERROR("No OTP code, seed codes first."))
+                return
+
+            self.explain('legacy', self.legacy_queryset(*codes[0]))
+            self.explain('indexed', self.indexed_queryset(*codes[0]))
+
+            self.report('legacy', self.measure(
+                lambda code: list(self.legacy_queryset(*code)[:2]), codes))
+            self.report('indexed', self.measure(
+                lambda code: list(self.indexed_queryset(*code)[:2]), codes))
+
+            # leave database as before
+            transaction.set_rollback(True)
+
+    def seed(self, count, chunk_size):
+        valid_until = timezone.now() + timezone.timedelta(hours=2)
+        challenges = [REGISTER_VALIDATION, PASSWORD_RECOVERY]
+
+        for offset in range(0, count, chunk_size):
+            size = min(chunk_size, count - offset)
+            codes = list()
+            for i in range(offset, offset + size):
+                # half by email, half by msisdn
+                target = {'email': 'bench%s@example.com' % i} if i % 2 \
+                    else {'msisdn': '08%s' % str(i).zfill(10)}
+
+                codes.append(OTPFactory(
+                    token='BENCH%s' % i, passcode=str(i).zfill(6)[-6:],
+                    challenge=challenges[i % 2], valid_until=valid_until,
+                    valid_until_timestamp=int(valid_until.timestamp()),
+                    is_verified=bool(i % 3), is_used=i % 5 == 0, **target
+                ))
+
+            # bulk_create skip save(), code not generated and not sent
+            OTPFactory.objects.bulk_create(codes)
+            self.stdout.write("%s codes seeded" % (offset + size))
+
+    def legacy_queryset(self, email, msisdn, challenge, token, passcode):
+        # query used by OTPFactoryQuerySet before indexed predicate
+        return OTPFactory.objects.filter(
+            Q(email=Case(When(email__isnull=False, then=Value(email))))
+            | Q(msisdn=Case(When(msisdn__isnull=False, then=Value(msisdn)))),
+            Q(is_verified=False), Q(is_used=False), Q(is_expired=False),
+            Q(token=token), Q(passcode=passcode), Q(challenge=challenge)
+        )
+
+    def indexed_queryset(self, email, msisdn, challenge, token, passcode):
+        q_target = otp_target_q(email=email, msisdn=msisdn)
+        if q_target is None:
+            return OTPFactory.objects.none()
+
+        return OTPFactory.objects \
+            .filter(is_verified=False, is_used=False, is_expired=False,
+                    token=token, passcode=passcode, challenge=challenge) \
+            .filter(q_target)
+
+    def explain(self, label, queryset):
+        self.stdout.write(self.style.MIGRATE_HEADING("EXPLAIN %s" % label))
+        self.stdout.write(queryset.explain())
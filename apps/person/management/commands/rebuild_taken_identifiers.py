@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from apps.person.utils.availability import rebuild_taken_identifiers
+
+
+class Command(BaseCommand):
+    help = "Build Redis sets of used username, email and msisdn for availability check"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        total = rebuild_taken_identifiers(
+            chunk_size=options['chunk_size'],
+            progress=lambda total: self.stdout.write("%s users added" % total)
+        )
+        self.stdout.write(self.style.SUCCESS("Done, %s users." % total))
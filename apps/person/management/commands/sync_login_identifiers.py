@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from utils.generals import get_model
+from apps.person.utils.auth import get_login_identifiers
+
+User = get_model('person', 'User')
+LoginIdentifier = get_model('person', 'LoginIdentifier')
+
+
+class Command(BaseCommand):
+    help = "Build login identifiers of all users, run once before use LoginBackend"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        last_id = 0
+        total = 0
+
+        while True:
+            users = list(
+                User.objects
+                .select_related('account')
+                .filter(id__gt=last_id)
+                .order_by('id')[:chunk_size]
+            )
+            if not users:
+                break
+
+            objs = list()
+            for user in users:
+                for kind, identifier in get_login_identifiers(user).items():
+                    objs.append(LoginIdentifier(user_id=user.id, kind=kind, identifier=identifier))
+
+            with transaction.atomic():
+                LoginIdentifier.objects.filter(user_id__in=[user.id for user in users]).delete()
+                # identifier used by more than one user, first one win
+                LoginIdentifier.objects.bulk_create(objs, ignore_conflicts=True)
+
+            last_id = users[-1].id
+            total += len(users)
+            self.stdout.write("%s users synced" % total)
+
+        self.stdout.write(self.style.SUCCESS("Done, %s users." % total))
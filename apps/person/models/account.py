@@ -3,16 +3,16 @@ import uuid
 from django.conf import settings
 from django.db import models
 from django.utils.translation import ugettext_lazy as _
-from django.core.exceptions import ValidationError, ObjectDoesNotExist
+from django.core.exceptions import ValidationError
 from django.core.validators import validate_email
 
-from utils.generals import get_model
 from utils.validators import non_python_keyword, IDENTIFIER_VALIDATOR
 from apps.person.utils.constants import (
     EMAIL_VALIDATION,
     MSISDN_VALIDATION,
     UNDEFINED,
-    GENDER_CHOICES
+    GENDER_CHOICES,
+    LOGIN_IDENTIFIER_KINDS
 )
 
 
@@ -59,10 +59,9 @@ class AbstractAccount(models.Model):
         if self.email_verified == True:
             raise ValidationError(_(u"Email has verified."))
 
-        OTPFactory = get_model('person', 'OTPFactory')
-        try:
-            OTPFactory.objects.get_verified_unused(email=self.email, challenge=EMAIL_VALIDATION)
-        except ObjectDoesNotExist:
+        from apps.person.utils.otp import get_otp_storage
+
+        if not get_otp_storage().has_verified(email=self.email, challenge=EMAIL_VALIDATION):
             raise ValidationError(_(u"OTP code invalid."))
 
         self.email_verified = True
@@ -72,16 +71,39 @@ class AbstractAccount(models.Model):
         if self.msisdn_verified == True:
             raise ValidationError(_(u"MSISDN has verified."))
 
-        OTPFactory = get_model('person', 'OTPFactory')
-        try:
-            OTPFactory.objects.get_verified_unused(msisdn=self.msisdn, challenge=MSISDN_VALIDATION)
-        except ObjectDoesNotExist:
+        from apps.person.utils.otp import get_otp_storage
+
+        if not get_otp_storage().has_verified(msisdn=self.msisdn, challenge=MSISDN_VALIDATION):
             raise ValidationError(_(u"OTP code invalid."))
 
         self.msisdn_verified = True
         self.save()
 
 
+class AbstractLoginIdentifier(models.Model):
+    """
+    Normalized username, verified email and verified msisdn of the user.
+    Login resolved with one unique index lookup.
+    Maintained by `apps.person.utils.auth.sync_login_identifiers`
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE,
+                             related_name='login_identifiers')
+    kind = models.CharField(choices=LOGIN_IDENTIFIER_KINDS, max_length=15)
+    identifier = models.CharField(max_length=255, unique=True)
+
+    class Meta:
+        abstract = True
+        app_label = 'person'
+        verbose_name = _(u"Login Identifier")
+        verbose_name_plural = _(u"Login Identifiers")
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'kind'], name='unique_user_login_kind')
+        ]
+
+    def __str__(self):
+        return self.identifier
+
+
 class AbstractProfile(models.Model):
     _UPLOAD_TO = 'images/user'
 
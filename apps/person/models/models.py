@@ -60,3 +60,12 @@ if not is_model_registered('person', 'OTPFactory'):
             db_table = 'person_otp_factory'
 
     __all__.append('OTPFactory')
+
+
+# 5
+if not is_model_registered('person', 'LoginIdentifier'):
+    class LoginIdentifier(AbstractLoginIdentifier):
+        class Meta(AbstractLoginIdentifier.Meta):
+            db_table = 'person_login_identifier'
+
+    __all__.append('LoginIdentifier')
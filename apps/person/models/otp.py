@@ -4,7 +4,7 @@ import pyotp
 from django.contrib.auth import get_user_model
 from django.conf import settings
 from django.db import models
-from django.db.models import Q, F, Prefetch, Case, When, Value
+from django.db.models import Q, F
 from django.utils.translation import ugettext_lazy as _
 from django.core.validators import RegexValidator, ValidationError, validate_email
 from django.core.exceptions import ObjectDoesNotExist
@@ -16,40 +16,37 @@ from apps.person.utils.constants import (
     OTP_CHALLENGE,
     PASSWORD_RECOVERY,
     CHANGE_EMAIL,
-    REGISTER_VALIDATION
+    REGISTER_VALIDATION,
+    LOGIN_EMAIL
 )
 
 User = get_model('person', 'User')
 
 
-class OTPFactoryQuerySet(models.query.QuerySet):
-    def get_verified_unused(self, email=None, msisdn=None, token=None,
-                            challenge=None, uuid=None, passcode=None):
-        q_uuid = Q()
-        if uuid:
-            q_uuid = Q(uuid=uuid)
+def otp_target_q(email=None, msisdn=None, email_field='email', msisdn_field='msisdn'):
+    """
+    Plain `email = %s OR msisdn = %s` of given values, so index can be used.
+    None when no target given, empty Q() would match every row.
+    """
+    if not email and not msisdn:
+        return None
 
-        q_passcode = Q()
-        if passcode:
-            q_passcode = Q(passcode=passcode)
+    q = Q()
+    if email:
+        q |= Q(**{email_field: email})
 
-        q_token = Q()
-        if token:
-            q_token = Q(token=token)
+    if msisdn:
+        q |= Q(**{msisdn_field: msisdn})
+    return q
 
-        q_challenge = Q()
-        if challenge:
-            q_challenge = Q(challenge=challenge)
 
-        return self.get(
-            Q(email=Case(When(email__isnull=False, then=Value(email))))
-            | Q(msisdn=Case(When(msisdn__isnull=False, then=Value(msisdn)))),
-            Q(is_verified=True), Q(is_used=False), Q(is_expired=False),
-            q_uuid, q_passcode, q_token, q_challenge
-        )
+class OTPFactoryQuerySet(models.query.QuerySet):
+    def _filter_unused(self, is_verified, email=None, msisdn=None, token=None,
+                       challenge=None, uuid=None, passcode=None):
+        q_target = otp_target_q(email=email, msisdn=msisdn)
+        if q_target is None:
+            return self.none()
 
-    def get_unverified_unused(self, email=None, msisdn=None, token=None,
-                              challenge=None, uuid=None, passcode=None):
         q_uuid = Q()
         if uuid:
             q_uuid = Q(uuid=uuid)
@@ -66,13 +63,20 @@ class OTPFactoryQuerySet(models.query.QuerySet):
         if challenge:
             q_challenge = Q(challenge=challenge)
 
-        return self.get(
-            Q(email=Case(When(email__isnull=False, then=Value(email))))
-            | Q(msisdn=Case(When(msisdn__isnull=False, then=Value(msisdn)))),
-            Q(is_verified=False), Q(is_used=False), Q(is_expired=False),
+        return self.filter(
+            q_target, Q(is_verified=is_verified), Q(is_used=False), Q(is_expired=False),
             q_uuid, q_passcode, q_token, q_challenge
         )
 
+    def filter_verified_unused(self, **kwargs):
+        return self._filter_unused(True, **kwargs)
+
+    def get_verified_unused(self, **kwargs):
+        return self._filter_unused(True, **kwargs).get()
+
+    def get_unverified_unused(self, **kwargs):
+        return self._filter_unused(False, **kwargs).get()
+
 
 class AbstractOTPFactory(models.Model):
     """
@@ -123,6 +127,12 @@ class AbstractOTPFactory(models.Model):
         app_label = 'person'
         verbose_name = _(u"OTP Factory")
         verbose_name_plural = _(u"OTP Factories")
+        indexes = [
+            models.Index(fields=["email", "challenge", "is_used", "is_expired"],
+                         name="%(app_label)s_%(class)s_email"),
+            models.Index(fields=["msisdn", "challenge", "is_used", "is_expired"],
+                         name="%(app_label)s_%(class)s_msisdn"),
+        ]
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -131,30 +141,30 @@ class AbstractOTPFactory(models.Model):
         return self.passcode
 
     def clean(self):
-        if not self.pk and not self.user:
-            user_query = User.objects \
-                .prefetch_related(Prefetch('account')) \
-                .select_related('account')
+        from apps.person.utils.availability import maybe_taken
 
+        if not self.pk and not self.user:
             if self.email:
                 try:
                     validate_email(self.email)
                 except ValidationError as e:
                     raise ValidationError(_(e.message))
 
-                # Registration each account has different email
-                if self.challenge == REGISTER_VALIDATION:
-                    user_query = user_query.filter(email=self.email, account__email_verified=True)
-                    if user_query.exists():
-                        raise ValidationError(_(u"Email `{email}` sudah terdaftar.".format(email=self.email)))
+                # Registration each account has different email, new email
+                # answered by Redis sets of verified email without database
+                if self.challenge == REGISTER_VALIDATION \
+                        and maybe_taken(self.email, kinds=[LOGIN_EMAIL]) \
+                        and User.objects.filter(email=self.email,
+                                                account__email_verified=True).exists():
+                    raise ValidationError(_(u"Email `{email}` sudah terdaftar.".format(email=self.email)))
 
-            # Reset password make sure account exist
+            # Reset password make sure account exist, unverified email
+            # and msisdn not in Redis sets so database still checked
             if self.challenge == PASSWORD_RECOVERY or self.challenge == CHANGE_EMAIL:
-                user_query = user_query.filter(
-                    Q(email=Case(When(email__isnull=False, then=Value(self.email))))
-                    | Q(account__msisdn=Case(When(account__msisdn__isnull=False, then=Value(self.msisdn)))))
+                q_target = otp_target_q(email=self.email, msisdn=self.msisdn,
+                                        msisdn_field='account__msisdn')
 
-                if not user_query.exists():
+                if q_target is None or not User.objects.filter(q_target).exists():
                     raise ValidationError(_(u"Akun tidak ditemukan."))
 
             if self.challenge not in dict(OTP_CHALLENGE):
@@ -36,6 +36,8 @@ class AbstractRole(models.Model):
         ordering = ['-user__date_joined']
         verbose_name = _(u"Role")
         verbose_name_plural = _(u"Roles")
+        constraints = [models.UniqueConstraint(
+            fields=['user', 'identifier'], name='unique_user_role')]
 
     def __str__(self):
         return self.identifier
@@ -1,61 +1,51 @@
 import os
 
-from django.db import transaction, IntegrityError
-from django.db.models import Q, F, Case, When, Value
+from django.db import transaction
+from django.db.models import Q, F
 from django.utils import timezone
 from django.core.exceptions import ObjectDoesNotExist
 
 from utils.generals import get_model
-from apps.person.utils.constants import ROLE_DEFAULTS
-from apps.person.utils.auth import set_roles
-
-# Celery task
-from apps.person.tasks import send_otp_email
+from apps.person.utils.auth import (
+    invalidate_token_users, sync_login_identifiers, invalidate_user_snapshot,
+    invalidate_role_capabilities, get_login_identifiers
+)
+from apps.person.utils.availability import mark_taken
+from apps.person.utils.provisioning import provision_user
+from apps.person.utils.mail import queue_otp_email
+from apps.person.models.otp import otp_target_q
 
 Account = get_model('person', 'Account')
 Profile = get_model('person', 'Profile')
-Role = get_model('person', 'Role')
-DeliveryAddress = get_model('commerce', 'DeliveryAddress')
 
 
 @transaction.atomic
 def user_save_handler(sender, instance, created, **kwargs):
     if created:
-        account = getattr(instance, 'account', None)
-        if account is None:
-            try:
-                Account.objects.create(user=instance, email=instance.email,
-                                       email_verified=True)
-            except IntegrityError:
-                pass
-
-        profile = getattr(instance, 'profile', None)
-        if profile is None:
-            try:
-                Profile.objects.create(user=instance)
-            except IntegrityError:
-                pass
-        
-        delivery_address = getattr(instance, 'deliveryaddress', None)
-        if delivery_address is None:
-            try:
-                DeliveryAddress.objects.create(user=instance)
-            except IntegrityError:
-                pass
-
-        # Set roles if created by admin
-        roles = getattr(instance, 'roles_value', None)
-        if roles is None:
-            # Set roles on register
-            Role.objects.create(user=instance)
-
-            # set default roles
-            roles = list()
-            for item in ROLE_DEFAULTS:
-                roles.append(item[0])
-        set_roles(user=instance, roles=roles)
+        # roles set if created by admin, default roles on register
+        provision_user(instance, roles=getattr(instance, 'roles_value', None))
 
     if not created:
+        user_id = instance.id
+        transaction.on_commit(lambda: invalidate_user_snapshot(user_id))
+
+        # password changed or deactivated, drop cached websocket user
+        if not instance.is_active or getattr(instance, '_password', None) is not None:
+            transaction.on_commit(lambda: invalidate_token_users(user_id))
+
+        # login only update last_login, account and profile untouched
+        update_fields = kwargs.get('update_fields', None)
+        if update_fields and set(update_fields) <= {'last_login'}:
+            return
+
+        # snapshot user (CachedJWTAuthentication) carry cached account and
+        # profile, load them again so stale values not written back
+        if getattr(instance, '_from_snapshot', False):
+            for model in (Account, Profile):
+                related = model._meta.get_field('user').remote_field
+                if related.is_cached(instance):
+                    related.delete_cached_value(instance)
+
         # create Account if not exist
         if not hasattr(instance, 'account'):
             Account.objects.create(user=instance, email=instance.email,
@@ -69,26 +59,52 @@ def user_save_handler(sender, instance, created, **kwargs):
             Profile.objects.create(user=instance)
 
 
+def user_delete_handler(sender, instance, **kwargs):
+    user_id = instance.id
+    transaction.on_commit(lambda: invalidate_token_users(user_id))
+    transaction.on_commit(lambda: invalidate_user_snapshot(user_id))
+
+
+def account_save_handler(sender, instance, created, **kwargs):
+    # user save always save the account too, see user_save_handler
+    sync_login_identifiers(instance.user, account=instance)
+    mark_taken(get_login_identifiers(instance.user, account=instance))
+
+    user_id = instance.user_id
+    transaction.on_commit(lambda: invalidate_user_snapshot(user_id))
+
+
+def profile_save_handler(sender, instance, created, **kwargs):
+    user_id = instance.user_id
+    transaction.on_commit(lambda: invalidate_user_snapshot(user_id))
+
+
+def role_capabilities_change_handler(sender, **kwargs):
+    # role capability or its permissions changed
+    transaction.on_commit(invalidate_role_capabilities)
+
+
+def role_change_handler(sender, instance, **kwargs):
+    # role identifiers cached in user snapshot
+    user_id = instance.user_id
+    transaction.on_commit(lambda: invalidate_user_snapshot(user_id))
+
+
 @transaction.atomic
 def otpcode_save_handler(sender, instance, created, **kwargs):
     # create tasks
     # run only on resend and created
     if instance.is_used == False and instance.is_verified == False:
         if instance.email:
-            data = {
-                'email': getattr(instance, 'email', None),
-                'passcode': getattr(instance, 'passcode', None)
-            }
-            send_otp_email.delay(data)
+            queue_otp_email(instance.email, instance.passcode)
 
         # mark older OTP Code to expired
-        oldest = instance.__class__.objects \
-            .filter(
-                Q(challenge=instance.challenge),
-                Q(is_used=False), Q(is_expired=False),
-                Q(email=Case(When(email__isnull=False, then=Value(instance.email))))
-                | Q(msisdn=Case(When(msisdn__isnull=False, then=Value(instance.msisdn))))
-            ).exclude(passcode=instance.passcode)
-
-        if oldest.exists():
-            oldest.update(is_expired=True)
+        q_target = otp_target_q(email=instance.email, msisdn=instance.msisdn)
+        if q_target is not None:
+            instance.__class__.objects \
+                .filter(
+                    Q(challenge=instance.challenge),
+                    Q(is_used=False), Q(is_expired=False),
+                    q_target
+                ).exclude(passcode=instance.passcode) \
+                .update(is_expired=True)
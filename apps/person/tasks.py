@@ -1,60 +1,64 @@
 import logging
-import smtplib
 
-from django.conf import settings
 from django.utils.translation import ugettext_lazy as _
-from django.core.mail import BadHeaderError, EmailMultiAlternatives
 
 # Celery config
 from celery import shared_task
 
+from apps.person.utils.mail import queue_otp_email, flush_mail_queue
+from apps.person.utils.sessions import purge_database_sessions as _purge_database_sessions
+
 
 @shared_task
 def send_otp_email(data):
-    logging.info(_(u"Send OTP email run."))
-
+    """Kept for task already in broker, new code use `queue_otp_email`"""
     to = data.get('email', None)
     passcode = data.get('passcode', None)
 
     if to and passcode:
-        subject = _(u"Validasi OTP")
-        from_email = '%s <hellopuyup@gmail.com>' % (settings.PROJECT_NAME)
-
-        # Message
-        text = _(
-            "JANGAN BERIKAN KODE OTP ini kepada siapapun "
-            "TERMASUK PIHAK %(site_name)s. Kode OTP Anda: " +
-            passcode
-        ) % {'site_name': settings.PROJECT_NAME}
-
-        html = _(
-            "JANGAN BERIKAN KODE OTP ini kepada siapapun "
-            "TERMASUK PIHAK %(site_name)s.<br />"
-            "Kode OTP Anda: "
-            "<strong>" + passcode + "</strong>"
-            "<br /><br />"
-            "Salam, <br /> <strong>%(site_name)s</strong>"
-        ) % {'site_name': settings.PROJECT_NAME}
-
-        if subject and from_email:
-            try:
-                msg = EmailMultiAlternatives(subject, text, from_email, [to])
-                msg.attach_alternative(html, "text/html")
-                msg.send()
-                logging.info(_(u"OTP email success."))
-            except smtplib.SMTPConnectError as e:
-                logging.error('SMTPConnectError: %s' % e)
-            except smtplib.SMTPAuthenticationError as e:
-                logging.error('SMTPAuthenticationError: %s' % e)
-            except smtplib.SMTPSenderRefused as e:
-                logging.error('SMTPSenderRefused: %s' % e)
-            except smtplib.SMTPRecipientsRefused as e:
-                logging.error('SMTPRecipientsRefused: %s' % e)
-            except smtplib.SMTPDataError as e:
-                logging.error('SMTPDataError: %s' % e)
-            except smtplib.SMTPException as e:
-                logging.error('SMTPException: %s' % e)
-            except BadHeaderError:
-                logging.warning(_(u"Invalid header found."))
+        queue_otp_email(to, passcode)
     else:
         logging.warning(_(u"Tried to send email to non-existing OTP Code."))
+
+
+@shared_task
+def deliver_email_batch():
+    logging.info(_(u"Deliver email batch run."))
+    return flush_mail_queue()
+
+
+@shared_task
+def purge_database_sessions():
+    """Hourly from beat, bounded by SESSION_PURGE_MAX_CHUNKS"""
+    deleted = _purge_database_sessions()
+    logging.info(_(u"Database sessions purged: %s.") % deleted)
+    return deleted
+
+
+@shared_task
+def write_otp_audit(action, data):
+    """
+    Keep OTPFactory row of code stored outside database, for admin and report.
+    Row written without `save()`, so code not generated or sent again.
+    """
+    from django.utils.dateparse import parse_datetime
+    from utils.generals import get_model
+
+    OTPFactory = get_model('person', 'OTPFactory')
+
+    fields = {
+        'email': data.get('email'),
+        'msisdn': data.get('msisdn'),
+        'challenge': data.get('challenge'),
+        'token': data.get('token'),
+        'passcode': data.get('passcode'),
+        'valid_until': parse_datetime(data.get('valid_until')),
+        'is_verified': action in ('verified', 'used'),
+        'is_used': action == 'used',
+    }
+
+    # code renewed with the same uuid
+    updated = OTPFactory.objects.filter(uuid=data['uuid']).update(**fields)
+    if not updated and action == 'created':
+        fields['valid_until_timestamp'] = int(fields['valid_until'].timestamp())
+        OTPFactory.objects.bulk_create([OTPFactory(uuid=data['uuid'], **fields)])
@@ -0,0 +1,668 @@
+import base64
+import io
+import json
+import smtplib
+import uuid
+
+from unittest import mock
+
+from datetime import timedelta
+
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.contrib.auth import authenticate
+from django.contrib.auth.hashers import check_password as auth_check_password
+from django.contrib.auth.models import Permission
+from django.test import override_settings
+from django.utils import timezone
+
+from PIL import Image
+from rest_framework import serializers
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from utils.cache import TwoLevelCache
+from utils.generals import get_model
+from utils.testcases import RedisTestCase, execute_on_commit
+from apps.person.api.profile.serializers import ProfileSerializer
+from apps.person.models.otp import otp_target_q
+from apps.person.utils import auth, images, mail
+from apps.person.utils.availability import (
+    mark_taken, maybe_taken, rebuild_taken_identifiers, READY_KEY
+)
+from apps.person.utils.constants import (
+    LOGIN_EMAIL, LOGIN_USERNAME, REGISTER_VALIDATION, PASSWORD_RECOVERY, ROLE_DEFAULTS
+)
+from apps.person.utils.otp import DatabaseOTPStorage, RedisOTPStorage
+from apps.person.utils.provisioning import provision_user, set_verified_msisdn
+from apps.person.utils.sessions import purge_database_sessions
+
+User = get_model('person', 'User')
+Account = get_model('person', 'Account')
+LoginIdentifier = get_model('person', 'LoginIdentifier')
+OTPFactory = get_model('person', 'OTPFactory')
+Profile = get_model('person', 'Profile')
+Role = get_model('person', 'Role')
+DeliveryAddress = get_model('commerce', 'DeliveryAddress')
+RoleCapabilities = get_model('person', 'RoleCapabilities')
+
+
+class TokenUserCacheTest(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='tokenuser', email='token@example.com',
+                                             password='secret')
+        self.token = str(AccessToken.for_user(self.user))
+
+    def test_user_cached_by_token(self):
+        self.assertEqual(auth.get_user_from_token(self.token).id, self.user.id)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(auth.get_user_from_token(self.token).id, self.user.id)
+
+    def test_local_copy_dropped_after_invalidate_on_other_process(self):
+        self.assertTrue(auth.get_user_from_token(self.token).is_authenticated)
+
+        # other process bump the generation, local LRU here untouched
+        User.objects.filter(id=self.user.id).update(is_active=False)
+        cache.set(auth._token_generation_key(self.user.id), 1, timeout=None)
+
+        self.assertFalse(auth.get_user_from_token(self.token).is_authenticated)
+
+
+class TwoLevelCacheTest(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cache = TwoLevelCache('test', local_timeout=60)
+        # same shared cache, own local LRU
+        self.other_process = TwoLevelCache('test', local_timeout=60)
+
+    def test_delete_seen_by_other_process(self):
+        self.cache.set('key', 'old')
+        self.assertEqual(self.other_process.get('key'), 'old')
+
+        self.cache.delete('key')
+        self.assertIsNone(self.other_process.get('key'))
+
+    def test_value_loaded_before_delete_ignored(self):
+        value, version = self.cache.get_versioned('key')
+        self.assertIsNone(value)
+
+        # invalidated while the reader load from database
+        self.other_process.delete('key')
+        self.cache.set('key', 'stale', version=version)
+
+        self.assertIsNone(self.cache.get('key'))
+        self.assertIsNone(self.other_process.get('key'))
+
+    def test_get_or_set(self):
+        self.assertEqual(self.cache.get_or_set('key', lambda: 'loaded'), 'loaded')
+        self.assertEqual(self.cache.get_or_set('key', lambda: 'again'), 'loaded')
+        self.assertIsNone(self.cache.get_or_set('missing', lambda: None))
+
+
+class UserSnapshotTest(RedisTestCase):
+    def test_deactivated_user_rejected_by_every_process(self):
+        user = User.objects.create_user(username='snapshot', email='snapshot@example.com',
+                                        password='secret')
+        self.assertTrue(auth.get_user_snapshot(user.id).is_active)
+
+        with self.assertNumQueries(0):
+            auth.get_user_snapshot(user.id)
+
+        # saved on other process: only shared version bumped
+        User.objects.filter(id=user.id).update(is_active=False)
+        TwoLevelCache('user_snapshot').delete(user.id)
+
+        self.assertFalse(auth.get_user_snapshot(user.id).is_active)
+
+    def test_save_not_write_stale_account(self):
+        user = User.objects.create_user(username='snapshot', email='snapshot@example.com',
+                                        password='secret')
+        snapshot = auth.get_user_snapshot(user.id)
+        self.assertEqual(snapshot._state.db, 'default')
+
+        # changed after the snapshot cached
+        Account.objects.filter(user_id=user.id).update(msisdn='08123456789')
+
+        snapshot.first_name = 'Changed'
+        snapshot.save(update_fields=['first_name'])
+        self.assertEqual(Account.objects.get(user_id=user.id).msisdn, '08123456789')
+
+
+class PurgeSessionTest(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        now = timezone.now()
+        for i in range(5):
+            Session.objects.create(session_key='expired%s' % i, session_data='',
+                                   expire_date=now - timedelta(days=1))
+        Session.objects.create(session_key='active', session_data='',
+                               expire_date=now + timedelta(days=1))
+
+    @override_settings(SESSION_ENGINE='django.contrib.sessions.backends.db')
+    def test_database_engine_keep_active_sessions(self):
+        self.assertEqual(purge_database_sessions(chunk_size=2), 5)
+        self.assertEqual(list(Session.objects.values_list('session_key', flat=True)), ['active'])
+
+    @override_settings(SESSION_ENGINE='django.contrib.sessions.backends.cache')
+    def test_cache_engine_delete_every_row(self):
+        with self.assertNumQueries(2 * 3 + 1):
+            self.assertEqual(purge_database_sessions(chunk_size=2), 6)
+        self.assertFalse(Session.objects.exists())
+
+
+class LoginBackendTest(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='Budi', email='budi@example.com',
+                                             password='secret')
+        Account.objects.filter(user=self.user) \
+            .update(email_verified=True, msisdn='08123456789', msisdn_verified=True)
+        auth.sync_login_identifiers(User.objects.get(id=self.user.id))
+
+    def test_login_with_each_identifier(self):
+        for username in ('budi', ' BUDI ', 'Budi@Example.com', '08123456789'):
+            with self.assertNumQueries(1):
+                user = authenticate(username=username, password='secret')
+            self.assertEqual(user, self.user, username)
+
+    def test_wrong_password_or_unknown_identifier(self):
+        self.assertIsNone(authenticate(username='budi', password='wrong'))
+        self.assertIsNone(authenticate(username='nobody', password='secret'))
+
+    def test_unverified_msisdn_rejected(self):
+        Account.objects.filter(user=self.user).update(msisdn_verified=False)
+        auth.sync_login_identifiers(User.objects.get(id=self.user.id))
+        self.assertIsNone(authenticate(username='08123456789', password='secret'))
+
+    def test_user_without_identifier_fallback_and_synced(self):
+        LoginIdentifier.objects.filter(user=self.user).delete()
+
+        self.assertEqual(authenticate(username='budi@example.com', password='secret'), self.user)
+        self.assertEqual(LoginIdentifier.objects.filter(user=self.user).count(), 3)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(authenticate(username='08123456789', password='secret'), self.user)
+
+    def test_fallback_not_synced_on_wrong_password(self):
+        LoginIdentifier.objects.filter(user=self.user).delete()
+
+        self.assertIsNone(authenticate(username='budi', password='wrong'))
+        self.assertFalse(LoginIdentifier.objects.filter(user=self.user).exists())
+
+    @override_settings(LOGIN_IDENTIFIER_FALLBACK=False)
+    def test_fallback_off(self):
+        LoginIdentifier.objects.filter(user=self.user).delete()
+        self.assertIsNone(authenticate(username='budi', password='secret'))
+
+
+class TokenLoginTest(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='session', email='session@example.com',
+                                             password='secret')
+
+    @override_settings(LOGIN_WITH_JWT=True)
+    def test_session_login_hash_password_once(self):
+        client = APIClient()
+        with mock.patch('django.contrib.auth.base_user.check_password',
+                        wraps=auth_check_password) as check:
+            response = client.post('/api/person/token/',
+                                   {'username': 'session', 'password': 'secret'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('access', response.data)
+        self.assertEqual(check.call_count, 1)
+        self.assertEqual(client.session['_auth_user_id'], str(self.user.id))
+
+        self.user.refresh_from_db()
+        self.assertIsNotNone(self.user.last_login)
+
+    def test_wrong_password_not_logged_in(self):
+        client = APIClient()
+        response = client.post('/api/person/token/', {'username': 'session', 'password': 'wrong'})
+
+        self.assertEqual(response.status_code, 401)
+        self.assertNotIn('_auth_user_id', client.session)
+
+
+class OTPStorageTests:
+    """Same behaviour expected from every storage"""
+    storage_class = None
+
+    def setUp(self):
+        super().setUp()
+        self.storage = self.storage_class()
+
+        for module in ('apps.person.utils.otp', 'apps.person.signals'):
+            patcher = mock.patch('%s.queue_otp_email' % module)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_create_renew_pending_code(self):
+        otp, created = self.storage.create(REGISTER_VALIDATION, email='new@example.com')
+        self.assertTrue(created)
+
+        renewed, created = self.storage.create(REGISTER_VALIDATION, email='new@example.com')
+        self.assertFalse(created)
+        self.assertEqual(renewed.uuid, otp.uuid)
+        self.assertTrue(self.storage.has_active(email='new@example.com'))
+        self.assertFalse(self.storage.has_active(email='other@example.com'))
+
+    def test_verify_then_use_once(self):
+        otp, created = self.storage.create(REGISTER_VALIDATION, msisdn='08123456789')
+
+        pending = self.storage.get_unverified_unused(
+            msisdn='08123456789', challenge=REGISTER_VALIDATION, passcode=otp.passcode)
+        pending.validate()
+
+        self.assertTrue(self.storage.has_verified(msisdn='08123456789',
+                                                  challenge=REGISTER_VALIDATION))
+        verified = self.storage.get_verified_unused(
+            msisdn='08123456789', challenge=REGISTER_VALIDATION)
+        verified.mark_used()
+
+        self.assertFalse(self.storage.has_verified(msisdn='08123456789',
+                                                   challenge=REGISTER_VALIDATION))
+        with self.assertRaises(OTPFactory.DoesNotExist):
+            self.storage.get_verified_unused(msisdn='08123456789', challenge=REGISTER_VALIDATION)
+
+    def test_wrong_passcode_or_challenge(self):
+        self.storage.create(REGISTER_VALIDATION, email='new@example.com')
+
+        with self.assertRaises(OTPFactory.DoesNotExist):
+            self.storage.get_unverified_unused(email='new@example.com', passcode='000000x',
+                                               challenge=REGISTER_VALIDATION)
+
+        with self.assertRaises(OTPFactory.DoesNotExist):
+            self.storage.get_unverified_unused(email='new@example.com',
+                                               challenge=PASSWORD_RECOVERY)
+
+
+class DatabaseOTPStorageTest(OTPStorageTests, RedisTestCase):
+    storage_class = DatabaseOTPStorage
+
+    def test_has_verified_with_many_rows(self):
+        for item in range(2):
+            OTPFactory.objects.create(msisdn='08123456789', challenge=REGISTER_VALIDATION,
+                                      is_verified=True)
+
+        self.assertTrue(self.storage.has_verified(msisdn='08123456789',
+                                                  challenge=REGISTER_VALIDATION))
+
+
+class RedisOTPStorageTest(OTPStorageTests, RedisTestCase):
+    storage_class = RedisOTPStorage
+
+    def test_email_in_other_case(self):
+        otp, created = self.storage.create(REGISTER_VALIDATION, email='New@Example.com')
+
+        found = self.storage.get_unverified_unused(email='new@example.COM',
+                                                   challenge=REGISTER_VALIDATION)
+        self.assertEqual(found.uuid, otp.uuid)
+        self.assertTrue(self.storage.has_active(email='NEW@example.com'))
+
+    def test_verify_empty_passcode_rejected(self):
+        otp, created = self.storage.create(REGISTER_VALIDATION, email='new@example.com')
+        # broken hash, empty value must not match empty input
+        self.redis.hset(self.storage._code_key(otp.uuid), mapping={'token': '', 'passcode': ''})
+        otp.token, otp.passcode = '', ''
+
+        with self.assertRaises(ValidationError):
+            self.storage.verify(otp)
+        self.assertEqual(self.storage._load(otp.uuid)['state'], 'pending')
+
+    def test_no_database_query(self):
+        with self.assertNumQueries(0):
+            otp, created = self.storage.create(REGISTER_VALIDATION, email='new@example.com')
+            self.storage.get_unverified_unused(uuid=otp.uuid).validate()
+            self.storage.get_verified_unused(uuid=otp.uuid).mark_used()
+
+
+class AvailabilityTest(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='Taken', email='taken@example.com',
+                                             password='secret')
+        Account.objects.filter(user=self.user).update(email_verified=True)
+
+    def test_unknown_until_built(self):
+        self.assertTrue(maybe_taken('free@example.com'))
+
+    def test_member_after_rebuild(self):
+        self.assertEqual(rebuild_taken_identifiers(), 1)
+
+        self.assertTrue(maybe_taken('taken'))
+        self.assertTrue(maybe_taken('TAKEN@example.com', kinds=[LOGIN_EMAIL]))
+        self.assertFalse(maybe_taken('taken', kinds=[LOGIN_EMAIL]))
+        self.assertFalse(maybe_taken('free@example.com'))
+
+    def test_marked_while_rebuild_kept(self):
+        def progress(total):
+            mark_taken({LOGIN_EMAIL: 'new@example.com'})
+
+        rebuild_taken_identifiers(progress=progress)
+        self.assertTrue(maybe_taken('new@example.com', kinds=[LOGIN_EMAIL]))
+
+    def test_new_user_marked(self):
+        rebuild_taken_identifiers()
+        User.objects.create_user(username='fresh', email='fresh@example.com', password='secret')
+        self.assertTrue(maybe_taken('fresh', kinds=[LOGIN_USERNAME]))
+
+
+class OTPCleanTest(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        self.redis.set(READY_KEY, 1)
+
+    def test_new_email_checked_without_database(self):
+        with self.assertNumQueries(0):
+            OTPFactory(email='new@example.com', challenge=REGISTER_VALIDATION).clean()
+
+    def test_registered_email_rejected(self):
+        user = User.objects.create_user(username='taken', email='taken@example.com',
+                                        password='secret')
+        Account.objects.filter(user=user).update(email_verified=True)
+        mark_taken({LOGIN_EMAIL: 'taken@example.com'})
+
+        with self.assertRaises(ValidationError):
+            OTPFactory(email='taken@example.com', challenge=REGISTER_VALIDATION).clean()
+
+    def test_recovery_without_target_rejected(self):
+        User.objects.create_user(username='someone', email='someone@example.com',
+                                 password='secret')
+        self.assertIsNone(otp_target_q())
+
+        with self.assertRaises(ValidationError):
+            OTPFactory(challenge=PASSWORD_RECOVERY).clean()
+
+        with self.assertRaises(OTPFactory.DoesNotExist):
+            DatabaseOTPStorage().get_unverified_unused(challenge=PASSWORD_RECOVERY)
+
+
+@override_settings(OTP_THROTTLE_RATES={
+    'global': {
+        'partial_update': {'ip': (10, 60 * 60), 'target': (2, 60 * 60)},
+        'validate': {'ip': (10, 60 * 60), 'target': (3, 60 * 60)},
+    },
+    'default': {
+        'validate': {'ip': (10, 60 * 60), 'target': (2, 60 * 60)},
+    },
+})
+class OTPThrottleTest(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+
+        # storage created with in-memory Redis
+        patcher = mock.patch('apps.person.utils.otp._storage', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def validate(self, challenge, email='target@example.com'):
+        # without token and passcode, rejected after throttle
+        return self.client.post('/api/person/otps/validate/',
+                                {'email': email, 'challenge': challenge}, format='json')
+
+    def test_challenge_quota(self):
+        self.assertEqual(self.validate(REGISTER_VALIDATION).status_code, 406)
+        self.assertEqual(self.validate(REGISTER_VALIDATION).status_code, 406)
+
+        response = self.validate(REGISTER_VALIDATION)
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+
+    def test_rotate_challenge_not_reset_global_quota(self):
+        self.assertEqual(self.validate(REGISTER_VALIDATION).status_code, 406)
+        self.assertEqual(self.validate(PASSWORD_RECOVERY).status_code, 406)
+        self.assertEqual(self.validate('email_validation').status_code, 406)
+        self.assertEqual(self.validate('msisdn_validation').status_code, 429)
+
+        # other target still allowed
+        self.assertEqual(self.validate(REGISTER_VALIDATION, email='other@example.com').status_code, 406)
+
+    def test_resend_throttled_by_code(self):
+        url = '/api/person/otps/%s/' % uuid.uuid4()
+        self.assertEqual(self.client.patch(url, {}, format='json').status_code, 404)
+        self.assertEqual(self.client.patch(url, {}, format='json').status_code, 404)
+        self.assertEqual(self.client.patch(url, {}, format='json').status_code, 429)
+
+
+class ProvisionUserTest(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='Fresh', email='fresh@example.com',
+                                             password='secret')
+
+    def test_rows_created_for_new_user(self):
+        self.assertTrue(Account.objects.filter(user=self.user, email='fresh@example.com',
+                                               email_verified=True).exists())
+        self.assertTrue(Profile.objects.filter(user=self.user).exists())
+        self.assertTrue(DeliveryAddress.objects.filter(user=self.user).exists())
+        self.assertEqual(
+            set(Role.objects.filter(user=self.user).values_list('identifier', flat=True)),
+            set(item[0] for item in ROLE_DEFAULTS)
+        )
+        self.assertEqual(
+            dict(LoginIdentifier.objects.filter(user=self.user).values_list('kind', 'identifier')),
+            {LOGIN_USERNAME: 'fresh', LOGIN_EMAIL: 'fresh@example.com'}
+        )
+        self.assertEqual(self.user.profile.user_id, self.user.id)
+
+    def test_existing_rows_ignored(self):
+        before = Role.objects.filter(user=self.user).count()
+
+        # one insert per table
+        with self.assertNumQueries(5):
+            provision_user(self.user)
+        self.assertEqual(Role.objects.filter(user=self.user).count(), before)
+
+    def test_verified_msisdn_refresh_snapshot(self):
+        self.assertFalse(auth.get_user_snapshot(self.user.id).account.msisdn_verified)
+
+        with execute_on_commit():
+            set_verified_msisdn(self.user, '08123456789')
+
+        account = auth.get_user_snapshot(self.user.id).account
+        self.assertEqual(account.msisdn, '08123456789')
+        self.assertTrue(account.msisdn_verified)
+
+
+class FakeSMTPConnection:
+    """Refuse recipients in `refused`, drop connection `disconnects` times"""
+    def __init__(self, refused=(), disconnects=0):
+        self.refused = refused
+        self.disconnects = disconnects
+        self.sent = list()
+        self.opened = 0
+
+    def open(self):
+        self.opened += 1
+
+    def close(self):
+        pass
+
+    def send_messages(self, messages):
+        for message in messages:
+            if self.disconnects:
+                self.disconnects -= 1
+                raise smtplib.SMTPServerDisconnected('Connection unexpectedly closed')
+            if set(message.to) & set(self.refused):
+                raise smtplib.SMTPRecipientsRefused({message.to[0]: (550, b'No such user')})
+            self.sent.append(message.to[0])
+        return len(messages)
+
+
+class MailDeliveryTest(RedisTestCase):
+    def item(self, to):
+        return {'subject': 'OTP', 'to': [to], 'text': 'text', 'html': None,
+                'from_email': 'noreply@example.com', 'attempts': 0}
+
+    def test_refused_recipient_skipped_only(self):
+        items = [self.item(to) for to in ('ok1@example.com', 'bad@example.com',
+                                          'ok2@example.com', 'ok3@example.com')]
+        connection = FakeSMTPConnection(refused=['bad@example.com'])
+
+        with self.assertLogs(level='ERROR'):
+            self.assertEqual(mail.deliver_messages(items, connection=connection), (3, []))
+        self.assertEqual(connection.sent, ['ok1@example.com', 'ok2@example.com', 'ok3@example.com'])
+
+    def test_reconnect_once_after_disconnect(self):
+        items = [self.item('ok1@example.com'), self.item('ok2@example.com')]
+        connection = FakeSMTPConnection(disconnects=1)
+
+        self.assertEqual(mail.deliver_messages(items, connection=connection), (2, []))
+        self.assertEqual(connection.opened, 3)
+
+    def test_connection_down_return_rest(self):
+        items = [self.item('ok1@example.com'), self.item('ok2@example.com')]
+
+        with self.assertLogs(level='ERROR'):
+            sent, failed = mail.deliver_messages(items, connection=FakeSMTPConnection(disconnects=2))
+        self.assertEqual((sent, failed), (0, items))
+
+    @override_settings(MAIL_MAX_ATTEMPTS=3)
+    def test_flush_requeue_only_connection_failures(self):
+        self.redis.rpush(mail.MAIL_QUEUE_KEY,
+                         *[json.dumps(self.item(to)) for to in ('bad@example.com', 'ok@example.com')])
+
+        connection = FakeSMTPConnection(refused=['bad@example.com'])
+        with mock.patch('apps.person.utils.mail.get_pooled_connection', return_value=connection), \
+                self.assertLogs(level='ERROR'):
+            self.assertEqual(mail.flush_mail_queue(batch_size=10), 1)
+
+        self.assertEqual(connection.sent, ['ok@example.com'])
+        self.assertEqual(self.redis.llen(mail.MAIL_QUEUE_KEY), 0)
+
+    def test_otp_email_rendered(self):
+        text, html = mail.render_email('otp', {'site_name': 'Openpeo', 'passcode': 'ABC123'})
+        self.assertIn('TERMASUK PIHAK Openpeo. Kode OTP Anda: ABC123', text)
+        self.assertIn('<strong>ABC123</strong>', html)
+
+
+class RolePermissionTest(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        self.granted = Permission.objects.get(codename='view_user')
+        self.other = Permission.objects.get(codename='delete_user')
+
+        capability = RoleCapabilities.objects.create(identifier=ROLE_DEFAULTS[0][0])
+        capability.permissions.add(self.granted)
+        auth.invalidate_role_capabilities()
+
+        self.user = User.objects.create_user(username='member', email='member@example.com',
+                                             password='secret')
+
+    def test_no_query_for_snapshot_user(self):
+        user = auth.get_user_snapshot(self.user.id)
+        user.has_perm('person.view_user')
+
+        with self.assertNumQueries(0):
+            self.assertTrue(user.has_perm('person.view_user'))
+            # no role give it, model permission not queried
+            self.assertFalse(user.has_perm('person.delete_user'))
+
+    def test_user_permission_only_for_staff(self):
+        self.user.user_permissions.add(self.other)
+
+        # roles are the only permission source of non staff user
+        self.assertFalse(User.objects.get(id=self.user.id).has_perm('person.delete_user'))
+
+        User.objects.filter(id=self.user.id).update(is_staff=True)
+        self.assertTrue(User.objects.get(id=self.user.id).has_perm('person.delete_user'))
+
+    def test_roles_not_copied_to_user_permissions(self):
+        self.assertFalse(self.user.user_permissions.exists())
+        self.assertTrue(User.objects.get(id=self.user.id).has_perm('person.view_user'))
+
+        with execute_on_commit():
+            auth.update_roles(user=self.user, roles=[])
+        self.assertFalse(self.user.user_permissions.exists())
+        self.assertFalse(User.objects.get(id=self.user.id).has_perm('person.view_user'))
+
+    def test_local_copy_trusted_within_version_timeout(self):
+        cached = TwoLevelCache('test', local_timeout=60, version_timeout=60)
+        cached.set('key', 'value')
+
+        with mock.patch('utils.cache.cache') as shared:
+            self.assertEqual(cached.get('key'), 'value')
+        shared.get.assert_not_called()
+
+        always = TwoLevelCache('test', local_timeout=60)
+        always.set('key', 'value')
+        with mock.patch('utils.cache.cache', wraps=cache) as shared:
+            self.assertEqual(always.get('key'), 'value')
+        shared.get.assert_called_once()
+
+
+def make_data_url(size=(64, 48), image_format='PNG'):
+    output = io.BytesIO()
+    Image.new('RGB', size, (200, 30, 30)).save(output, image_format)
+    return 'data:image/%s;base64,%s' % (image_format.lower(),
+                                        base64.b64encode(output.getvalue()).decode())
+
+
+class PictureIngestTest(RedisTestCase):
+    @mock.patch.object(images, 'DECODE_CHUNK_SIZE', 12)
+    def test_decoded_by_chunk(self):
+        value = make_data_url()
+        source, image_format = images.base64_to_tempfile(value, 1024 * 1024)
+
+        self.assertEqual(image_format, 'PNG')
+        self.assertEqual(source.read(), base64.b64decode(value.split(',', 1)[1]))
+        source.close()
+
+    @mock.patch.object(images, 'DECODE_CHUNK_SIZE', 12)
+    def test_wrapped_base64_accepted(self):
+        value = make_data_url()
+        header, encoded = value.split(',', 1)
+        wrapped = '%s,%s' % (header, '\r\n'.join(encoded[i:i + 10] for i in range(0, len(encoded), 10)))
+
+        source, image_format = images.base64_to_tempfile(wrapped, 1024 * 1024)
+        self.assertEqual(source.read(), base64.b64decode(encoded))
+        source.close()
+
+    def test_timeout_reported_as_busy(self):
+        ingest = images.PictureIngest(picture=make_data_url())
+        future = mock.Mock()
+        future.result.side_effect = images.TimeoutError()
+        ingest._futures = {('picture',): future}
+
+        with self.assertRaises(images.PictureBusy):
+            ingest.files()
+        ingest._futures = dict()
+        ingest.close()
+
+    def test_too_large_rejected_before_decode(self):
+        with mock.patch.object(images.tempfile, 'TemporaryFile') as temporary:
+            with self.assertRaises(serializers.ValidationError):
+                images.base64_to_tempfile(make_data_url(), 16)
+        temporary.assert_not_called()
+
+    def test_wrong_signature_rejected(self):
+        value = make_data_url(image_format='JPEG').replace('image/jpeg', 'image/png')
+        with self.assertRaises(serializers.ValidationError):
+            images.base64_to_tempfile(value, 1024 * 1024)
+
+    def test_close_without_files(self):
+        ingest = images.PictureIngest(picture=make_data_url())
+        ingest.submit()
+        sources = list(ingest._sources)
+        futures = list(ingest._futures.values())
+
+        # rendered output released even never taken with `files`
+        ingest.close()
+        outputs = [output for future in futures if not future.cancelled()
+                   for output in future.result()]
+        self.assertTrue(all(item.closed for item in sources + outputs))
+
+    @mock.patch('apps.person.api.profile.serializers.PictureIngest')
+    def test_ingest_closed_when_validation_failed(self, ingest_class):
+        serializer = ProfileSerializer(data={'picture': make_data_url()}, partial=True)
+
+        with mock.patch.object(ProfileSerializer, 'validate',
+                               side_effect=serializers.ValidationError('invalid')):
+            self.assertFalse(serializer.is_valid())
+        ingest_class.return_value.close.assert_called_once_with()
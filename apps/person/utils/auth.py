@@ -1,21 +1,55 @@
-import itertools
+import time
 
-from django.db.models import Prefetch
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction, IntegrityError, DEFAULT_DB_ALIAS
 from django.shortcuts import redirect
 from django.urls import reverse
-from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.backends import BaseBackend, ModelBackend
 from django.db.models import Q
 from django.utils.translation import ugettext_lazy as _
 from django.contrib.auth.forms import _unicode_ci_compare
 from django.contrib.auth.validators import UnicodeUsernameValidator
+from django.contrib.auth.models import AnonymousUser
+
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import TokenError, InvalidToken
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import AccessToken
 
+from utils.cache import LRUCache, TwoLevelCache
 from utils.generals import get_model
-from apps.person.utils.constants import OTP_SESSION_FIELDS
+from apps.person.utils.constants import (
+    OTP_SESSION_FIELDS, LOGIN_USERNAME, LOGIN_EMAIL, LOGIN_MSISDN
+)
 
 validate_username = UnicodeUsernameValidator()
 
 User = get_model('person', 'User')
 
+# user fields needed by websocket consumers
+_TOKEN_USER_FIELDS = ('id', 'uuid', 'username', 'first_name', 'last_name', 'email',
+                      'is_active', 'is_staff', 'is_superuser',)
+_TOKEN_USER_CACHE = LRUCache(maxsize=settings.WS_AUTH_LOCAL_CACHE_SIZE,
+                             timeout=settings.WS_AUTH_LOCAL_CACHE_TIMEOUT)
+
+# permissions of each role, see get_role_capabilities
+RoleCapability = namedtuple('RoleCapability', ['permission_ids', 'permissions'])
+_ROLE_CAPABILITIES_CACHE = TwoLevelCache('role_capabilities',
+                                         timeout=settings.ROLE_CAPABILITY_CACHE_TIMEOUT,
+                                         local_timeout=settings.ROLE_CAPABILITY_LOCAL_CACHE_TIMEOUT,
+                                         local_maxsize=1,
+                                         version_timeout=settings.ROLE_CAPABILITY_VERSION_TIMEOUT)
+
+# user + profile + account of API requests
+_USER_SNAPSHOT_CACHE = TwoLevelCache('user_snapshot',
+                                     timeout=settings.API_AUTH_CACHE_TIMEOUT,
+                                     local_timeout=settings.API_AUTH_LOCAL_CACHE_TIMEOUT,
+                                     local_maxsize=settings.API_AUTH_LOCAL_CACHE_SIZE)
+
 
 class CurrentUserDefault:
     """Return current logged-in user"""
@@ -30,36 +64,124 @@ class CurrentUserDefault:
         return '%s()' % self.__class__.__name__
 
 
+def normalize_identifier(value):
+    """Same form for stored and typed username, email and msisdn"""
+    return (value or '').strip().lower()
+
+
+def get_login_identifiers(user, account=None):
+    """{kind: identifier} the user can login with"""
+    if account is None:
+        account = getattr(user, 'account', None)
+
+    identifiers = {LOGIN_USERNAME: normalize_identifier(user.username)}
+    if account is not None:
+        if account.email and account.email_verified:
+            identifiers[LOGIN_EMAIL] = normalize_identifier(account.email)
+
+        if account.msisdn and account.msisdn_verified:
+            identifiers[LOGIN_MSISDN] = normalize_identifier(account.msisdn)
+    return identifiers
+
+
+def sync_login_identifiers(user, account=None):
+    """
+    Update LoginIdentifier rows of the user. Identifier already
+    used by other user skipped, first owner keep it.
+    """
+    LoginIdentifier = get_model('person', 'LoginIdentifier')
+
+    wanted = get_login_identifiers(user, account=account)
+    current = {item.kind: item for item in LoginIdentifier.objects.filter(user_id=user.id)}
+
+    removed = [item.id for kind, item in current.items() if kind not in wanted]
+    if removed:
+        LoginIdentifier.objects.filter(id__in=removed).delete()
+
+    for kind, identifier in wanted.items():
+        item = current.get(kind)
+        if item is not None and item.identifier == identifier:
+            continue
+
+        try:
+            with transaction.atomic():
+                if item is None:
+                    LoginIdentifier.objects.create(user_id=user.id, kind=kind, identifier=identifier)
+                else:
+                    LoginIdentifier.objects.filter(id=item.id).update(identifier=identifier)
+        except IntegrityError:
+            # taken by other user, old value can't be used too
+            if item is not None:
+                item.delete()
+
+
 class LoginBackend(ModelBackend):
-    """Login w/h username or email"""
+    """
+    Login w/h username, verified email or verified msisdn. User without
+    LoginIdentifier rows found with the legacy query, while
+    LOGIN_IDENTIFIER_FALLBACK on, and the rows created for the next login.
+    """
     def authenticate(self, request, username=None, password=None, **kwargs):
+        LoginIdentifier = get_model('person', 'LoginIdentifier')
+
         if username is None:
             username = kwargs.get(User.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
 
+        # profile and account used by token response, loaded together
         try:
-            # user = User._default_manager.get_by_natural_key(username)
-            # You can customise what the given username is checked against, here I compare to both username and email fields of the User model
-            user = User.objects \
-                .filter(
-                    Q(username__iexact=username)
-                    | Q(email__iexact=username)
-                    | Q(account__msisdn=username)
-                    & Q(account__msisdn_verified=True))
-        except User.DoesNotExist:
-            # Run the default password tokener once to reduce the timing
+            user = LoginIdentifier.objects \
+                .select_related('user', 'user__profile', 'user__account') \
+                .get(identifier=normalize_identifier(username)).user
+            synced = True
+        except LoginIdentifier.DoesNotExist:
+            user = self.get_legacy_user(username)
+            synced = False
+
+        if user is None:
+            # Run the default password hasher once to reduce the timing
             # difference between an existing and a nonexistent user (#20760).
             User().set_password(password)
-        else:
-            try:
-                user = user.get(Q(username__iexact=username) | Q(email__iexact=username)
-                                | Q(account__msisdn=username)
-                                & Q(account__msisdn_verified=True))
-            except User.DoesNotExist:
-                return None
+            return None
+
+        if not user.check_password(password):
+            return None
 
-            if user and user.check_password(password) and self.user_can_authenticate(user):
-                return user
-        return super().authenticate(request, username, password, **kwargs)
+        if not synced:
+            sync_login_identifiers(user)
+
+        if self.user_can_authenticate(user):
+            return user
+        return None
+
+    # User and group permissions only for staff (admin site). Roles are the
+    # only permission source of other users, answered by RolePermissionBackend,
+    # so a permission no role give not cost query on each API request.
+    def get_user_permissions(self, user_obj, obj=None):
+        if not user_obj.is_staff:
+            return set()
+        return super().get_user_permissions(user_obj, obj=obj)
+
+    def get_group_permissions(self, user_obj, obj=None):
+        if not user_obj.is_staff:
+            return set()
+        return super().get_group_permissions(user_obj, obj=obj)
+
+    def get_legacy_user(self, username):
+        """Query used before LoginIdentifier, for user not synced yet"""
+        if not settings.LOGIN_IDENTIFIER_FALLBACK:
+            return None
+
+        try:
+            return User.objects \
+                .select_related('profile', 'account') \
+                .get(Q(username__iexact=username)
+                     | Q(email__iexact=username)
+                     | Q(account__msisdn=username)
+                     & Q(account__msisdn_verified=True))
+        except (User.DoesNotExist, User.MultipleObjectsReturned):
+            return None
 
 
 class GuestRequiredMixin:
@@ -97,13 +219,56 @@ def clear_otp_session(request, interact):
             pass
 
 
+def get_role_capabilities():
+    """
+    {role identifier: RoleCapability(permission_ids, permissions)}
+    permissions is frozenset of 'app_label.codename', same format as `has_perm`.
+    Cached in-process and Redis, invalidated by person signals on
+    RoleCapabilities change.
+    """
+    RoleCapabilities = get_model('person', 'RoleCapabilities')
+
+    def load():
+        rows = RoleCapabilities.objects \
+            .filter(permissions__isnull=False) \
+            .values_list('identifier', 'permissions__id',
+                         'permissions__content_type__app_label', 'permissions__codename')
+
+        permission_ids = dict()
+        permissions = dict()
+        for identifier, permission_id, app_label, codename in rows:
+            permission_ids.setdefault(identifier, set()).add(permission_id)
+            permissions.setdefault(identifier, set()).add('%s.%s' % (app_label, codename))
+
+        return {
+            identifier: RoleCapability(frozenset(ids), frozenset(permissions[identifier]))
+            for identifier, ids in permission_ids.items()
+        }
+
+    return _ROLE_CAPABILITIES_CACHE.get_or_set('all', load)
+
+
+def invalidate_role_capabilities():
+    _ROLE_CAPABILITIES_CACHE.delete('all')
+
+
+def get_permission_ids(roles):
+    capabilities = get_role_capabilities()
+    return frozenset().union(*[capabilities[identifier].permission_ids
+                               for identifier in roles if identifier in capabilities])
+
+
+def get_role_permissions(roles):
+    capabilities = get_role_capabilities()
+    return frozenset().union(*[capabilities[identifier].permissions
+                               for identifier in roles if identifier in capabilities])
+
+
 def set_roles(user=None, roles=list()):
     """
     :user is user object
     :roles is list of identifier for role, egg: ['registered', 'seller']
     """
-    RoleCapabilities = get_model('person', 'RoleCapabilities')
-
     roles_created = list()
     identifiers_initial = list(user.roles.values_list('identifier', flat=True))
     identifiers_new = list(set(roles) - set(identifiers_initial))
@@ -115,12 +280,8 @@ def set_roles(user=None, roles=list()):
     if roles_created:
         user.roles.model.objects.bulk_create(roles_created)
 
-    capabilities_objs = RoleCapabilities.objects \
-        .prefetch_related(Prefetch('permissions')) \
-        .filter(identifier__in=user.roles.all().values('identifier'))
-    permission_objs = [list(item.permissions.all()) for item in capabilities_objs]
-    permission_objs_unique = list(set(itertools.chain.from_iterable(permission_objs)))
-    user.user_permissions.add(*permission_objs_unique)
+    user_id = user.id
+    transaction.on_commit(lambda: invalidate_user_snapshot(user_id))
 
 
 def update_roles(user=None, roles=list()):
@@ -128,54 +289,202 @@ def update_roles(user=None, roles=list()):
     :user is user object
     :roles is list of identifier for role, egg: ['registered', 'seller']
     """
-    RoleCapabilities = get_model('person', 'RoleCapabilities')
-
-    permissions_removed = list()
-    permissions_add = list()
-    permissions_current = user.user_permissions.all()
-    capabilities = RoleCapabilities.objects \
-        .prefetch_related(Prefetch('permissions'))
+    identifiers_initial = set(user.roles.values_list('identifier', flat=True))
+    identifiers_removed = identifiers_initial - set(roles)
+    identifiers_new = set(roles) - identifiers_initial
 
     # REMOVE ROLES
-    roles_removed = user.roles.exclude(identifier__in=roles)
-    if roles_removed.exists():
-        capabilities = capabilities.filter(identifier__in=roles_removed.values('identifier'))
-        permissions = [list(item.permissions.all()) for item in capabilities]
-        permissions_removed = list(set(itertools.chain.from_iterable(permissions)))
-        roles_removed.delete()
+    if identifiers_removed:
+        user.roles.filter(identifier__in=identifiers_removed).delete()
 
     # ADD ROLES
-    if roles:
-        roles_created = list()
-        identifiers_initial = list(user.roles.values_list('identifier', flat=True))
-        identifiers_new = list(set(roles) ^ set(identifiers_initial))
-
-        for identifier in identifiers_new:
-            role_obj = user.roles.model(user=user, identifier=identifier)
-            roles_created.append(role_obj)
-
-        if roles_created:
-            user.roles.model.objects.bulk_create(roles_created)
-
-        capabilities = capabilities.filter(identifier__in=user.roles.all().values('identifier'))
-        permissions = [list(item.permissions.all()) for item in capabilities]
-        permissions_add = list(set(itertools.chain.from_iterable(permissions)))
-
-    # Compare current with new permissions
-    # If has different assign that to user
-    if permissions_current:
-        add_diff = list(set(permissions_add) & set(permissions_current))
-        if add_diff:
-            add_diff = list(set(permissions_add) ^ set(add_diff))
-    else:
-        add_diff = list(set(permissions_add))
-
-    if add_diff and permissions_add:
-        user.user_permissions.add(*list(add_diff))
-
-    # Compare current with old permissions
-    # If has different remove that
-    removed_diff = list(set(permissions_add) ^ set(permissions_removed))
-    if removed_diff and permissions_removed:
-        diff = set(removed_diff) & set(permissions_removed)
-        user.user_permissions.remove(*list(diff))
+    if identifiers_new:
+        user.roles.model.objects.bulk_create([
+            user.roles.model(user=user, identifier=identifier)
+            for identifier in identifiers_new
+        ])
+
+    # role permissions answered by RolePermissionBackend, not copied to
+    # user permissions. Staff still use user permissions, revoke the ones
+    # copied from removed roles before, not given by the others
+    if identifiers_removed and user.is_staff:
+        permissions_removed = get_permission_ids(identifiers_removed) - get_permission_ids(roles)
+        if permissions_removed:
+            user.user_permissions.remove(*permissions_removed)
+
+    user_id = user.id
+    transaction.on_commit(lambda: invalidate_user_snapshot(user_id))
+
+
+def _token_cache_key(jti):
+    return 'ws_token_user:%s' % jti
+
+
+def _token_generation_key(user_id):
+    return 'ws_token_generation:%s' % user_id
+
+
+def get_user_from_token(raw_token):
+    """
+    Validate JWT access token signed with simplejwt key and return the user.
+    User record cached by token id (jti), first in process LRU then Redis,
+    so reconnect storm not hit database. Both copies tagged with user
+    generation, checked on every hit, so record ignored on every process
+    once `invalidate_token_users` called for the user.
+    """
+    try:
+        token = AccessToken(raw_token)
+    except TokenError:
+        return AnonymousUser()
+
+    jti = token.get(jwt_settings.JTI_CLAIM)
+    user_id = token.get(jwt_settings.USER_ID_CLAIM)
+    if not jti or not user_id:
+        return AnonymousUser()
+
+    key = _token_cache_key(jti)
+    generation_key = _token_generation_key(user_id)
+    record = _TOKEN_USER_CACHE.get(key)
+
+    # local copy dropped once the user invalidated by any process
+    if record is not None and record['generation'] != cache.get(generation_key, 0):
+        record = None
+
+    if record is None:
+        values = cache.get_many([key, generation_key])
+        generation = values.get(generation_key, 0)
+        record = values.get(key)
+
+        if record is None or record['generation'] != generation:
+            user = User.objects \
+                .filter(**{jwt_settings.USER_ID_FIELD: user_id, 'is_active': True}) \
+                .values(*_TOKEN_USER_FIELDS) \
+                .first()
+
+            if user is None:
+                return AnonymousUser()
+
+            # never keep longer than the token itself
+            timeout = min(settings.WS_AUTH_CACHE_TIMEOUT, int(token['exp'] - time.time()))
+            record = {'generation': generation, 'user': user}
+            if timeout > 0:
+                cache.set(key, record, timeout=timeout)
+
+        _TOKEN_USER_CACHE.set(key, record)
+
+    return _load_instance(User, record['user'])
+
+
+def invalidate_token_users(user_id):
+    """Drop cached websocket user of all tokens belong to the user"""
+    generation_key = _token_generation_key(user_id)
+    try:
+        cache.incr(generation_key)
+    except ValueError:
+        cache.set(generation_key, 1, timeout=None)
+
+    _TOKEN_USER_CACHE.delete_matching(lambda key, value: value['user']['id'] == user_id)
+
+
+def _dump_instance(instance, exclude=()):
+    return {f.attname: getattr(instance, f.attname)
+            for f in instance._meta.concrete_fields if f.attname not in exclude}
+
+
+def _load_instance(model, values):
+    # from_db expect values in model field order
+    field_names = [f.attname for f in model._meta.concrete_fields if f.attname in values]
+    return model.from_db(DEFAULT_DB_ALIAS, field_names, [values[name] for name in field_names])
+
+
+def get_user_snapshot(user_id):
+    """
+    User with profile, account and role identifiers attached, from cache
+    when possible. Password not cached, loaded from database only when used.
+    Attached profile and account may be stale, read again before saved,
+    see `user_save_handler`.
+    """
+    def load():
+        user = User.objects \
+            .select_related('profile', 'account') \
+            .filter(**{jwt_settings.USER_ID_FIELD: user_id}) \
+            .first()
+
+        if user is None:
+            return None
+
+        snapshot = {
+            'user': _dump_instance(user, exclude=('password',)),
+            'roles': list(user.roles.values_list('identifier', flat=True)),
+        }
+        for name in ('profile', 'account'):
+            related = getattr(user, name, None)
+            if related is not None:
+                snapshot[name] = _dump_instance(related)
+        return snapshot
+
+    snapshot = _USER_SNAPSHOT_CACHE.get_or_set(user_id, load)
+    if snapshot is None:
+        return None
+
+    user = _load_instance(User, snapshot['user'])
+    for name in ('profile', 'account'):
+        if name in snapshot:
+            related_model = User._meta.get_field(name).related_model
+            setattr(user, name, _load_instance(related_model, snapshot[name]))
+
+    # used by RolePermissionBackend
+    if 'roles' in snapshot:
+        user._role_identifiers = frozenset(snapshot['roles'])
+
+    user._from_snapshot = True
+    return user
+
+
+def invalidate_user_snapshot(user_id):
+    _USER_SNAPSHOT_CACHE.delete(user_id)
+
+
+class RolePermissionBackend(BaseBackend):
+    """
+    Answer `has_perm` from permissions of user roles, no permission
+    query when the user come from snapshot (CachedJWTAuthentication).
+    Only permission source for non staff user, see `LoginBackend`.
+    """
+    def get_role_identifiers(self, user_obj):
+        if not hasattr(user_obj, '_role_identifiers'):
+            user_obj._role_identifiers = frozenset(
+                user_obj.roles.values_list('identifier', flat=True))
+        return user_obj._role_identifiers
+
+    def get_all_permissions(self, user_obj, obj=None):
+        if not user_obj.is_active or user_obj.is_anonymous or obj is not None:
+            return set()
+        return set(get_role_permissions(self.get_role_identifiers(user_obj)))
+
+    def has_perm(self, user_obj, perm, obj=None):
+        if not user_obj.is_active or user_obj.is_anonymous or obj is not None:
+            return False
+        return perm in get_role_permissions(self.get_role_identifiers(user_obj))
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication without user query each request.
+    User, profile and account cached as one snapshot, invalidated
+    by person signals when any of them saved.
+    """
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[jwt_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+
+        user = get_user_snapshot(user_id)
+        if user is None:
+            raise AuthenticationFailed(_('User not found'), code='user_not_found')
+
+        if not user.is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+
+        return user
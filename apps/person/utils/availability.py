@@ -0,0 +1,134 @@
+import logging
+
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+from utils.generals import get_model
+from apps.person.utils.auth import get_login_identifiers, normalize_identifier
+from apps.person.utils.constants import LOGIN_IDENTIFIER_KINDS
+
+READY_KEY = 'taken_identifiers:ready'
+REBUILDING_KEY = 'taken_identifiers:rebuilding'
+
+# add to live set, and to the set being rebuilt so rename not lose it
+# KEYS: rebuilding flag, then (live, rebuild) pair each member
+# ARGV: members
+_ADD_SCRIPT = """
+local rebuilding = redis.call('exists', KEYS[1]) == 1
+for i = 1, #ARGV do
+    redis.call('sadd', KEYS[i * 2], ARGV[i])
+    if rebuilding then
+        redis.call('sadd', KEYS[i * 2 + 1], ARGV[i])
+    end
+end
+return #ARGV
+"""
+
+_script = None
+
+
+def _key(kind):
+    return 'taken_identifiers:%s' % kind
+
+
+def _rebuild_key(kind):
+    return 'taken_identifiers:%s:rebuild' % kind
+
+
+def mark_taken(identifiers):
+    """
+    :param identifiers: {kind: value}, see `get_login_identifiers`
+    Set only grow, value no longer used stay as false positive
+    and checked by database.
+    """
+    global _script
+
+    if not identifiers:
+        return
+
+    keys = [REBUILDING_KEY]
+    args = list()
+    for kind, value in identifiers.items():
+        keys.extend([_key(kind), _rebuild_key(kind)])
+        args.append(normalize_identifier(value))
+
+    try:
+        if _script is None:
+            _script = get_redis_connection('default').register_script(_ADD_SCRIPT)
+        _script(keys=keys, args=args)
+    except RedisError as e:
+        logging.warning('Taken identifier not saved: %s' % e)
+
+
+def maybe_taken(value, kinds=None):
+    """
+    False mean definitely not used by any user, no database needed.
+    True mean maybe used, or sets not built yet, check the database.
+
+    :param kinds: list of login kind, default all
+    """
+    kinds = kinds or [kind for kind, label in LOGIN_IDENTIFIER_KINDS]
+    value = normalize_identifier(value)
+
+    try:
+        pipe = get_redis_connection('default').pipeline(transaction=False)
+        pipe.exists(READY_KEY)
+        for kind in kinds:
+            pipe.sismember(_key(kind), value)
+        result = pipe.execute()
+    except RedisError as e:
+        logging.warning('Taken identifier not checked: %s' % e)
+        return True
+
+    ready, members = result[0], result[1:]
+    return not ready or any(members)
+
+
+def rebuild_taken_identifiers(chunk_size=5000, progress=None):
+    """
+    Build sets from User and Account, then swap with live sets.
+    Value marked meanwhile copied to both, so nothing lost on swap.
+    """
+    User = get_model('person', 'User')
+
+    kinds = [kind for kind, label in LOGIN_IDENTIFIER_KINDS]
+    redis = get_redis_connection('default')
+    redis.delete(*[_rebuild_key(kind) for kind in kinds])
+    redis.set(REBUILDING_KEY, 1, ex=60 * 60 * 6)
+
+    last_id = 0
+    total = 0
+    while True:
+        users = list(
+            User.objects
+            .select_related('account')
+            .filter(id__gt=last_id)
+            .order_by('id')[:chunk_size]
+        )
+        if not users:
+            break
+
+        members = dict()
+        for user in users:
+            for kind, identifier in get_login_identifiers(user).items():
+                members.setdefault(kind, list()).append(identifier)
+
+        pipe = redis.pipeline(transaction=False)
+        for kind, values in members.items():
+            pipe.sadd(_rebuild_key(kind), *values)
+        pipe.execute()
+
+        last_id = users[-1].id
+        total += len(users)
+        if progress:
+            progress(total)
+
+    pipe = redis.pipeline()
+    for kind in kinds:
+        # rename fail on empty set, no user with that kind
+        pipe.sadd(_rebuild_key(kind), '')
+        pipe.rename(_rebuild_key(kind), _key(kind))
+    pipe.set(READY_KEY, 1)
+    pipe.delete(REBUILDING_KEY)
+    pipe.execute()
+    return total
@@ -10,6 +10,15 @@ ROLE_IDENTIFIERS = (
     (BUYER, _(u"Buyer")),
 )
 
+LOGIN_USERNAME = 'username'
+LOGIN_EMAIL = 'email'
+LOGIN_MSISDN = 'msisdn'
+LOGIN_IDENTIFIER_KINDS = (
+    (LOGIN_USERNAME, _(u"Username")),
+    (LOGIN_EMAIL, _(u"Email")),
+    (LOGIN_MSISDN, _(u"MSISDN")),
+)
+
 ROLE_DEFAULTS = (
     (REGISTERED, _(u"Registered")),
     (SELLER, _(u"Client")),
@@ -0,0 +1,274 @@
+import base64
+import binascii
+import tempfile
+
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, wait
+
+from django.conf import settings
+from django.core.files import File
+from django.utils.translation import ugettext_lazy as _
+
+from PIL import Image, ImageOps
+from rest_framework import serializers
+from rest_framework.exceptions import APIException
+
+# accepted upload, by data url mime type
+IMAGE_FORMATS = {
+    'image/jpeg': 'JPEG',
+    'image/jpg': 'JPEG',
+    'image/png': 'PNG',
+}
+
+# first bytes of each format, checked before decode the rest
+IMAGE_SIGNATURES = {
+    'JPEG': (b'\xff\xd8\xff',),
+    'PNG': (b'\x89PNG\r\n\x1a\n',),
+}
+
+# base64 decoded per chunk, must be multiple of 4
+DECODE_CHUNK_SIZE = 64 * 1024
+
+_executor = None
+
+
+def get_executor():
+    """Pool shared by all request in process, limit image decoded at the same time"""
+    global _executor
+
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=settings.PROFILE_PICTURE_WORKERS,
+                                       thread_name_prefix='picture')
+    return _executor
+
+
+class PictureBusy(APIException):
+    """Pool not finished in time, client may retry"""
+    status_code = 503
+    default_detail = _(u"Server sedang sibuk, coba lagi nanti.")
+    default_code = 'picture_busy'
+
+
+def _invalid_format():
+    return serializers.ValidationError(_(u"File hanya boleh .jpg dan .png"))
+
+
+def _too_large(max_size):
+    return serializers.ValidationError(
+        _(u"Maksimal ukuran file %s MB") % ('%g' % (max_size / 1024 / 1024)))
+
+
+def _check_signature(image_format, head):
+    if not head.startswith(IMAGE_SIGNATURES[image_format]):
+        raise _invalid_format()
+
+
+def base64_to_tempfile(value, max_size):
+    """
+    Decode data url `data:image/png;base64,...` chunk by chunk into temp file.
+    Mime type, decoded size and file signature checked before decode the rest.
+
+    :return: (temp file, Pillow format name)
+    """
+    try:
+        header, encoded = value.split(';base64,', 1)
+    except ValueError:
+        raise _invalid_format()
+
+    image_format = IMAGE_FORMATS.get(header.replace('data:', '').lower())
+    if image_format is None:
+        raise _invalid_format()
+
+    # wrapped base64 has line breaks, decoder validate each chunk
+    encoded = ''.join(encoded.split())
+    size = len(encoded) * 3 // 4 - encoded[-2:].count('=')
+    if size > max_size:
+        raise _too_large(max_size)
+
+    output = tempfile.TemporaryFile()
+    try:
+        for offset in range(0, len(encoded), DECODE_CHUNK_SIZE):
+            chunk = base64.b64decode(encoded[offset:offset + DECODE_CHUNK_SIZE], validate=True)
+            if not offset:
+                _check_signature(image_format, chunk)
+            output.write(chunk)
+    except (binascii.Error, ValueError):
+        output.close()
+        raise _invalid_format()
+    except serializers.ValidationError:
+        output.close()
+        raise
+
+    output.seek(0)
+    return output, image_format
+
+
+def upload_to_tempfile(upload, max_size):
+    """Multipart upload, already streamed to disk by Django when large"""
+    if upload.size > max_size:
+        raise _too_large(max_size)
+
+    head = upload.read(16)
+    upload.seek(0)
+    for image_format, signatures in IMAGE_SIGNATURES.items():
+        if head.startswith(signatures):
+            return upload, image_format
+    raise _invalid_format()
+
+
+def open_image(source, image_format):
+    """Only header read here, pixel decoded on first access"""
+    try:
+        image = Image.open(source)
+    except (OSError, Image.DecompressionBombError):
+        raise _invalid_format()
+
+    if image.format != image_format:
+        raise _invalid_format()
+
+    width, height = image.size
+    if width * height > settings.PROFILE_PICTURE_MAX_PIXELS:
+        raise serializers.ValidationError(_(u"Resolusi gambar terlalu besar"))
+    return image
+
+
+def render_pictures(image, variants):
+    """
+    Decode image once, then crop, resize and encode each variant to WebP.
+    Run inside pool thread, Pillow release GIL while decode and encode.
+
+    :param variants: list of (size, square, box), box is
+        (left, top, right, bottom) crop area in original pixel
+    :return: list of temp file, same order as variants
+    """
+    # JPEG decoded at reduced scale, big photo never fully loaded in memory
+    if not any(box for size, square, box in variants):
+        size = max(size for size, square, box in variants)
+        image.draft('RGB', (size * 2, size * 2))
+
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ('RGB', 'RGBA'):
+        transparent = image.mode in ('LA', 'PA') or 'transparency' in image.info
+        image = image.convert('RGBA' if transparent else 'RGB')
+
+    outputs = list()
+    for size, square, box in variants:
+        variant = image.crop(box) if box else image
+        if square:
+            variant = ImageOps.fit(variant, (size, size), Image.LANCZOS)
+        else:
+            variant = variant.copy()
+            variant.thumbnail((size, size), Image.LANCZOS)
+
+        output = tempfile.TemporaryFile()
+        variant.save(output, 'WEBP', quality=settings.PROFILE_PICTURE_QUALITY, method=4)
+        output.seek(0)
+        outputs.append(output)
+    return outputs
+
+
+def clean_crop_box(crop, image):
+    """Crop `{x, y, width, height}` from client, clamped to image area"""
+    try:
+        left, top = int(crop['x']), int(crop['y'])
+        right, bottom = left + int(crop['width']), top + int(crop['height'])
+    except (KeyError, TypeError, ValueError):
+        raise serializers.ValidationError(_(u"Area potong gambar tidak valid"))
+
+    width, height = image.size
+    left, top = max(left, 0), max(top, 0)
+    right, bottom = min(right, width), min(bottom, height)
+    if right <= left or bottom <= top:
+        raise serializers.ValidationError(_(u"Area potong gambar tidak valid"))
+    return left, top, right, bottom
+
+
+class PictureIngest:
+    """
+    Profile picture from data url or upload, validated on create.
+    Resize and encode start on `submit`, result taken with `files`.
+    """
+    def __init__(self, picture=None, picture_original=None, crop=None):
+        self._sources = list()
+        self._futures = dict()
+        self.image = None
+        self.original = None
+
+        try:
+            if picture is not None:
+                self.image = self._open(picture, settings.PROFILE_PICTURE_MAX_SIZE)
+            if picture_original is not None:
+                self.original = self._open(picture_original,
+                                           settings.PROFILE_PICTURE_ORIGINAL_MAX_SIZE)
+            self.crop = clean_crop_box(crop, self.original) \
+                if crop and self.original is not None else None
+        except serializers.ValidationError:
+            self.close()
+            raise
+
+    def _open(self, value, max_size):
+        if isinstance(value, str):
+            source, image_format = base64_to_tempfile(value, max_size)
+        else:
+            source, image_format = upload_to_tempfile(value, max_size)
+
+        self._sources.append(source)
+        return open_image(source, image_format)
+
+    @property
+    def has_picture(self):
+        return self.image is not None or self.crop is not None
+
+    def submit(self):
+        executor = get_executor()
+        size = settings.PROFILE_PICTURE_SIZE
+        original_size = settings.PROFILE_PICTURE_ORIGINAL_SIZE
+
+        if self.image is not None:
+            self._futures[('picture',)] = executor.submit(
+                render_pictures, self.image, [(size, True, None)])
+
+        if self.original is not None:
+            fields = ('picture_original',)
+            variants = [(original_size, False, None)]
+
+            # cropped by server, original decoded only once
+            if self.crop and not self.image:
+                fields += ('picture',)
+                variants.append((size, True, self.crop))
+
+            self._futures[fields] = executor.submit(render_pictures, self.original, variants)
+
+    def files(self):
+        """:return: {field name: File} of encoded WebP"""
+        if not self._futures:
+            self.submit()
+
+        result = dict()
+        try:
+            for fields, future in self._futures.items():
+                outputs = future.result(timeout=settings.PROFILE_PICTURE_TIMEOUT)
+                self._sources.extend(outputs)
+                for field, output in zip(fields, outputs):
+                    result[field] = File(output, name='%s.webp' % field)
+        except TimeoutError:
+            # subclass of OSError, not caused by the file
+            raise PictureBusy()
+        except (OSError, ValueError, Image.DecompressionBombError):
+            raise _invalid_format()
+        return result
+
+    def close(self):
+        """Release temp files, also when validation failed before `files` called"""
+        pending = [future for future in self._futures.values() if not future.cancel()]
+        self._futures = dict()
+
+        # wait running render before close the source it read
+        if pending:
+            wait(pending, timeout=settings.PROFILE_PICTURE_TIMEOUT)
+            for future in pending:
+                if future.done() and not future.exception():
+                    self._sources.extend(future.result())
+
+        for source in self._sources:
+            source.close()
+        self._sources = list()
@@ -0,0 +1,172 @@
+import os
+import json
+import logging
+import smtplib
+
+from functools import lru_cache
+
+from django.conf import settings
+from django.core import mail
+from django.core.mail import EmailMultiAlternatives
+from django.template.loader import get_template
+from django.utils.translation import ugettext as _
+
+from django_redis import get_redis_connection
+
+MAIL_QUEUE_KEY = 'mail_queue'
+MAIL_SCHEDULED_KEY = 'mail_queue:scheduled'
+
+_connection = None
+_connection_pid = None
+
+
+@lru_cache(maxsize=None)
+def get_compiled_template(name):
+    """Template parsed once per process, only rendered on each message"""
+    return get_template(name)
+
+
+def render_email(name, context):
+    """Return (text, html) of templates `email/<name>.txt` and `email/<name>.html`"""
+    text = get_compiled_template('email/%s.txt' % name).render(context)
+    html = get_compiled_template('email/%s.html' % name).render(context)
+    return text, html
+
+
+def get_pooled_connection():
+    """
+    One SMTP connection per worker process, kept open and reused
+    by every batch. New process (Celery prefork) has its own connection.
+    """
+    global _connection, _connection_pid
+
+    if _connection is None or _connection_pid != os.getpid():
+        _connection = mail.get_connection(fail_silently=False)
+        _connection_pid = os.getpid()
+    return _connection
+
+
+def build_message(item):
+    msg = EmailMultiAlternatives(item['subject'], item['text'], item['from_email'], item['to'])
+    if item.get('html'):
+        msg.attach_alternative(item['html'], "text/html")
+    return msg
+
+
+# refused by server for this message only, connection still usable
+MESSAGE_ERRORS = (
+    smtplib.SMTPRecipientsRefused,
+    smtplib.SMTPSenderRefused,
+    smtplib.SMTPDataError,
+)
+
+
+def deliver_messages(items, connection=None):
+    """
+    Send items over one connection, reconnect once when server drop it.
+    Message refused by server logged and skipped.
+
+    :return: (sent count, items not sent because connection failed)
+    """
+    connection = connection or get_pooled_connection()
+    sent = 0
+
+    for index, item in enumerate(items):
+        for attempt in range(2):
+            try:
+                # opened connection not closed by send_messages
+                connection.open()
+                sent += connection.send_messages([build_message(item)])
+                break
+            except MESSAGE_ERRORS as e:
+                # checked first, SMTPException is subclass of OSError
+                logging.error('%s: %s' % (e.__class__.__name__, e))
+                break
+            except OSError as e:
+                try:
+                    connection.close()
+                except OSError:
+                    pass
+
+                if attempt:
+                    logging.error('SMTP connection failed: %s' % e)
+                    return sent, items[index:]
+    return sent, []
+
+
+def queue_email(subject, to, text, html=None, from_email=None):
+    """
+    Put message in mail queue. First message schedule
+    `apps.person.tasks.deliver_email_batch` after MAIL_BATCH_WINDOW,
+    messages queued meanwhile delivered by the same run.
+    """
+    from apps.person.tasks import deliver_email_batch
+
+    item = {
+        'subject': str(subject),
+        'to': to if isinstance(to, (list, tuple)) else [to],
+        'text': str(text),
+        'html': str(html) if html else None,
+        'from_email': from_email or '%s <hellopuyup@gmail.com>' % (settings.PROJECT_NAME),
+        'attempts': 0,
+    }
+
+    redis = get_redis_connection('default')
+    pipe = redis.pipeline()
+    pipe.rpush(MAIL_QUEUE_KEY, json.dumps(item))
+    pipe.set(MAIL_SCHEDULED_KEY, 1, nx=True, ex=settings.MAIL_BATCH_WINDOW * 10)
+    scheduled = pipe.execute()[1]
+
+    if scheduled:
+        deliver_email_batch.apply_async(countdown=settings.MAIL_BATCH_WINDOW)
+
+
+def queue_otp_email(email, passcode):
+    text, html = render_email('otp', {
+        'site_name': settings.PROJECT_NAME,
+        'passcode': passcode,
+    })
+    queue_email(_(u"Validasi OTP"), email, text, html)
+
+
+def take_batch(size):
+    redis = get_redis_connection('default')
+    pipe = redis.pipeline()
+    pipe.lrange(MAIL_QUEUE_KEY, 0, size - 1)
+    pipe.ltrim(MAIL_QUEUE_KEY, size, -1)
+    return [json.loads(item) for item in pipe.execute()[0]]
+
+
+def flush_mail_queue(batch_size=None, max_batches=None):
+    """Deliver queued messages batch by batch, return sent count"""
+    batch_size = batch_size or settings.MAIL_BATCH_SIZE
+    max_batches = max_batches or settings.MAIL_MAX_BATCHES
+
+    redis = get_redis_connection('default')
+
+    # message queued from now schedule next run
+    redis.delete(MAIL_SCHEDULED_KEY)
+
+    sent = 0
+    for i in range(max_batches):
+        items = take_batch(batch_size)
+        if not items:
+            break
+
+        count, failed = deliver_messages(items)
+        sent += count
+
+        # connection down, put back and try on next run
+        retry = list()
+        for item in failed:
+            item['attempts'] += 1
+            if item['attempts'] < settings.MAIL_MAX_ATTEMPTS:
+                retry.append(json.dumps(item))
+        if retry:
+            redis.rpush(MAIL_QUEUE_KEY, *retry)
+        if failed:
+            break
+
+        if len(items) < batch_size:
+            break
+    return sent
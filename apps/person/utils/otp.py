@@ -0,0 +1,347 @@
+import abc
+import uuid
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.core.exceptions import ValidationError
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from django.utils.translation import ugettext_lazy as _
+
+from django_redis import get_redis_connection
+
+from utils.generals import get_model
+from apps.person.utils.mail import queue_otp_email
+
+PENDING = 'pending'
+VERIFIED = 'verified'
+USED = 'used'
+
+# state must be pending, token and passcode must match
+_VERIFY_SCRIPT = """
+if not ARGV[1] or ARGV[1] == '' or not ARGV[2] or ARGV[2] == '' then
+    return -2
+end
+if redis.call('exists', KEYS[1]) == 0 then
+    return -1
+end
+local values = redis.call('hmget', KEYS[1], 'state', 'token', 'passcode')
+if values[1] ~= 'pending' then
+    return 0
+end
+if values[2] ~= ARGV[1] or values[3] ~= ARGV[2] then
+    return -2
+end
+redis.call('hset', KEYS[1], 'state', 'verified')
+return 1
+"""
+
+# state must be verified, then the code can't be found anymore
+_CONSUME_SCRIPT = """
+if redis.call('hget', KEYS[1], 'state') ~= 'verified' then
+    return 0
+end
+redis.call('hset', KEYS[1], 'state', 'used')
+if redis.call('get', KEYS[2]) == ARGV[1] then
+    redis.call('del', KEYS[2])
+end
+redis.call('srem', KEYS[3], ARGV[1])
+return 1
+"""
+
+
+class BaseOTPStorage(abc.ABC):
+    """
+    Where OTP codes live. Object returned by `get_*` has
+    `validate()` and `mark_used()` like OTPFactory instance.
+    """
+    @abc.abstractmethod
+    def create(self, challenge, email=None, msisdn=None):
+        """Return (otp, created). Active code of same target and challenge renewed."""
+
+    @abc.abstractmethod
+    def get_unverified_unused(self, email=None, msisdn=None, token=None,
+                              challenge=None, uuid=None, passcode=None):
+        """Pending code, raise OTPFactory.DoesNotExist if not found"""
+
+    @abc.abstractmethod
+    def get_verified_unused(self, email=None, msisdn=None, token=None,
+                            challenge=None, uuid=None, passcode=None):
+        """Verified code not used yet, raise OTPFactory.DoesNotExist if not found"""
+
+    @abc.abstractmethod
+    def has_verified(self, email=None, msisdn=None, challenge=None):
+        """Any verified code not used yet, for checks that not consume it"""
+
+    @abc.abstractmethod
+    def has_active(self, email=None, msisdn=None):
+        """Any unused and not expired code sent to the email or msisdn"""
+
+
+class DatabaseOTPStorage(BaseOTPStorage):
+    """Each code is an OTPFactory row"""
+    def create(self, challenge, email=None, msisdn=None):
+        OTPFactory = get_model('person', 'OTPFactory')
+
+        defaults = {
+            'challenge': challenge,
+            'is_verified': False,
+            'is_used': False,
+            'is_expired': False,
+        }
+
+        if email:
+            defaults['email'] = email
+        else:
+            defaults['msisdn'] = msisdn
+
+        # If `valid_until` greater than time now we update OTP Code
+        return OTPFactory.objects \
+            .filter(Q(valid_until__gt=timezone.now())) \
+            .update_or_create(**defaults, defaults=defaults)
+
+    def _queryset(self):
+        OTPFactory = get_model('person', 'OTPFactory')
+
+        # lock the row when caller will verify or consume it
+        queryset = OTPFactory.objects.all()
+        if transaction.get_connection().in_atomic_block:
+            queryset = queryset.select_for_update()
+        return queryset
+
+    def get_unverified_unused(self, **kwargs):
+        return self._queryset().get_unverified_unused(**kwargs)
+
+    def get_verified_unused(self, **kwargs):
+        return self._queryset().get_verified_unused(**kwargs)
+
+    def has_verified(self, email=None, msisdn=None, challenge=None):
+        OTPFactory = get_model('person', 'OTPFactory')
+        return OTPFactory.objects \
+            .filter_verified_unused(email=email, msisdn=msisdn, challenge=challenge) \
+            .exists()
+
+    def has_active(self, email=None, msisdn=None):
+        OTPFactory = get_model('person', 'OTPFactory')
+
+        queryset = OTPFactory.objects.filter(is_used=False, is_expired=False)
+        if email:
+            return queryset.filter(email=email).exists()
+        return queryset.filter(msisdn=msisdn).exists()
+
+
+class RedisOTP:
+    """OTP code kept in Redis hash, expired by key TTL"""
+    def __init__(self, storage, data, created=False):
+        self.storage = storage
+        self.uuid = data['uuid']
+        self.email = data.get('email') or None
+        self.msisdn = data.get('msisdn') or None
+        self.challenge = data['challenge']
+        self.token = data['token']
+        self.passcode = data['passcode']
+        self.state = data.get('state', PENDING)
+        self.valid_until = timezone.datetime.fromtimestamp(
+            int(data['valid_until']), tz=timezone.utc)
+        self.created = created
+
+    def __str__(self):
+        return self.passcode
+
+    @property
+    def is_verified(self):
+        return self.state in (VERIFIED, USED)
+
+    @property
+    def is_used(self):
+        return self.state == USED
+
+    def validate(self):
+        self.storage.verify(self)
+        self.state = VERIFIED
+
+    def mark_used(self):
+        self.storage.consume(self)
+        self.state = USED
+
+
+class RedisOTPStorage(BaseOTPStorage):
+    """
+    Keys, all expire with the code:
+        otp:<uuid>                          hash of the code
+        otp_target:<challenge>:<target>     uuid of active code
+        otp_active:<target>                 set of active uuid
+    Verify and consume are atomic Lua scripts, no row lock needed.
+    """
+    def __init__(self):
+        self.redis = get_redis_connection('default')
+        self.verify_script = self.redis.register_script(_VERIFY_SCRIPT)
+        self.consume_script = self.redis.register_script(_CONSUME_SCRIPT)
+
+    def _code_key(self, uuid):
+        return 'otp:%s' % uuid
+
+    def _normalize_email(self, email):
+        return (email or '').strip().lower()
+
+    def _target(self, email=None, msisdn=None):
+        if email:
+            return 'email:%s' % self._normalize_email(email)
+        return 'msisdn:%s' % msisdn
+
+    def _target_key(self, challenge, target):
+        return 'otp_target:%s:%s' % (challenge, target)
+
+    def _active_key(self, target):
+        return 'otp_active:%s' % target
+
+    def _load(self, uuid):
+        data = self.redis.hgetall(self._code_key(uuid))
+        if not data:
+            return None
+        return {key.decode(): value.decode() for key, value in data.items()}
+
+    def _audit(self, action, otp):
+        if settings.OTP_AUDIT:
+            from apps.person.tasks import write_otp_audit
+
+            write_otp_audit.delay(action, {
+                'uuid': str(otp.uuid),
+                'email': otp.email,
+                'msisdn': otp.msisdn,
+                'challenge': otp.challenge,
+                'token': otp.token,
+                'passcode': otp.passcode,
+                'valid_until': otp.valid_until.isoformat(),
+            })
+
+    def create(self, challenge, email=None, msisdn=None):
+        OTPFactory = get_model('person', 'OTPFactory')
+
+        target = self._target(email=email, msisdn=msisdn)
+        target_key = self._target_key(challenge, target)
+        active = self.redis.get(target_key)
+        current = self._load(active.decode()) if active else None
+
+        # renew pending code, same as database version
+        created = current is None or current['state'] != PENDING
+        code_uuid = str(uuid.uuid4()) if created else current['uuid']
+
+        generator = OTPFactory()
+        generator.generate()
+        timeout = max(int(generator.valid_until_timestamp - timezone.now().timestamp()), 1)
+
+        data = {
+            'uuid': code_uuid,
+            'email': email or '',
+            'msisdn': msisdn or '',
+            'challenge': challenge,
+            'token': generator.token,
+            'passcode': generator.passcode,
+            'valid_until': int(generator.valid_until_timestamp),
+            'state': PENDING,
+        }
+
+        pipe = self.redis.pipeline()
+        pipe.delete(self._code_key(code_uuid))
+        pipe.hset(self._code_key(code_uuid), mapping=data)
+        pipe.expire(self._code_key(code_uuid), timeout)
+        pipe.set(target_key, code_uuid, ex=timeout)
+        pipe.sadd(self._active_key(target), code_uuid)
+        pipe.expire(self._active_key(target), timeout)
+        pipe.execute()
+
+        otp = RedisOTP(self, data, created=created)
+        if email:
+            queue_otp_email(email, otp.passcode)
+
+        self._audit('created', otp)
+        return otp, created
+
+    def _get(self, state, email=None, msisdn=None, token=None,
+             challenge=None, uuid=None, passcode=None):
+        OTPFactory = get_model('person', 'OTPFactory')
+
+        if not uuid and challenge and (email or msisdn):
+            active = self.redis.get(self._target_key(challenge, self._target(email, msisdn)))
+            uuid = active.decode() if active else None
+
+        data = self._load(uuid) if uuid else None
+        if data is None:
+            raise OTPFactory.DoesNotExist
+
+        checks = {
+            'state': state, 'challenge': challenge, 'token': token,
+            'passcode': passcode, 'msisdn': msisdn
+        }
+        for field, value in checks.items():
+            if value and data.get(field) != str(value):
+                raise OTPFactory.DoesNotExist
+
+        # same email in other case is the same target
+        if email and self._normalize_email(data.get('email')) != self._normalize_email(email):
+            raise OTPFactory.DoesNotExist
+        return RedisOTP(self, data)
+
+    def get_unverified_unused(self, **kwargs):
+        return self._get(PENDING, **kwargs)
+
+    def get_verified_unused(self, **kwargs):
+        return self._get(VERIFIED, **kwargs)
+
+    def has_verified(self, email=None, msisdn=None, challenge=None):
+        OTPFactory = get_model('person', 'OTPFactory')
+
+        # one code per target and challenge, nothing to count
+        try:
+            self.get_verified_unused(email=email, msisdn=msisdn, challenge=challenge)
+        except OTPFactory.DoesNotExist:
+            return False
+        return True
+
+    def has_active(self, email=None, msisdn=None):
+        uuids = self.redis.smembers(self._active_key(self._target(email, msisdn)))
+        if not uuids:
+            return False
+
+        # set may hold code already expired
+        pipe = self.redis.pipeline()
+        for item in uuids:
+            pipe.exists(self._code_key(item.decode()))
+        return any(pipe.execute())
+
+    def verify(self, otp):
+        result = self.verify_script(keys=[self._code_key(otp.uuid)],
+                                    args=[otp.token or '', otp.passcode or ''])
+        if result == -1:
+            raise ValidationError(_(u"OTP code expired on %s." % (otp.valid_until)))
+        if result == 0:
+            raise ValidationError(_(u"Has verified."))
+        if result != 1:
+            raise ValidationError(_(u"OTP Code invalid."))
+
+        self._audit('verified', otp)
+
+    def consume(self, otp):
+        target = self._target(otp.email, otp.msisdn)
+        result = self.consume_script(
+            keys=[self._code_key(otp.uuid), self._target_key(otp.challenge, target),
+                  self._active_key(target)],
+            args=[str(otp.uuid)]
+        )
+        if result != 1:
+            raise ValidationError(_(u"Kode OTP sudah digunakan atau kadaluarsa."))
+
+        self._audit('used', otp)
+
+
+_storage = None
+
+
+def get_otp_storage():
+    global _storage
+
+    if _storage is None:
+        _storage = import_string(settings.OTP_STORAGE)()
+    return _storage
@@ -0,0 +1,80 @@
+from django.db import IntegrityError, transaction
+
+from utils.generals import get_model
+from apps.person.utils.constants import ROLE_DEFAULTS, LOGIN_MSISDN
+from apps.person.utils.auth import (
+    get_login_identifiers, normalize_identifier, invalidate_user_snapshot
+)
+from apps.person.utils.availability import mark_taken
+
+
+def provision_user(user, roles=None):
+    """
+    Create rows every new user has, one bulk insert per table:
+        Account, Profile, DeliveryAddress, Role, LoginIdentifier
+    Role permissions not copied to user permissions, answered by
+    RolePermissionBackend.
+
+    Bulk insert skip `save()` and post_save signal, nothing cached yet for
+    a new user. Row already exist (eg: created in admin inline) ignored.
+
+    :roles is list of role identifier, default ROLE_DEFAULTS
+    """
+    Account = get_model('person', 'Account')
+    Profile = get_model('person', 'Profile')
+    Role = get_model('person', 'Role')
+    LoginIdentifier = get_model('person', 'LoginIdentifier')
+    DeliveryAddress = get_model('commerce', 'DeliveryAddress')
+
+    if roles is None:
+        roles = [item[0] for item in ROLE_DEFAULTS]
+
+    # Account.save() copy email from user, do it here
+    account = Account(user=user, email=user.email, email_verified=True)
+
+    Account.objects.bulk_create([account], ignore_conflicts=True)
+    Profile.objects.bulk_create([Profile(user=user)], ignore_conflicts=True)
+    DeliveryAddress.objects.bulk_create([DeliveryAddress(user=user, address='')],
+                                        ignore_conflicts=True)
+
+    # constructor cached the unsaved instance on user, primary key
+    # not set by bulk insert, let `user.profile` load the saved row
+    for model in (Account, Profile, DeliveryAddress):
+        model._meta.get_field('user').remote_field.delete_cached_value(user)
+
+    if roles:
+        Role.objects.bulk_create([Role(user=user, identifier=identifier)
+                                  for identifier in set(roles)],
+                                 ignore_conflicts=True)
+
+    # identifier owned by other user skipped, same as sync_login_identifiers
+    identifiers = get_login_identifiers(user, account=account)
+    LoginIdentifier.objects.bulk_create(
+        [LoginIdentifier(user_id=user.id, kind=kind, identifier=identifier)
+         for kind, identifier in identifiers.items()],
+        ignore_conflicts=True
+    )
+    mark_taken(identifiers)
+
+
+def set_verified_msisdn(user, msisdn):
+    """
+    Registration with validated msisdn, without load the Account.
+    Update skip account_save_handler, snapshot dropped here.
+    """
+    Account = get_model('person', 'Account')
+    LoginIdentifier = get_model('person', 'LoginIdentifier')
+
+    Account.objects.filter(user_id=user.id).update(msisdn=msisdn, msisdn_verified=True)
+    mark_taken({LOGIN_MSISDN: msisdn})
+
+    user_id = user.id
+    transaction.on_commit(lambda: invalidate_user_snapshot(user_id))
+
+    try:
+        with transaction.atomic():
+            LoginIdentifier.objects.create(user_id=user.id, kind=LOGIN_MSISDN,
+                                           identifier=normalize_identifier(msisdn))
+    except IntegrityError:
+        # taken by other user
+        pass
@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.utils import timezone
+
+_DATABASE_ENGINES = (
+    'django.contrib.sessions.backends.db',
+    'django.contrib.sessions.backends.cached_db',
+)
+
+
+def purge_database_sessions(chunk_size=None, max_chunks=None):
+    """
+    Delete django_session rows, chunk by chunk.
+    Session engine not use database: every row left from old engine deleted,
+    otherwise only expired one (same as `clearsessions`).
+    """
+    chunk_size = chunk_size or settings.SESSION_PURGE_CHUNK_SIZE
+    max_chunks = max_chunks or settings.SESSION_PURGE_MAX_CHUNKS
+
+    queryset = Session.objects.all()
+    if settings.SESSION_ENGINE in _DATABASE_ENGINES:
+        queryset = queryset.filter(expire_date__lt=timezone.now())
+
+    deleted = 0
+    for i in range(max_chunks):
+        keys = list(queryset.values_list('session_key', flat=True)[:chunk_size])
+        if not keys:
+            break
+
+        # no relation or signal on Session, one DELETE without load rows
+        deleted += Session.objects.filter(session_key__in=keys).delete()[0]
+
+        if len(keys) < chunk_size:
+            break
+    return deleted
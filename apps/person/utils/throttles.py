@@ -0,0 +1,62 @@
+from django.conf import settings
+
+from utils.ratelimit import TokenBucketThrottle
+
+
+class OTPThrottle(TokenBucketThrottle):
+    """
+    Limit OTP create, resend and validate by client IP and target
+    (email, msisdn or code uuid). Global quota count every challenge
+    together, so new challenge not give fresh quota. Quota per challenge
+    taken on top, see `OTP_THROTTLE_RATES`
+    """
+    scope = 'otp'
+
+    def get_rates(self, action, challenge=None):
+        rates = settings.OTP_THROTTLE_RATES
+        if challenge is None:
+            return rates['global'].get(action)
+
+        return rates.get(challenge, dict()).get(action) \
+            or rates['default'].get(action)
+
+    def get_targets(self, request, view):
+        targets = list()
+
+        email = request.data.get('email', None)
+        if email:
+            targets.append('email:%s' % str(email).strip().lower())
+
+        msisdn = request.data.get('msisdn', None)
+        if msisdn:
+            targets.append('msisdn:%s' % str(msisdn).strip())
+
+        # resend only know the code
+        uuid = getattr(view, 'kwargs', dict()).get('uuid', None)
+        if uuid:
+            targets.append('uuid:%s' % uuid)
+        return targets
+
+    def make_buckets(self, prefix, rates, request, targets):
+        buckets = [('%s:ip:%s' % (prefix, self.get_ident(request)), *rates['ip'])]
+        for target in targets:
+            buckets.append(('%s:%s' % (prefix, target), *rates['target']))
+        return buckets
+
+    def get_buckets(self, request, view):
+        action = getattr(view, 'action', None)
+        challenge = request.data.get('challenge', None)
+        targets = self.get_targets(request, view)
+
+        buckets = list()
+        rates = self.get_rates(action)
+        if rates:
+            prefix = '%s:%s:all' % (self.scope, action)
+            buckets.extend(self.make_buckets(prefix, rates, request, targets))
+
+        if challenge:
+            rates = self.get_rates(action, challenge=challenge)
+            if rates:
+                prefix = '%s:%s:challenge:%s' % (self.scope, action, challenge)
+                buckets.extend(self.make_buckets(prefix, rates, request, targets))
+        return buckets
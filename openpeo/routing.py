@@ -1,31 +1,25 @@
 from urllib.parse import parse_qs
 
+from django.urls import re_path
 from django.db import close_old_connections
-from django.contrib.auth import get_user_model
 
 from channels.db import database_sync_to_async
 from channels.auth import AuthMiddlewareStack
+from channels.http import AsgiHandler
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.security.websocket import AllowedHostsOriginValidator
 
-from rest_framework_simplejwt.authentication import JWTAuthentication
-
-from utils.generals import get_model
-from apps.commerce.routing import websocket_urlpatterns as commerce_websocket
-
-User = get_model('person', 'User')
+from apps.person.utils.auth import get_user_from_token
+from apps.commerce.routing import (
+    websocket_urlpatterns as commerce_websocket,
+    http_urlpatterns as commerce_http
+)
 
 
 @database_sync_to_async
 def get_user(token):
-    # jwt = JWTAuthentication()
-    # validated_token = jwt.get_validated_token(token)
-    # user = jwt.get_user(validated_token)
-    user = User.objects.get(id=token)
-
-    if user:
-        return user
-    return None
+    # JWT validated, user cached by token id
+    return get_user_from_token(token)
 
 
 class TokenAuthMiddleware:
@@ -68,7 +62,11 @@ TokenAuthMiddlewareStack = lambda inner: TokenAuthMiddleware(AuthMiddlewareStack
 
 
 application = ProtocolTypeRouter({
-    # (http->django views is added by default)
+    # Server-Sent Events, other http to django views
+    'http': URLRouter([
+        re_path(r'^sse/', TokenAuthMiddlewareStack(URLRouter(commerce_http))),
+        re_path(r'', AsgiHandler),
+    ]),
     'websocket': TokenAuthMiddlewareStack(
         URLRouter(
             commerce_websocket
@@ -11,3 +11,4 @@ else:
 
 # CACHING SERVER
 CACHES['default']['LOCATION'] = REDIS_URL
+CACHES['sessions']['LOCATION'] = REDIS_URL
@@ -1,6 +1,28 @@
+from celery.schedules import crontab
 from django.conf import settings
 
 broker_url = settings.REDIS_URL
 broker_transport_options = {'visibility_timeout': 3600} 
 result_backend = settings.REDIS_URL
 task_serializer = 'json'
+
+beat_schedule = {
+    'notification-retention': {
+        'task': 'apps.commerce.tasks.notification_retention',
+        'schedule': crontab(minute=15),
+    },
+    # file of rolled back attachment upload
+    'purge-orphan-blobs': {
+        'task': 'apps.commerce.tasks.purge_orphan_blobs',
+        'schedule': crontab(hour=3, minute=30),
+    },
+    'purge-database-sessions': {
+        'task': 'apps.person.tasks.purge_database_sessions',
+        'schedule': crontab(minute=45),
+    },
+    # message left by a lost or full run
+    'deliver-email-batch': {
+        'task': 'apps.person.tasks.deliver_email_batch',
+        'schedule': crontab(),
+    },
+}
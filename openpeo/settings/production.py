@@ -130,4 +130,5 @@ CHANNEL_LAYERS = {
 
 # CACHING SERVER
 CACHES['default']['LOCATION'] = REDIS_URL
+CACHES['sessions']['LOCATION'] = REDIS_URL
 ASGI_THREADS = 1000
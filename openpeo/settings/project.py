@@ -1,3 +1,5 @@
+import os
+
 from datetime import timedelta
 from django.contrib.messages import constants as messages
 
@@ -13,6 +15,31 @@ LOGIN_WITH_JWT = True
 OTP_COOKIES_EXPIRED = 3000
 PUBLIC_DIR_NAME = 'public'
 
+# OTP code storage, use `apps.person.utils.otp.DatabaseOTPStorage` for rows only
+OTP_STORAGE = 'apps.person.utils.otp.RedisOTPStorage'
+# Copy code stored in Redis to OTPFactory table (async)
+OTP_AUDIT = False
+
+# OTP token bucket per action, (capacity, refill period in seconds)
+# ip: each client IP, target: each email, msisdn or code uuid (resend)
+# global: all challenges together, every request take from it.
+# default: each challenge, taken on top of global when challenge sent.
+# Challenge key override default, eg: 'password_recovery': {'create': {...}}
+OTP_THROTTLE_RATES = {
+    'global': {
+        'create': {'ip': (30, 60 * 60), 'target': (8, 60 * 60)},
+        'partial_update': {'ip': (20, 60 * 60), 'target': (5, 60 * 60)},
+        'validate': {'ip': (100, 60 * 60), 'target': (20, 60 * 60)},
+    },
+    'default': {
+        'create': {'ip': (20, 60 * 60), 'target': (5, 60 * 60)},
+        'validate': {'ip': (60, 60 * 60), 'target': (10, 60 * 60)},
+    },
+    'password_recovery': {
+        'create': {'ip': (10, 60 * 60), 'target': (3, 60 * 60)},
+    },
+}
+
 # REGISTRATION REQUIREMENTS
 STRICT_EMAIL = False
 STRICT_EMAIL_VERIFIED = False
@@ -55,7 +82,14 @@ MIDDLEWARE = MIDDLEWARE + PROJECT_MIDDLEWARE
 
 # Specifying authentication backends
 # https://docs.djangoproject.com/en/3.0/topics/auth/customizing/
-AUTHENTICATION_BACKENDS = ['apps.person.utils.auth.LoginBackend',]
+AUTHENTICATION_BACKENDS = [
+    'apps.person.utils.auth.RolePermissionBackend',
+    'apps.person.utils.auth.LoginBackend',
+]
+
+# LoginBackend query user table when identifier not found, and create the
+# LoginIdentifier rows. Turn off after `manage.py sync_login_identifiers`
+LOGIN_IDENTIFIER_FALLBACK = True
 
 
 # CACHING
@@ -67,6 +101,11 @@ CACHES = {
             "SELLER_CLASS": "django_redis.seller.DefaultClient"
         },
         "KEY_PREFIX": "openpeo_cache"
+    },
+    # sessions kept apart, clear default cache not logout users
+    "sessions": {
+        "BACKEND": "django_redis.cache.RedisCache",
+        "KEY_PREFIX": "openpeo_session"
     }
 }
 
@@ -86,7 +125,13 @@ MESSAGE_TAGS = {
 # ------------------------------------------------------------------------------
 # https://docs.djangoproject.com/en/2.2/ref/settings/
 SESSION_SAVE_EVERY_REQUEST = False
-SESSION_ENGINE = 'django.contrib.sessions.backends.db'
+# Redis only, use 'django.contrib.sessions.backends.cached_db' to keep
+# database copy (write on each login, read only on cache miss)
+SESSION_ENGINE = 'django.contrib.sessions.backends.cache'
+SESSION_CACHE_ALIAS = 'sessions'
+# purge django_session rows, see apps.person.tasks.purge_database_sessions
+SESSION_PURGE_CHUNK_SIZE = 1000
+SESSION_PURGE_MAX_CHUNKS = 100
 
 
 # Static files (CSS, JavaScript, Images)
@@ -104,6 +149,70 @@ SIMPLE_JWT = {
 }
 
 
+# Notification
+NOTIFICATION_PER_PAGE = 20
+# unread counter recounted at least this often (in seconds), bound drift
+# of increment racing with recount
+NOTIFICATION_UNREAD_TIMEOUT = 60 * 15
+NOTIFICATION_FANOUT_CHUNK_SIZE = 1000
+NOTIFICATION_FANOUT_TIMEOUT = 60 * 60 * 24 * 7
+
+# Retention, run by celery beat. Each run delete at most
+# NOTIFICATION_PURGE_CHUNK_SIZE * NOTIFICATION_PURGE_MAX_CHUNKS read rows
+# and scan as many order item notifications for superseded status
+NOTIFICATION_READ_TTL_DAYS = 30
+NOTIFICATION_PURGE_CHUNK_SIZE = 1000
+NOTIFICATION_PURGE_MAX_CHUNKS = 50
+
+# Attachment blob file without row removed only after this age (seconds),
+# longer than any upload transaction
+BLOB_ORPHAN_MIN_AGE = 60 * 60 * 24
+
+# Push events of a user in this window (seconds) sent as one digest
+PUSH_DIGEST_WINDOW = 30
+
+# Firebase Cloud Messaging legacy server key, push skipped when empty
+FCM_SERVER_KEY = os.environ.get('FCM_SERVER_KEY', '')
+
+# Per user replay buffer for Server-Sent Events (Last-Event-ID)
+EVENT_STREAM_MAXLEN = 200
+EVENT_STREAM_TIMEOUT = 60 * 60 * 24
+SSE_HEARTBEAT = 15
+
+
+# Websocket authentication cache (in seconds)
+# local copy checked against user generation in Redis on every connect,
+# deactivation or password change applied at once on all processes
+WS_AUTH_CACHE_TIMEOUT = 300
+WS_AUTH_LOCAL_CACHE_TIMEOUT = 15
+WS_AUTH_LOCAL_CACHE_SIZE = 4096
+
+# Permissions of each role (in seconds), invalidated when RoleCapabilities changed
+# local copy checked against version in Redis at most once per version
+# timeout, change applied on all processes within it. Local timeout only
+# bound memory
+ROLE_CAPABILITY_CACHE_TIMEOUT = 60 * 60 * 24
+ROLE_CAPABILITY_LOCAL_CACHE_TIMEOUT = 30
+ROLE_CAPABILITY_VERSION_TIMEOUT = 5
+
+# API (JWT) user snapshot cache (in seconds)
+# versioned like role permissions, deactivated user rejected at once by all processes
+API_AUTH_CACHE_TIMEOUT = 300
+API_AUTH_LOCAL_CACHE_TIMEOUT = 5
+API_AUTH_LOCAL_CACHE_SIZE = 4096
+
+# Profile picture, validated then cropped and encoded to WebP in thread pool
+# size in bytes, dimension in pixels
+PROFILE_PICTURE_MAX_SIZE = int(2.5 * 1024 * 1024)
+PROFILE_PICTURE_ORIGINAL_MAX_SIZE = 10 * 1024 * 1024
+PROFILE_PICTURE_MAX_PIXELS = 40 * 1000 * 1000
+PROFILE_PICTURE_SIZE = 512
+PROFILE_PICTURE_ORIGINAL_SIZE = 1600
+PROFILE_PICTURE_QUALITY = 85
+PROFILE_PICTURE_WORKERS = 2
+PROFILE_PICTURE_TIMEOUT = 30
+
+
 # Django Rest Framework (DRF)
 # ------------------------------------------------------------------------------
 # https://www.django-rest-framework.org/
@@ -120,7 +229,7 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.SessionAuthentication',
         'rest_framework.authentication.BasicAuthentication',
-        'rest_framework_simplejwt.authentication.JWTAuthentication'
+        'apps.person.utils.auth.CachedJWTAuthentication'
     ],
     'DEFAULT_VERSIONING_CLASS': 'rest_framework.versioning.'
                                 'NamespaceVersioning',
@@ -133,6 +242,13 @@ REST_FRAMEWORK = {
 # https://docs.djangoproject.com/en/3.0/topics/email/
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 
+# Queued email sent in batch over one SMTP connection per worker
+# MAIL_BATCH_WINDOW in seconds
+MAIL_BATCH_WINDOW = 1
+MAIL_BATCH_SIZE = 100
+MAIL_MAX_BATCHES = 50
+MAIL_MAX_ATTEMPTS = 3
+
 
 # Channels
 ASGI_APPLICATION = 'openpeo.routing.application'
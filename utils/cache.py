@@ -0,0 +1,146 @@
+import time
+import threading
+
+from collections import OrderedDict
+
+from django.core.cache import cache
+
+
+class LRUCache:
+    """
+    Small in-process LRU cache with expiry.
+    Each worker process has its own copy, so keep timeout short
+    and use shared cache (Redis) as source of truth.
+    """
+    def __init__(self, maxsize=1024, timeout=30):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+
+            value, expire_at = item
+            if expire_at <= time.monotonic():
+                del self._data[key]
+                return default
+
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + timeout)
+            self._data.move_to_end(key)
+
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def delete_matching(self, predicate):
+        """Delete every entry where predicate(key, value) is True"""
+        with self._lock:
+            keys = [key for key, (value, expire_at) in self._data.items()
+                    if predicate(key, value)]
+            for key in keys:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class TwoLevelCache:
+    """
+    In-process LRU in front of the shared cache (Redis).
+
+    Every entry tagged with the version of its key, kept in shared cache
+    and bumped by `delete`. Local hit still read the version (one small
+    value, no unpickle), so delete seen by every process at once.
+    Value loaded before delete stored with old version and ignored.
+
+    `version_timeout` (seconds) trust local copy that long after its version
+    checked, no Redis read meanwhile. Delete seen by other process within it.
+    """
+    def __init__(self, prefix, timeout=300, local_timeout=5, local_maxsize=1024,
+                 version_timeout=0):
+        self.prefix = prefix
+        self.timeout = timeout
+        self.version_timeout = version_timeout
+        self.local = LRUCache(maxsize=local_maxsize, timeout=local_timeout)
+
+    def _set_local(self, key, item):
+        # [version, value, version checked at]
+        self.local.set(key, [item[0], item[1], time.monotonic()])
+
+    def make_key(self, key):
+        return '%s:%s' % (self.prefix, key)
+
+    def make_version_key(self, key):
+        return '%s:%s:version' % (self.prefix, key)
+
+    def get_versioned(self, key):
+        """:return: (value or None, current version)"""
+        key, version_key = self.make_key(key), self.make_version_key(key)
+
+        item = self.local.get(key)
+        if item is not None:
+            now = time.monotonic()
+            if now - item[2] < self.version_timeout:
+                return item[1], item[0]
+
+            version = cache.get(version_key, 0)
+            if item[0] == version:
+                item[2] = now
+                return item[1], version
+            self.local.delete(key)
+
+        values = cache.get_many([key, version_key])
+        version = values.get(version_key, 0)
+        item = values.get(key)
+        # not tuple: stored before entries were versioned
+        if not isinstance(item, tuple) or item[0] != version:
+            return None, version
+
+        self._set_local(key, item)
+        return item[1], version
+
+    def get(self, key, default=None):
+        value, version = self.get_versioned(key)
+        return default if value is None else value
+
+    def set(self, key, value, timeout=None, version=None):
+        """:version: from `get_versioned` before value loaded"""
+        if version is None:
+            version = cache.get(self.make_version_key(key), 0)
+
+        item = (version, value)
+        key = self.make_key(key)
+        cache.set(key, item, timeout=self.timeout if timeout is None else timeout)
+        self._set_local(key, item)
+
+    def get_or_set(self, key, load):
+        """Cached value, or `load()` result stored with version read before it"""
+        value, version = self.get_versioned(key)
+        if value is None:
+            value = load()
+            if value is not None:
+                self.set(key, value, version=version)
+        return value
+
+    def delete(self, key):
+        version_key = self.make_version_key(key)
+
+        # version never expire, reset to 0 would validate old copies
+        cache.add(version_key, 0, timeout=None)
+        cache.incr(version_key)
+        cache.delete(self.make_key(key))
+        self.local.delete(self.make_key(key))
@@ -0,0 +1,98 @@
+import time
+import logging
+
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+from rest_framework.throttling import BaseThrottle
+
+# All buckets refilled and checked, tokens taken only when every bucket
+# has one. Return seconds to wait as string (Lua number to Redis is integer).
+# KEYS: bucket keys
+# ARGV: now, then capacity and refill per second for each key
+_TAKE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local tokens = {}
+local wait = 0
+
+for i = 1, #KEYS do
+    local capacity = tonumber(ARGV[i * 2])
+    local rate = tonumber(ARGV[i * 2 + 1])
+    local bucket = redis.call('hmget', KEYS[i], 'tokens', 'timestamp')
+    local value = tonumber(bucket[1]) or capacity
+    local timestamp = tonumber(bucket[2]) or now
+
+    value = math.min(capacity, value + math.max(0, now - timestamp) * rate)
+    tokens[i] = value
+    if value < 1 then
+        wait = math.max(wait, (1 - value) / rate)
+    end
+end
+
+if wait > 0 then
+    return tostring(wait)
+end
+
+for i = 1, #KEYS do
+    local capacity = tonumber(ARGV[i * 2])
+    local rate = tonumber(ARGV[i * 2 + 1])
+    redis.call('hset', KEYS[i], 'tokens', tokens[i] - 1, 'timestamp', now)
+    redis.call('expire', KEYS[i], math.ceil(capacity / rate) + 1)
+end
+return '0'
+"""
+
+_script = None
+
+
+def take_tokens(buckets):
+    """
+    Take one token from each bucket in one round-trip.
+
+    :param buckets: list of (key, capacity, period in seconds),
+        bucket refilled `capacity` tokens every `period`
+    :return: seconds to wait, 0 if allowed
+    """
+    global _script
+
+    if not buckets:
+        return 0
+
+    keys = list()
+    args = [time.time()]
+    for key, capacity, period in buckets:
+        keys.append('token_bucket:%s' % key)
+        args.extend([capacity, capacity / period])
+
+    try:
+        if _script is None:
+            _script = get_redis_connection('default').register_script(_TAKE_SCRIPT)
+        return float(_script(keys=keys, args=args))
+    except RedisError as e:
+        # limiter down must not take the endpoint down
+        logging.warning('Token bucket not checked: %s' % e)
+        return 0
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Throttle with Redis token bucket. Subclass set `scope` and `rate`
+    as (capacity, period in seconds), or override `get_buckets`
+    to limit by more than client IP.
+    """
+    scope = None
+    rate = None
+
+    def get_buckets(self, request, view):
+        if self.rate is None:
+            return []
+
+        capacity, period = self.rate
+        return [('%s:ip:%s' % (self.scope, self.get_ident(request)), capacity, period)]
+
+    def allow_request(self, request, view):
+        self._wait = take_tokens(self.get_buckets(request, view))
+        return self._wait == 0
+
+    def wait(self):
+        return self._wait
@@ -0,0 +1,55 @@
+from contextlib import contextmanager
+from unittest import mock
+
+import fakeredis
+
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test import TestCase, override_settings
+
+LOCMEM_CACHE = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+
+# modules calling `get_redis_connection` directly
+REDIS_MODULES = (
+    'utils.ratelimit',
+    'apps.person.utils.availability',
+    'apps.person.utils.mail',
+    'apps.person.utils.otp',
+    'apps.commerce.utils.events',
+    'apps.commerce.utils.push',
+)
+
+
+@contextmanager
+def execute_on_commit(using=DEFAULT_DB_ALIAS):
+    """
+    Run on_commit callbacks registered inside the block, TestCase
+    never commit. Callbacks of rolled back savepoint already dropped.
+    """
+    connection = connections[using]
+    start = len(connection.run_on_commit)
+    yield
+    for sids, func in connection.run_on_commit[start:]:
+        func()
+
+
+# one server for the whole run, registered Lua scripts keep working
+_redis = fakeredis.FakeStrictRedis()
+
+
+@override_settings(CACHES={'default': LOCMEM_CACHE, 'sessions': LOCMEM_CACHE})
+class RedisTestCase(TestCase):
+    """
+    Test without Redis server, in-memory Redis for `get_redis_connection`
+    and local memory for Django cache. Both emptied before each test.
+    """
+    def setUp(self):
+        super().setUp()
+        self.redis = _redis
+        self.redis.flushall()
+        cache.clear()
+
+        for module in REDIS_MODULES:
+            patcher = mock.patch('%s.get_redis_connection' % module, return_value=self.redis)
+            patcher.start()
+            self.addCleanup(patcher.stop)